@@ -1,5 +1,5 @@
 from advertisement_processing.attribution_utils import *
-from utils.html_utils import html_to_plaintext
+from utils.parsed_document import ParsedDocument
 import nltk
 import torch
 import re
@@ -12,8 +12,10 @@ logit_fn = torch.nn.Softmax(dim=1)
 regexp = re.compile('\\s\\s\\s+')
 
 def rationales(html, model, tokenizer):
-    text = html_to_plaintext(html, keep_paragraphs_only=True, trim_start=0,#Config.TRIM_LENGTH,
-                             lowercase=False, merge_whitespaces=False)
+    return rationales_from_text(ParsedDocument(html).paragraph_text, model, tokenizer)
+
+
+def rationales_from_text(text, model, tokenizer):
     result = generate_rationales(text, model, tokenizer)
     result = postprocess_rationales(result)
     return result
@@ -38,12 +40,14 @@ def generate_rationales(text, model,  tokenizer):
     if len(blocks) == 0:
         return None
 
-    attrs_complete = []
-    for block in blocks:
-        input_embeds = torch.unsqueeze(torch.index_select(embeddings, 0, torch.squeeze(block['input_ids']).to(device)), 0).requires_grad_(True).to(device)
-        attention_mask = block['attention_mask'].to(device)
+    blocks_embeds = [embed_input_ids(block['input_ids'], embeddings) for block in blocks]
+    attention_masks = [block['attention_mask'].to(device) for block in blocks]
+    baselines = [0 * input_embeds for input_embeds in blocks_embeds]
 
-        attrs = ig_attributions(input_embeds, attention_mask, 1, 0 * input_embeds, model, logit_fn, steps=Config.IG_SAMPLES)
+    blocks_attrs = ig_attributions_blocks(blocks_embeds, attention_masks, 1, baselines, model, logit_fn, steps=Config.IG_SAMPLES)
+
+    attrs_complete = []
+    for attrs in blocks_attrs:
         attrs_complete.extend(format_attrs(attrs))
 
     attributions = filter_attributions(attrs_complete, Config.ATTRS_TOP_PERCENT)
@@ -21,7 +21,8 @@ def gradient_attributions(inputs_embeds, attention_mask, target_idx, model, logi
 
     model.zero_grad()
     output = logit_fn(model(inputs_embeds=inputs_embeds, attention_mask=attention_mask).logits)[:, target_idx]
-    grads = torch.autograd.grad(output, inputs_embeds)[0]
+    # samples in a batch are independent, so the gradient of the sum is the per-sample gradient
+    grads = torch.autograd.grad(torch.sum(output), inputs_embeds)[0]
 
     if x_inputs:
         grads = grads * inputs_embeds
@@ -29,49 +30,93 @@ def gradient_attributions(inputs_embeds, attention_mask, target_idx, model, logi
     return grads
 
 
-def ig_attributions(inputs_embeds, attention_mask, target_idx, baseline, model, logit_fn, steps=50, method='trapezoid'):
+def ig_attributions(inputs_embeds, attention_mask, target_idx, baseline, model, logit_fn, steps=50, method='trapezoid', batch_size=None):
     """
     Generates Integrated Gradients attributions for a sample
+
+    The interpolation steps are evaluated in batches of batch_size samples and the weighted gradients
+    are summed into a single buffer on the device
     :param inputs_embeds: input embeddings
     :param attention_mask: attention mask
     :param target_idx: taget index in the model output
     :param baseline: what baseline to use as a starting point for the interpolation
     :param model: model
     :param steps: number of interpolation steps
+    :param method: 'trapezoid' or anything else for Gauss-Legendre quadrature
+    :param batch_size: number of interpolation steps per forward pass, Config.IG_BATCH_SIZE if None
     :return:
     """
+    if batch_size is None:
+        batch_size = Config.IG_BATCH_SIZE
 
-    if method == 'trapezoid':
-        interpolated_samples = _ig_interpolate_samples(baseline, inputs_embeds, steps)
-        gradients = torch.tensor([])
-        for sample in interpolated_samples:
-            sample = sample.to(device)
-            grads = gradient_attributions(sample, attention_mask, target_idx, model, logit_fn).to('cpu')
-            gradients = torch.cat((gradients, grads), dim=0)
-
-        gradients = (gradients[:-1] + gradients[1:]) / 2.0
-        average_gradients = torch.mean(gradients, dim=0)
-        integrated_gradients = (inputs_embeds - baseline) * average_gradients.to(device)
-
-        return integrated_gradients
-    else:
-        # scale the [-1, 1] interval to [0, 1]
-        weights = list(0.5 * np.polynomial.legendre.leggauss(steps)[1])
-        alphas = list(0.5 * (1 + np.polynomial.legendre.leggauss(steps)[0]))
+    return ig_attributions_blocks([inputs_embeds], [attention_mask], target_idx, [baseline], model, logit_fn,
+                                  steps=steps, method=method, max_batch_tokens=batch_size * inputs_embeds.shape[1])[0]
 
-        interpolated_samples = [(baseline + alpha * (inputs_embeds - baseline)).to('cpu') for alpha in alphas]
-        total_grads = 0
-        for i, sample in enumerate(interpolated_samples):
-            sample = sample.to(device)
-            grads = gradient_attributions(sample, attention_mask, target_idx, model, logit_fn).to('cpu')
-            total_grads += grads * weights[i]
 
-        integrated_gradients = (inputs_embeds - baseline) * total_grads.to(device)
-        return integrated_gradients
+def ig_attributions_blocks(blocks_embeds, attention_masks, target_idx, baselines, model, logit_fn, steps=50, method='trapezoid', max_batch_tokens=None):
+    """
+    Generates Integrated Gradients attributions for several samples at once
 
+    The interpolation steps of all samples are packed into shared batches, padded to the longest sample,
+    so that a batch holds at most max_batch_tokens tokens (but always at least one step)
+    :param blocks_embeds: list of input embeddings of shape (1, length, embedding size)
+    :param attention_masks: list of attention masks of shape (1, length)
+    :param target_idx: taget index in the model output
+    :param baselines: list of baselines, one per sample
+    :param model: model
+    :param steps: number of interpolation steps
+    :param method: 'trapezoid' or anything else for Gauss-Legendre quadrature
+    :param max_batch_tokens: token budget of a single forward pass, Config.IG_MAX_BATCH_TOKENS if None
+    :return: list of attributions, one per sample
+    """
+    if max_batch_tokens is None:
+        max_batch_tokens = Config.IG_MAX_BATCH_TOKENS
+
+    blocks_embeds = [inputs_embeds.detach().to(device) for inputs_embeds in blocks_embeds]
+    baselines = [baseline.detach().to(device) for baseline in baselines]
+    attention_masks = [attention_mask.to(device) for attention_mask in attention_masks]
+    differences = [inputs_embeds - baseline for inputs_embeds, baseline in zip(blocks_embeds, baselines)]
+    alphas, weights = _ig_alphas_weights(steps, method)
+
+    max_length = max(inputs_embeds.shape[1] for inputs_embeds in blocks_embeds)
+    batch_size = max(1, max_batch_tokens // max_length)
+    total_grads = [torch.zeros_like(inputs_embeds[0]) for inputs_embeds in blocks_embeds]
+
+    # (sample, step) pairs, packed into batches in this order
+    work = [(block, step) for block in range(len(blocks_embeds)) for step in range(len(alphas))]
+    for i in range(0, len(work), batch_size):
+        items = work[i:i + batch_size]
+        samples = torch.zeros((len(items), max_length, blocks_embeds[0].shape[2]), device=device)
+        attention_mask = torch.zeros((len(items), max_length), dtype=attention_masks[0].dtype, device=device)
+        for row, (block, step) in enumerate(items):
+            length = blocks_embeds[block].shape[1]
+            samples[row, :length] = baselines[block][0] + alphas[step] * differences[block][0]
+            attention_mask[row, :length] = attention_masks[block][0]
+
+        grads = gradient_attributions(samples, attention_mask, target_idx, model, logit_fn)
+        for row, (block, step) in enumerate(items):
+            length = blocks_embeds[block].shape[1]
+            total_grads[block] += grads[row, :length] * weights[step]
+
+    return [difference * total for difference, total in zip(differences, total_grads)]
+
+
+def _ig_alphas_weights(steps, method):
+    """
+    Interpolation coefficients and their weights in the integral approximation
+    """
+    if method == 'trapezoid':
+        # averaging the gradients of neighbouring steps weights the endpoints by half
+        alphas = np.arange(steps + 1) / steps
+        weights = np.full(steps + 1, 1.0 / steps)
+        weights[0] = weights[-1] = 0.5 / steps
+    else:
+        # scale the [-1, 1] interval to [0, 1]
+        points, weights = np.polynomial.legendre.leggauss(steps)
+        alphas = 0.5 * (1 + points)
+        weights = 0.5 * weights
 
-def _ig_interpolate_samples(baseline, target, steps):
-    return [(baseline + (float(i) / steps) * (target - baseline)).to('cpu') for i in range(0, steps + 1)]
+    return torch.tensor(alphas, dtype=torch.float, device=device), torch.tensor(weights, dtype=torch.float, device=device)
 
 
 def format_attrs(attrs):
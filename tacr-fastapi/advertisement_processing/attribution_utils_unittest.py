@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+import torch
+import transformers
+
+from advertisement_processing.attribution_utils import ig_attributions, ig_attributions_blocks, gradient_attributions, device
+
+
+def reference_ig_attributions(inputs_embeds, attention_mask, target_idx, baseline, model, logit_fn, steps, method):
+    """
+    Integrated Gradients computed one interpolation step at a time
+    """
+    if method == 'trapezoid':
+        samples = [baseline + (float(i) / steps) * (inputs_embeds - baseline) for i in range(0, steps + 1)]
+        gradients = torch.cat([gradient_attributions(sample.detach(), attention_mask, target_idx, model, logit_fn) for sample in samples], dim=0)
+        gradients = (gradients[:-1] + gradients[1:]) / 2.0
+        return (inputs_embeds - baseline) * torch.mean(gradients, dim=0)
+
+    points, weights = np.polynomial.legendre.leggauss(steps)
+    total_grads = 0
+    for point, weight in zip(points, weights):
+        sample = baseline + 0.5 * (1 + point) * (inputs_embeds - baseline)
+        total_grads += gradient_attributions(sample.detach(), attention_mask, target_idx, model, logit_fn) * 0.5 * weight
+    return (inputs_embeds - baseline) * total_grads
+
+
+class IntegratedGradientsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        torch.manual_seed(0)
+        config = transformers.ElectraConfig(vocab_size=100, embedding_size=16, hidden_size=32, num_hidden_layers=2,
+                                            num_attention_heads=2, intermediate_size=64, num_labels=2)
+        cls.model = transformers.ElectraForSequenceClassification(config).to(device).eval()
+        cls.logit_fn = torch.nn.Softmax(dim=1)
+        cls.inputs_embeds = torch.randn((1, 40, 16), device=device)
+        cls.attention_mask = torch.ones((1, 40), dtype=torch.int, device=device)
+
+    def _assert_matches_reference(self, method, steps, batch_size):
+        baseline = 0 * self.inputs_embeds
+        expected = reference_ig_attributions(self.inputs_embeds, self.attention_mask, 1, baseline, self.model, self.logit_fn, steps, method)
+        actual = ig_attributions(self.inputs_embeds, self.attention_mask, 1, baseline, self.model, self.logit_fn,
+                                 steps=steps, method=method, batch_size=batch_size)
+
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertTrue(torch.allclose(actual, expected, rtol=1e-4, atol=1e-7))
+
+    def test_trapezoid(self):
+        self._assert_matches_reference('trapezoid', 25, 13)
+
+    def test_trapezoid_uneven_batches(self):
+        self._assert_matches_reference('trapezoid', 25, 4)
+
+    def test_gauss_legendre(self):
+        self._assert_matches_reference('gausslegendre', 25, 13)
+
+    def test_blocks_of_different_lengths(self):
+        blocks_embeds = [self.inputs_embeds, self.inputs_embeds[:, :17]]
+        attention_masks = [self.attention_mask, self.attention_mask[:, :17]]
+        baselines = [0 * inputs_embeds for inputs_embeds in blocks_embeds]
+
+        actual = ig_attributions_blocks(blocks_embeds, attention_masks, 1, baselines, self.model, self.logit_fn,
+                                        steps=25, max_batch_tokens=7 * 40)
+        for inputs_embeds, attention_mask, baseline, attrs in zip(blocks_embeds, attention_masks, baselines, actual):
+            expected = reference_ig_attributions(inputs_embeds, attention_mask, 1, baseline, self.model, self.logit_fn, 25, 'trapezoid')
+            self.assertEqual(attrs.shape, expected.shape)
+            self.assertTrue(torch.allclose(attrs, expected, rtol=1e-4, atol=1e-7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import torch
+
+from advertisement_processing.model_utils import pad_blocks
+from api.executors import PoolSaturated
+
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+class BlockBatcher:
+    """
+    Coalesces blocks from concurrent classification requests into batched forward passes.
+
+    Blocks are queued by predict(). A single worker task takes the first waiting block, keeps collecting
+    further blocks until either max_batch_size blocks are waiting or max_delay seconds have passed,
+    pads them into one batch, runs the model off the event loop and resolves each block's future
+    with its prediction.
+    """
+
+    def __init__(self, model, pad_token_id, max_batch_size, max_delay, pool=None, max_queued=None):
+        """
+        :param model: classification model
+        :param pad_token_id: id of the padding token
+        :param max_batch_size: maximum number of blocks in a single forward pass
+        :param max_delay: maximum time in seconds to wait for more blocks once the first one arrives
+        :param pool: ExecutionPool running the forward passes, counted against its pending tasks; the default loop
+            executor if None
+        :param max_queued: maximum number of waiting blocks, further requests are rejected with PoolSaturated; unbounded if None
+        """
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.pool = pool
+        self.max_queued = max_queued
+        self.queue = None
+        self.worker = None
+
+    async def predict(self, blocks):
+        """
+        Schedules the blocks for classification and waits for their predictions
+        :param blocks: blocks produced by split_into_blocks
+        :return: list of predicted classes, one per block
+        :raises PoolSaturated: if the blocks would exceed max_queued waiting blocks; a page of more blocks than that
+            is only admitted to an empty queue
+        """
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self._run())
+
+        queued = self.queue.qsize()
+        if self.max_queued is not None and queued and queued + len(blocks) > self.max_queued:
+            raise PoolSaturated('classification')
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for block in blocks:
+            future = loop.create_future()
+            self.queue.put_nowait((block, future))
+            futures.append(future)
+
+        return list(await asyncio.gather(*futures))
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _predict_batch(self, blocks):
+        if self.pool is not None:
+            return await self.pool.run(self._forward, blocks)
+        return await asyncio.get_running_loop().run_in_executor(None, self._forward, blocks)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            blocks = [block for block, _ in batch]
+            try:
+                predictions = await self._predict_batch(blocks)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), prediction in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(prediction)
+
+    def _forward(self, blocks):
+        input_ids, attention_mask = pad_blocks(blocks, self.pad_token_id)
+        with torch.inference_mode():
+            logits = self.model(input_ids=input_ids.to(device), attention_mask=attention_mask.to(device)).logits
+
+        return torch.argmax(logits, dim=1).tolist()
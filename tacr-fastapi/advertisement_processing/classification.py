@@ -1,27 +1,119 @@
+from collections import deque
+
 import torch
-from utils.html_utils import html_to_plaintext
-from utils.document_similarity import document_to_minhash
-from advertisement_processing.model_utils import get_cls_sep, split_into_blocks
+from transformers import BatchEncoding
+from utils.parsed_document import ParsedDocument
+from advertisement_processing.model_utils import get_cls_sep, split_into_blocks, pad_blocks
+from api.config import Config
 
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
 
-def classify(html, model, tokenizer):
+def text_to_blocks(text, tokenizer):
     cls_token_index, sep_token_index = get_cls_sep(tokenizer)
 
-    text = html_to_plaintext(html, lowercase=False)
-
     encoded = tokenizer(text, add_special_tokens=False)
 
-    blocks = split_into_blocks(encoded, cls_token_index, sep_token_index, 510)
+    return split_into_blocks(encoded, cls_token_index, sep_token_index, 510)
+
+
+def ids_to_blocks(input_ids, tokenizer):
+    """
+    Same as text_to_blocks for a text tokenized before, e.g. in another process
+    :param input_ids: token ids of the text without special tokens
+    """
+    cls_token_index, sep_token_index = get_cls_sep(tokenizer)
+    encoded = BatchEncoding({'input_ids': input_ids})
+
+    return split_into_blocks(encoded, cls_token_index, sep_token_index, 510)
+
+
+def predict_blocks(blocks, model, pad_token_id, chunk_size):
+    """
+    Classifies the blocks in padded chunks of chunk_size blocks
+
+    Stops after the first chunk containing a positive block, as a single positive block decides the page
+    :return: predictions for the blocks up to and including the decisive chunk
+    """
+    predictions = []
+    with torch.inference_mode():
+        for i in range(0, len(blocks), chunk_size):
+            input_ids, attention_mask = pad_blocks(blocks[i:i + chunk_size], pad_token_id)
+            logits = model(input_ids=input_ids.to(device), attention_mask=attention_mask.to(device)).logits
+            predictions.extend(torch.argmax(logits, dim=1).tolist())
+            if sum(predictions) >= 1:
+                break
+
+    return predictions
+
+
+def texts_to_blocks(texts, tokenizer):
+    return [text_to_blocks(text, tokenizer) for text in texts]
+
+
+def predict_pages(pages_blocks, model, pad_token_id, batch_size):
+    """
+    Classifies the blocks of several pages together in padded batches of up to batch_size blocks
+
+    The blocks are taken page by page; once a block of a page is positive, the rest of its blocks are skipped
+    :param pages_blocks: list of the blocks of each page
+    :return: classification of each page, None for pages without blocks
+    """
+    classes = [False if len(blocks) > 0 else None for blocks in pages_blocks]
+    pending = deque((page, block) for page, blocks in enumerate(pages_blocks) for block in blocks)
+    with torch.inference_mode():
+        while pending:
+            batch = []
+            while pending and len(batch) < batch_size:
+                page, block = pending.popleft()
+                if not classes[page]:
+                    batch.append((page, block))
+            if not batch:
+                break
+
+            input_ids, attention_mask = pad_blocks([block for _, block in batch], pad_token_id)
+            logits = model(input_ids=input_ids.to(device), attention_mask=attention_mask.to(device)).logits
+            for (page, _), prediction in zip(batch, torch.argmax(logits, dim=1).tolist()):
+                if prediction == 1:
+                    classes[page] = True
+
+    return classes
+
+
+def classify(html, model, tokenizer):
+    document = ParsedDocument(html)
+    blocks = text_to_blocks(document.text, tokenizer)
+    if len(blocks) == 0:
+        return None, None
+
+    predictions = predict_blocks(blocks, model, tokenizer.pad_token_id, Config.CLASSIFY_CHUNK_SIZE)
+
+    print(predictions)
+    return sum(predictions) >= 1, document.minhash
+
+
+async def classify_batched(document, tokenizer, batcher, inference_pool=None, chunk_size=None):
+    """
+    Same as classify for a ParsedDocument, but the blocks are classified by a BlockBatcher together with blocks
+    of concurrent requests
+
+    The blocks are submitted in chunks of chunk_size (Config.CLASSIFY_CHUNK_SIZE if None) and the rest are skipped
+    once a chunk contains a positive block, as in predict_blocks
+    Tokenization runs in inference_pool (api.executors.ExecutionPool), or inline if it is None
+    """
+    if inference_pool is None:
+        blocks = text_to_blocks(document.text, tokenizer)
+    else:
+        blocks = await inference_pool.run(text_to_blocks, document.text, tokenizer)
     if len(blocks) == 0:
-        return None
+        return None, None
 
+    chunk_size = chunk_size or Config.CLASSIFY_CHUNK_SIZE
     predictions = []
-    for block in blocks:
-        logits = model(input_ids=block['input_ids'].to(device), attention_mask=block['attention_mask'].to(device)).logits
-        pred = int(torch.argmax(logits, dim=1))
-        predictions.append(pred)
+    for i in range(0, len(blocks), chunk_size):
+        predictions.extend(await batcher.predict(blocks[i:i + chunk_size]))
+        if sum(predictions) >= 1:
+            break
 
     print(predictions)
-    return sum(predictions) >= 1, document_to_minhash(text)
+    return sum(predictions) >= 1, document.minhash
@@ -34,4 +34,22 @@ def split_into_blocks(encoding, cls_token_index, sep_token_index, block_size):
                 'attention_mask': torch.tensor([[1 for _ in range(len(input_ids))]], dtype=torch.int)
             })
 
-    return blocks
\ No newline at end of file
+    return blocks
+
+
+def pad_blocks(blocks, pad_token_id):
+    """
+    Stacks blocks produced by split_into_blocks into a single right-padded batch
+    :param blocks: list of blocks, each with 'input_ids' of shape (1, length)
+    :param pad_token_id: id of the padding token
+    :return: input_ids and attention_mask of shape (len(blocks), max length)
+    """
+    max_length = max(block['input_ids'].shape[1] for block in blocks)
+    input_ids = torch.full((len(blocks), max_length), pad_token_id, dtype=torch.int)
+    attention_mask = torch.zeros((len(blocks), max_length), dtype=torch.int)
+    for i, block in enumerate(blocks):
+        length = block['input_ids'].shape[1]
+        input_ids[i, :length] = block['input_ids'][0]
+        attention_mask[i, :length] = 1
+
+    return input_ids, attention_mask
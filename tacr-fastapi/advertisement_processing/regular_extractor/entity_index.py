@@ -0,0 +1,91 @@
+import functools
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+
+@functools.lru_cache(maxsize=64)
+def lowercase_set(words: tuple[str, ...]) -> frozenset[str]:
+    """
+    The words lowercased, computed once for each black list
+    """
+    return frozenset(word.lower() for word in words)
+
+
+class EntityIndex:
+    """
+    Spans of the named entities of a document grouped by type, each group sorted by start index, for finding the
+    entities starting in a range and the one starting closest to a position by bisection.
+
+    Results are in the order of the indexed entities and ties in distance go to the entity that comes first, as
+    when searching the list of entities from the start.
+    """
+
+    def __init__(self, entities: list):
+        """
+        :param entities: objects with type, start_index and text, e.g. NamedEntity
+        """
+        self.entities = entities
+        # texts compared with the black lists
+        self.keys = [entity.text.lower().strip() for entity in entities]
+
+        groups = defaultdict(list)
+        for position, entity in enumerate(entities):
+            groups[entity.type].append(position)
+        self.positions = {}
+        self.starts = {}
+        for entity_type, positions in groups.items():
+            positions.sort(key=lambda position: entities[position].start_index)
+            self.positions[entity_type] = positions
+            self.starts[entity_type] = [entities[position].start_index for position in positions]
+
+    def _bounds(self, entity_type: str, start: int, end: int) -> tuple[list[int], list[int], int, int]:
+        """
+        :return: positions and starts of the entities of the type, and the bounds of those starting in [start, end)
+        """
+        starts = self.starts.get(entity_type, [])
+        return self.positions.get(entity_type, []), starts, bisect_left(starts, start), bisect_left(starts, end)
+
+    def in_range(self, types: list[str], start: int, end: int, black_list: list[str] = ()) -> list:
+        """
+        :return: entities of the types starting in [start, end) whose text is not in the black list
+        """
+        black_list = lowercase_set(tuple(black_list))
+        found = []
+        for entity_type in set(types):
+            positions, _, first, last = self._bounds(entity_type, start, end)
+            found += [position for position in positions[first:last] if self.keys[position] not in black_list]
+        return [self.entities[position] for position in sorted(found)]
+
+    def closest(self, types: list[str], position: int, start: int, end: int, black_list: list[str] = ()):
+        """
+        :return: entity of the types starting in [start, end), not in the black list, whose start is the closest to
+            the position, None if there is none
+        """
+        black_list = lowercase_set(tuple(black_list))
+        best = None
+        for entity_type in set(types):
+            positions, starts, first, last = self._bounds(entity_type, start, end)
+            pivot = min(max(bisect_right(starts, position), first), last)
+
+            # nearest entity starting after the position
+            for i in range(pivot, last):
+                if self.keys[positions[i]] not in black_list:
+                    candidate = (abs(starts[i] - position), positions[i])
+                    best = candidate if best is None else min(best, candidate)
+                    break
+
+            # nearest entity starting at or before it, the first one of those starting at the same token
+            i = pivot - 1
+            while i >= first and self.keys[positions[i]] in black_list:
+                i -= 1
+            if i >= first:
+                nearest = positions[i]
+                for j in range(i - 1, first - 1, -1):
+                    if starts[j] != starts[i]:
+                        break
+                    if self.keys[positions[j]] not in black_list:
+                        nearest = positions[j]
+                candidate = (abs(starts[i] - position), nearest)
+                best = candidate if best is None else min(best, candidate)
+
+        return self.entities[best[1]] if best is not None else None
@@ -0,0 +1,127 @@
+import random
+import unittest
+
+import conllu
+
+from advertisement_processing.regular_extractor.entity_index import EntityIndex
+from advertisement_processing.regular_extractor.nlp_backend import NlpBackend
+from advertisement_processing.regular_extractor.text_processor import NamedEntity, TextProcessor
+
+TYPES = ['if', 'io', 'A']
+TEXTS = ['Alza.cz a.s.', 'Správce ', 'EU', 'Google Ireland Ltd']
+BLACK_LIST = ['správce', 'EU']
+
+# entity types of the parsed tokens, 'gu' is never searched for
+BACKEND_TYPES = ['if', 'io', 'A', 'gu']
+
+
+def random_entities(rng):
+    """
+    Entities in the order TextProcessor finds them, by their first token, several of them possibly starting at the
+    same token
+    """
+    entities = []
+    start = 0
+    for _ in range(rng.randint(0, 40)):
+        start += rng.choice([0, 0, 1, 2, 5])
+        entities.append(NamedEntity(type=rng.choice(TYPES), start_index=start, end_index=start + rng.randint(0, 3),
+                                    tokens=[], text=rng.choice(TEXTS)))
+    return entities
+
+
+def scan(entities, types, start, end, black_list):
+    black_list = [word.lower() for word in black_list]
+    return [entity for entity in entities if start <= entity.start_index < end and entity.type in types and
+            entity.text.lower().strip() not in black_list]
+
+
+class RandomEntityBackend(NlpBackend):
+    """
+    Sentences of random tokens, some of them in named entities of random types spanning a few tokens
+    """
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+
+    def parse(self, texts):
+        entity_ids = iter(range(1, 10000))
+        parsed = []
+        for _ in texts:
+            sentences = []
+            for _ in range(self.rng.randint(0, 3)):
+                tokens = []
+                labels = []
+                for i in range(1, self.rng.randint(1, 12)):
+                    labels = [label for label in labels if self.rng.random() < 0.7]
+                    if self.rng.random() < 0.3:
+                        labels.append(f'{self.rng.choice(BACKEND_TYPES)}_{next(entity_ids)}')
+                    misc = {'NE': '-'.join(labels)} if labels else None
+                    if self.rng.random() < 0.3:
+                        misc = dict(misc or {}, SpaceAfter='No')
+                    form = self.rng.choice(['Alza', 'Praha', 'a', 's', 'EU', '.'])
+                    tokens.append(conllu.Token({'id': i, 'form': form, 'lemma': form.lower(), 'misc': misc}))
+                sentences.append(conllu.TokenList(tokens))
+            parsed.append(sentences)
+        return parsed
+
+
+def scan_named_entities(text_processor, entity_type, start_range, end_range, black_list):
+    """
+    Token by token search of named entities as find_all_named_entities used to do it
+    """
+    black_list = [token.lower() for token in black_list]
+    named_entities = []
+    for i in range(start_range, end_range):
+        token = text_processor.flattened_tokens[i]
+        if token['misc'] and 'NE' in token['misc']:
+            if any(entity.split('_')[0] in entity_type for entity in token['misc']['NE'].split('-')):
+                named_entities.append(i)
+    return [entity for entity in text_processor.named_entities if entity.start_index in named_entities and
+            entity.type in entity_type and entity.text.lower().strip() not in black_list]
+
+
+class EntityIndexTest(unittest.TestCase):
+    def test_closest_prefers_first_on_ties(self):
+        entities = [NamedEntity('if', 2, 2, [], 'a'), NamedEntity('io', 6, 6, [], 'b'),
+                    NamedEntity('if', 6, 7, [], 'c'), NamedEntity('if', 10, 10, [], 'Správce')]
+        index = EntityIndex(entities)
+        self.assertIs(index.closest(['if', 'io'], 4, 0, 20), entities[0])
+        self.assertIs(index.closest(['if', 'io'], 5, 0, 20), entities[1])
+        self.assertIs(index.closest(['if'], 5, 0, 20), entities[2])
+        self.assertIs(index.closest(['if'], 10, 0, 20), entities[3])
+        self.assertIs(index.closest(['if'], 10, 0, 20, ['správce']), entities[2])
+        self.assertIsNone(index.closest(['if'], 5, 3, 6))
+        self.assertIsNone(index.closest(['A'], 5, 0, 20))
+
+    def test_same_as_scan(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            entities = random_entities(rng)
+            index = EntityIndex(entities)
+            for _ in range(20):
+                types = rng.sample(TYPES, rng.randint(1, 3))
+                start = rng.randint(0, 60)
+                end = start + rng.randint(0, 60)
+                position = rng.randint(-5, 130)
+                black_list = rng.choice([[], BLACK_LIST])
+
+                found = scan(entities, types, start, end, black_list)
+                self.assertEqual(index.in_range(types, start, end, black_list), found)
+                closest = min(found, key=lambda entity: abs(entity.start_index - position)) if found else None
+                self.assertIs(index.closest(types, position, start, end, black_list), closest)
+
+    def test_named_entities_same_as_scan(self):
+        for seed in range(50):
+            text_processor = TextProcessor('test', RandomEntityBackend(seed))
+            text_processor.process([{'id': i, 'tag': 'p', 'text': ''} for i in range(5)])
+            n = len(text_processor.flattened_tokens)
+            for types in [['if', 'io'], ['A'], ['x']]:
+                for start in range(0, n, 3):
+                    for end in [start, start + 5, n]:
+                        end = min(end, n)
+                        self.assertEqual(text_processor.find_all_named_entities(types, start, end, ['Praha ']),
+                                         scan_named_entities(text_processor, types, start, end, ['Praha ']))
+
+
+if __name__ == '__main__':
+    unittest.main()
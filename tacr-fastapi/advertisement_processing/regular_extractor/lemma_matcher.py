@@ -0,0 +1,132 @@
+from bisect import bisect_left
+from typing import Optional
+
+import numpy as np
+
+from .token_store import TokenStore
+
+# lemma ending the search of the next lemma of a pattern matched within a sentence
+SENTENCE_END = '.'
+
+
+class LemmaIndex:
+    """
+    Inverted index of the lemmas of a document, finding the lemma patterns of TextProcessor.find_start_reg without
+    trying every token position.
+
+    Each lemma id of the token store maps to the sorted positions of its tokens. A pattern is tried only at the
+    occurrences of its first lemma, and each following lemma is found by bisecting its positions, so matching costs about the number of
+    occurrences of the first lemma instead of the length of the document. The matches are exactly those of
+    TextProcessor._check_lemma_sequence and _check_lemma_in_sentence, including their end indices.
+    """
+
+    def __init__(self, tokens: TokenStore):
+        self.tokens = tokens
+        self.lemma_ids = tokens.lemma_ids
+        self.sentence_end_id = tokens.id(SENTENCE_END)
+        order = np.argsort(tokens.lemma_ids, kind='stable')
+        lemma_ids, first = np.unique(tokens.lemma_ids[order], return_index=True)
+        self.positions = {lemma_id: positions.tolist()
+                          for lemma_id, positions in zip(lemma_ids.tolist(), np.split(order, first[1:]))}
+
+    @staticmethod
+    def compile(lemma_list: list[str]) -> Optional[list[tuple[str, Optional[int]]]]:
+        """
+        Returns the (lemma, gap) elements of a strict pattern, gap being the maximum number of arbitrary tokens
+        before the lemma or None if the lemma directly follows the previous one. None if the pattern starts or ends
+        with a gap or has two gaps in a row, which only the token by token scan handles.
+        """
+        elements = []
+        gap = None
+        for lemma in lemma_list:
+            if lemma.startswith('*'):
+                if gap is not None or not elements:
+                    return None
+                gap = int(lemma[1:])
+            else:
+                elements.append((lemma, gap))
+                gap = None
+        if gap is not None:
+            return None
+        return elements
+
+    def next_position(self, lemma_id: int, start: int) -> Optional[int]:
+        """
+        :return: position of the first token of the lemma at or after start, None if there is none
+        """
+        positions = self.positions.get(lemma_id)
+        if positions is None:
+            return None
+        i = bisect_left(positions, start)
+        return positions[i] if i < len(positions) else None
+
+    def find(self, lemma_list: list[str], from_index: int, to_index: int,
+             method: str = "strict") -> Optional[tuple[list[int], list[int]]]:
+        """
+        Finds the matches of the pattern starting between from_index and to_index - len(lemma_list).
+        :param method: "sentence" to match the lemmas in order within a sentence, "strict" for the *n gaps
+        :returns: starts and ends of the matches as find_start_reg returns them, None if the pattern is not supported
+        """
+        if not lemma_list:
+            return None
+        if method == "sentence":
+            match = self._match_in_sentence
+            elements = [self.tokens.id(lemma) for lemma in lemma_list]
+        else:
+            match = self._match_sequence
+            elements = self.compile(lemma_list)
+            if elements is None:
+                return None
+            elements = [(self.tokens.id(lemma), gap) for lemma, gap in elements]
+
+        positions = self.positions.get(self.tokens.id(lemma_list[0]), [])
+        first = bisect_left(positions, from_index)
+        last = bisect_left(positions, to_index - len(lemma_list) + 1)
+
+        starts = []
+        ends = []
+        for start in positions[first:last]:
+            end = match(start, elements)
+            if end is not None:
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
+
+    def _match_sequence(self, start: int, elements: list[tuple[int, Optional[int]]]) -> Optional[int]:
+        """
+        :return: position of the lemma after the last gap, 0 without gaps, None if the pattern does not match
+        """
+        position = start
+        end = 0
+        for lemma_id, gap in elements[1:]:
+            if gap is None:
+                position += 1
+                if position >= len(self.lemma_ids) or self.lemma_ids[position] != lemma_id:
+                    return None
+            else:
+                found = self.next_position(lemma_id, position + 1)
+                if found is None or found > position + 1 + gap:
+                    return None
+                position = end = found
+
+        # the token by token scan gives up on a match ending at the last token
+        if position + 1 >= len(self.lemma_ids):
+            return None
+        return end
+
+    def _match_in_sentence(self, start: int, lemma_ids: list[int]) -> Optional[int]:
+        """
+        :return: position of the last lemma, None if the pattern does not match
+        """
+        position = start
+        for lemma_id in lemma_ids[1:]:
+            # the search starts at the previous lemma, so a repeated lemma matches the same token
+            found = self.next_position(lemma_id, position)
+            if found is None:
+                return None
+            if found > position:
+                sentence_end = self.next_position(self.sentence_end_id, position + 1)
+                if sentence_end is not None and sentence_end <= found:
+                    return None
+            position = found
+        return position
@@ -0,0 +1,72 @@
+import random
+import unittest
+
+from advertisement_processing.regular_extractor.lemma_matcher import LemmaIndex
+from advertisement_processing.regular_extractor.text_processor import TextProcessor
+from advertisement_processing.regular_extractor.token_store import TokenStore
+
+VOCABULARY = ['osobní', 'údaj', 'zpracovávat', 'po', 'doba', 'být', 'právo', 'výmaz', 'jméno', '.', ',', 'a', 'vy']
+
+PATTERNS = [
+    ['osobní', '*3', 'údaj', '*3', 'zpracovávat', '*3', 'po', '*3', 'doba'],
+    ['právo', '*2', 'výmaz'],
+    ['osobní', 'údaj', '*2', 'výmaz'],
+    ['být', '*4', 'po', '*3', 'doba'],
+    ['osobní', 'údaj'],
+    ['doba'],
+    ['po', '*0', 'doba', 'a'],
+]
+
+SENTENCE_PATTERNS = [
+    ['zpracovávat', 'jméno'],
+    ['osobní', 'údaj', 'jméno'],
+    ['osobní', 'osobní', 'údaj'],
+    ['vy', '.'],
+]
+
+
+def text_processor(lemmas):
+    processor = TextProcessor('test')
+    processor.flattened_tokens = [{'lemma': lemma, 'form': lemma, 'misc': None} for lemma in lemmas]
+    return processor
+
+
+def lemma_index(lemmas):
+    return LemmaIndex(TokenStore([[[{'lemma': lemma, 'form': lemma, 'misc': None} for lemma in lemmas]]]))
+
+
+class LemmaIndexTest(unittest.TestCase):
+    def assert_same_as_scan(self, lemmas, patterns, method, from_index=0, to_index=-1):
+        processor = text_processor(lemmas)
+        expected = [processor.find_start_reg(pattern, from_index, to_index, method) for pattern in patterns]
+        processor.lemma_index = lemma_index(lemmas)
+        found = [processor.find_start_reg(pattern, from_index, to_index, method) for pattern in patterns]
+        self.assertEqual(found, expected)
+
+    def test_gaps(self):
+        lemmas = 'vy osobní a údaj být zpracovávat a a po doba , právo výmaz .'.split()
+        index = lemma_index(lemmas)
+        self.assertEqual(index.find(PATTERNS[0], 0, len(lemmas)), ([1], [9]))
+        self.assertEqual(index.find(['právo', '*0', 'výmaz'], 0, len(lemmas)), ([11], [12]))
+        self.assertEqual(index.find(['osobní', '*1', 'zpracovávat'], 0, len(lemmas)), ([], []))
+
+    def test_unsupported_patterns(self):
+        index = lemma_index(['a', 'b'])
+        self.assertIsNone(index.find(['*1', 'a'], 0, 2))
+        self.assertIsNone(index.find(['a', '*1'], 0, 2))
+        self.assertIsNone(index.find(['a', '*1', '*2', 'b'], 0, 2))
+
+    def test_same_as_scan(self):
+        rng = random.Random(0)
+        for _ in range(300):
+            lemmas = [rng.choice(VOCABULARY) for _ in range(rng.randint(0, 60))]
+            self.assert_same_as_scan(lemmas, PATTERNS, "strict")
+            self.assert_same_as_scan(lemmas, SENTENCE_PATTERNS, "sentence")
+            from_index = rng.randint(0, len(lemmas))
+            to_index = rng.randint(from_index, len(lemmas))
+            self.assert_same_as_scan(lemmas, PATTERNS, "strict", from_index, to_index)
+            self.assert_same_as_scan(lemmas, SENTENCE_PATTERNS, "sentence", from_index, to_index)
+
+
+if __name__ == '__main__':
+    unittest.main()
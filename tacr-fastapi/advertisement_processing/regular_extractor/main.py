@@ -3,29 +3,32 @@ from collections import Counter, defaultdict
 import glob
 import os
 from .text_processor import LEMMATIZED_FOLDER, TextProcessor
+from .rules import DRUH, RULES, RuleMatches, druh_rule_name
 from collections import OrderedDict
 
 # from utils.html_utils import process_for_extraction
 
 BLACK_LIST = ["Evropského parlamentu", "Rady", "EU", "ES", "GDPR", "Pplk", "Úřadu pro ochranu osobních údajů", "Úřad pro ochranu osobních údajů", "Správce", "Provozovatel", "Vámi"]
 
-def extract_spravce(text_processor: TextProcessor):
-    input_texts = [
-        ['správce', '*1', 'osobní', 'údaj'],
-        ['zpracování', '*1', 'osobní', 'údaj'],
-        ['souhlas', '*1', 'zpracování', '*1', 'osobní', 'údaj', '*8', 'provozovatel']
-    ]
+def rule_matches(text_processor: TextProcessor, name: str, matches: dict[str, RuleMatches] = None) -> RuleMatches:
+    """
+    Returns the matches of the rule, evaluating it alone unless the matches of all rules are given
+    :param matches: result of RULES.evaluate for the text processor
+    """
+    if matches is None:
+        matches = RULES.evaluate(text_processor, [name])
+    return matches[name]
 
-    start_idxs = []
-    for text in input_texts:
-        starts, _ = text_processor.find_start_reg(text)
-        start_idxs += starts
+def sentences_with_contexts(match: RuleMatches):
+    return list(zip([sentence["text"] for sentence in match.sentences], match.contexts))
 
+def extract_spravce(text_processor: TextProcessor, matches: dict[str, RuleMatches] = None):
+    match = rule_matches(text_processor, "spravce", matches)
 
-    if start_idxs == []:
+    if match.starts == []:
         return None, None
 
-    start_idxs.sort()    
+    start_headings = sorted(zip(match.starts, match.headings), key=lambda start_heading: start_heading[0])
 
 
     # named_entities_of_type_A = [entity for entity in text_processor.named_entities if entity.type == "A"]
@@ -39,8 +42,7 @@ def extract_spravce(text_processor: TextProcessor):
     company = None
     first_company = None
     address = None
-    for start_idx in start_idxs:
-        range = text_processor.get_heading_for_token(start_idx)
+    for start_idx, range in start_headings:
         start_range = range[0]
         end_range = range[1]
         company = text_processor.find_closest_named_entity(["if","io"], start_range, start_range, end_range, BLACK_LIST) 
@@ -68,29 +70,16 @@ def extract_spravce(text_processor: TextProcessor):
 
     return first_company, address
 
-def extract_predavani(text_processor: TextProcessor):
+def extract_predavani(text_processor: TextProcessor, matches: dict[str, RuleMatches] = None):
+    match = rule_matches(text_processor, "predavani", matches)
 
-    input_texts = [
-        ['předávat', "*2", 'osobní', 'údaj'],
-        ['kdo', 'moci', '*2', 'údaj', '*3', 'zpřístupnit'],    # kdo moci údaj o vy zpřístupnit
-        ['příjemce', '*1', 'osobní', 'údaj'],  # příjemce osobní údaj
-    ]
-
-    start_idxs = []
-    end_lens = []
-    for text in input_texts:
-        starts, length = text_processor.find_start_reg(text)
-        start_idxs += starts
-        end_lens += length
-
-    if start_idxs == []:
+    if match.starts == []:
         return []
 
     # Locate company
     companies = []
 
-    for start_idx in start_idxs:
-        range = text_processor.get_heading_for_token(start_idx)
+    for range in match.headings:
         start_range = range[0]
         end_range = range[1]
 
@@ -106,13 +95,11 @@ def extract_predavani(text_processor: TextProcessor):
 
         return companies
     else:
-        ranges = [text_processor.get_heading_for_token(start_idx) for start_idx in start_idxs]
+        ranges = match.headings
         return list(zip(*([text_processor._conllu_to_text(text_processor.flattened_tokens[range[0]:range[1]]) for range in ranges], [text_processor.get_tokens_with_tags(text_processor.flattened_tokens[range[0]:range[1]]) for range in ranges])))
 
 
-def extract_druh(text_processor: TextProcessor):
-    found = []
-    tok_2 = "*3"
+def extract_druh(text_processor: TextProcessor, matches: dict[str, RuleMatches] = None):
     # Naše společnost zpracovává Vaše osobní údaje v rozsahu nezbytném pro naplnění výše uvedených účelů. Zpracováváme kontaktní údaje (kontaktní adresy, telefonní čísla, e-mailové a faxové adresy či jiné obdobné kontaktní údaje) a identifikační údaje (jméno, příjmení, datum narození, adresa trvalého pobytu, typ, číslo a platnost průkazu totožnosti; u klienta fyzické osoby – podnikatele také IČ a DIČ).
 
 # výkon práv a povinností vyplývajících ze smluvního vztahu mezi Vámi a správcem; při objednávce jsou vyžadovány osobní údaje, které jsou nutné pro úspěšné vyřízení objednávky (jméno a adresa, kontakt), poskytnutí osobních údajů je nutným požadavkem pro uzavření a plnění smlouvy, bez poskytnutí osobních údajů není možné smlouvu uzavřít či jí ze strany správce plnit, zasílání obchodních sdělení a činění dalších marketingových aktivit.
@@ -137,35 +124,13 @@ def extract_druh(text_processor: TextProcessor):
 # osobní údaj správce být zpracovávaný váš následující osobní údaj : jméno a příjmení , adresa , telefonní číslo , e - mail , v případ podnikající osoba IČ , DIČ ( dále jen " osobní údaj " ) účel zpracování účel zpracování osobní údaj být plnění právní povinnost správce vyplývající z obsah uzavřený smlouva mezi vy jako kupující a správce jako prodávající , a plnění právní povinnost správce vyplývající z obecně závazný právní předpis . příjemce osobní údaj osobní údaj zpracovávaný pro plnění povinnost vyplývající z zvláštní právní předpis správce moci v odůvodněný případ předat orgán činný v trestní řízení .
     ret = dict()
 
-    def search_for(key, regs: list):
-        regs_poss = list() 
-        
-        regs_poss.extend([["zpracovávat"] + r for r in regs])
-        regs_poss.extend([["osobní","údaj"] + r for r in regs])
-        regs_poss.extend([["ukládat"] + r for r in regs])
-        
-
-        regs = regs_poss
-        starts, ends = text_processor.find_all_reg(regs, method="sentence")
-        if len(starts) > 0:
-                sentences = text_processor.get_whole_sentence(starts+ends)
-
-                sentence_texts = [sentence["text"] for sentence in sentences]
-                contexts = [text_processor.get_tokens_with_tags(text_processor.flattened_tokens[sentence["range"][0]:sentence["range"][1]+1]) for sentence in sentences]
+    if matches is None:
+        matches = RULES.evaluate(text_processor, [druh_rule_name(key) for key in DRUH])
 
-                ret[key] = (sentence_texts, contexts)
-
-    search_for("Jméno",[["jméno"]])
-    search_for("Příjmení",[["příjmení"]])
-    search_for("Datum narození",[["datum","narození"]])
-    search_for("Adresa",[["adresa"]])
-    search_for("Průkaz",[["průkaz","totožnost"]])
-    search_for("IČ",[["IČ"]])
-    search_for("DIČ",[["DIČ"]])
-    search_for("Poloha",[["lokační","údaj"]])
-    search_for("SPZ",[["SPZ"]])
-    search_for("Podpis",[["podpis"]])
-    search_for("Datová schránka",[["datový","schránka"]])
+    for key in DRUH:
+        match = matches[druh_rule_name(key)]
+        if len(match.starts) > 0:
+            ret[key] = ([sentence["text"] for sentence in match.sentences], match.contexts)
 
     # SFDI nebo zpracovatel zpracovaný následující osobní údaj : SPZ , stát registrace vozidlo , v který být vozidlo registrovaný , osobní údaj o oznamovatel : jméno , příjmení , datum narození , adresa bydliště , úředně ověřený podpis nebo jeho ekvivalent ( číslo datový schránka nebo uznávaný elektronický podpis ) . Pppppe PPPPPS tento osobní údaj SFDI získávat přímo od vy nebo od třetí osoba , který zažádat o vrácení uhrazený časový poplatek 
 
@@ -193,7 +158,7 @@ def extract_druh(text_processor: TextProcessor):
 
 
 
-def extract_doba_zpracovani(text_processor: TextProcessor):
+def extract_doba_zpracovani(text_processor: TextProcessor, matches: dict[str, RuleMatches] = None):
     # budou vaše osobní údaje obecně zpracovávány po dobu 7 let
     # vaše osobní údaje budeme zpracovávat po dobu 7 let, popř. do doby vyslovení vašeho nesouhlasu s jejich dalším
     # Cookies: cookies zahrnující chování uživatele mažeme po 30 dnech s tím, že starší data jsou dostupná v anonymizované podobě v Google Analytics.
@@ -209,30 +174,12 @@ def extract_doba_zpracovani(text_processor: TextProcessor):
     # osobní údaj být zpracovávaný po doba
     # být uložený v systém evidence časový poplatek po doba
     # být uložený v spisový evidence minimálně po doba 5 léta
-    found = []
-    
-    tok_2 = "*3"
-    regs = [
-        ['osobní',tok_2,'údaj',tok_2,'zpracovávat',tok_2, 'po', tok_2, 'doba'],
-        ['osobní',tok_2,'údaj',tok_2,'být',tok_2,'zpracovávaný',tok_2, 'po', tok_2, 'doba'],
-        ['uchovávat',tok_2,'osobní',tok_2,'údaj',tok_2, 'po', tok_2, 'doba'],
-        ['data',tok_2,'být',tok_2,'uchovaný',tok_2, 'po', tok_2, 'doba'],
-        ['data',tok_2,'být',tok_2,'uchovávaný',tok_2, 'po', tok_2, 'doba'],
-        ['uložený',tok_2,'po',tok_2,'doba',tok_2, 'léta'],
-        ['být',tok_2,'zpracovávaný',tok_2,'po',tok_2, 'doba'],
-        ['být',tok_2,'uložený',"*4",'po',tok_2, 'doba'],
-    ]
-    starts, ends = text_processor.find_all_reg(regs)
-    
-    
-    sentences = text_processor.get_whole_sentence(starts+ends)
-    short = text_processor.extract_time(sentences)
-    contexts = [text_processor.get_tokens_with_tags(text_processor.flattened_tokens[sentence["range"][0]:sentence["range"][1]+1]) for sentence in sentences]
-    return (short ,  contexts)
-
-def extract_pristup(text_processor: TextProcessor):
-    found = []
-    tok_2 = "*3"
+    match = rule_matches(text_processor, "doba_zpracovani", matches)
+
+    short = text_processor.extract_time(match.sentences)
+    return (short ,  match.contexts)
+
+def extract_pristup(text_processor: TextProcessor, matches: dict[str, RuleMatches] = None):
     # Za podmínek stanovených v GDPR máte právo na přístup ke svým osobním údajům dle čl. 15 GDPR,
     # Právo na přístup znamená, že si kdykoliv můžete požádat o naše potvrzení, zda osobní údaje, které se Vás týkají, jsou či nejsou zpracovávány,
     # b)      Právo na přístup k osobním údajům
@@ -255,31 +202,9 @@ def extract_pristup(text_processor: TextProcessor):
     # mít právo na přístup k tento informace týkající se váš osobní údaj 
     
 
-    tok_2 = "*3"
-    regs = [
-        # právo na přístup k svůj osobní údaj
-        ['právo',tok_2,'přístup',"*5", 'osobní', 'údaj'],
-        # Můžete nás požádat, abychom vám zaslali přehled vašich osobních údajů
-        ['přehled',tok_2, 'osobní', 'údaj'],
-        # kdykoliv moci požádat o náš potvrzení , zda osobní údaj , který se vy týkat , být či být zpracovávaný 
-        ['potvrzení','*4','osobní','údaj'],
-        # přístup k osobní údaj na váš žádost vystavit potvrzení , zda zpracovávat nebo zpracovávat 
-        ['potvrzení','*4','zpracovávat' '*2', 'zpracovávat'],
-        # požadovat přenesení údaj , přístup k svůj osobní údaj 
-        ['přístup','*2', 'svůj', '*2', 'osobní', 'údaj']
-    ]
-    starts, ends = text_processor.find_all_reg(regs)
-
-    # sentences containing the found tokens
-    sentences = text_processor.get_whole_sentence(starts+ends)
-
-    sentence_texts = [sentence["text"] for sentence in sentences]
-    contexts = [text_processor.get_tokens_with_tags(text_processor.flattened_tokens[sentence["range"][0]:sentence["range"][1]+1]) for sentence in sentences]
-
-    return list(zip(sentence_texts, contexts))
+    return sentences_with_contexts(rule_matches(text_processor, "pristup", matches))
 
-def extract_vymaz(text_processor: TextProcessor):
-    found = []
+def extract_vymaz(text_processor: TextProcessor, matches: dict[str, RuleMatches] = None):
     # požadovat od my oprava nebo výmaz váš osobní údaj nebo
     # právo na výmaz některý osobní údaj 
 
@@ -303,48 +228,27 @@ def extract_vymaz(text_processor: TextProcessor):
     # požadovat výmaz tento osobní údaj
 
     
-    regs = [
-        ['právo','*2', 'výmaz'],
-        ['výmaz','*2', 'osobní', 'údaj'],
-        ['osobní', 'údaj','*2', 'výmaz']
-    ]
-    starts, ends = text_processor.find_all_reg(regs)
-    # sentences containing the found tokens
-    sentences = text_processor.get_whole_sentence(starts+ends)
-    sentence_texts = [sentence["text"] for sentence in sentences]
-    contexts = [text_processor.get_tokens_with_tags(text_processor.flattened_tokens[sentence["range"][0]:sentence["range"][1]+1]) for sentence in sentences]
-
-    return list(zip(sentence_texts, contexts))
-
+    return sentences_with_contexts(rule_matches(text_processor, "vymaz", matches))
 
-def extract_lhuta(text_processor: TextProcessor):
-
-    regs = [
-        ['obdržet','*4', 'žádost'],
-        ['žádosti','*4', 'lhůtu']
-    ]
-    starts, ends = text_processor.find_all_reg(regs)
-    # sentences containing the found tokens
-    sentences = text_processor.get_whole_sentence(starts+ends)
-    sentence_texts = [sentence["text"] for sentence in sentences]
-    contexts = [text_processor.get_tokens_with_tags(text_processor.flattened_tokens[sentence["range"][0]:sentence["range"][1]+1]) for sentence in sentences]
 
-    return list(zip(sentence_texts, contexts))
+def extract_lhuta(text_processor: TextProcessor, matches: dict[str, RuleMatches] = None):
+    return sentences_with_contexts(rule_matches(text_processor, "lhuta", matches))
 
 def extract_from_agreements(texts: list[dict[str, object]], text_processor: TextProcessor):
     text_processor.process(texts)
+    matches = RULES.evaluate(text_processor)
     
-    company, address = extract_spravce(text_processor)
-    third_companies = extract_predavani(text_processor)
+    company, address = extract_spravce(text_processor, matches)
+    third_companies = extract_predavani(text_processor, matches)
     
-    duration = extract_doba_zpracovani(text_processor)
+    duration = extract_doba_zpracovani(text_processor, matches)
 
-    access = extract_pristup(text_processor)
+    access = extract_pristup(text_processor, matches)
  
-    delete  = extract_vymaz(text_processor)
-    lhuta  = extract_lhuta(text_processor)
+    delete  = extract_vymaz(text_processor, matches)
+    lhuta  = extract_lhuta(text_processor, matches)
 
-    druh = extract_druh(text_processor)
+    druh = extract_druh(text_processor, matches)
 
     return {
         "company": company,
@@ -0,0 +1,158 @@
+import re
+from itertools import count
+
+# legal forms ending a company name, compared with the forms of the tokens joined without spaces; the dotted ones
+# case-insensitively
+LEGAL_FORMS = ['s.r.o.', 'spol.s.r.o.', 'a.s.', 'v.o.s.', 'k.s.', 'z.s.', 'z.ú.', 'o.p.s.', 's.p.', 'družstvo']
+CASED_LEGAL_FORMS = ['SE', 'GmbH', 'Ltd', 'Ltd.', 'Inc', 'Inc.', 'LLC', 'B.V.', 'N.V.']
+
+# maximum number of tokens of a legal form and of the name before it
+MAX_LEGAL_FORM_TOKENS = 6
+MAX_NAME_TOKENS = 6
+MAX_STREET_TOKENS = 4
+MAX_CITY_TOKENS = 3
+
+NAME_CONNECTORS = frozenset(['&', '-', '.', '+'])
+STREET_WORDS = frozenset(['na', 'u', 'v', 've', 'k', 'pod', 'nad', 'za', 'před', 'náměstí', 'nám', 'nábřeží',
+                          'třída', 'tř', 'ulice', 'ul', '.'])
+
+HOUSE_NUMBER = re.compile(r'^\d{1,5}[a-zA-Z]?(/\d{1,5}[a-zA-Z]?)?$')
+ZIP_CODE = re.compile(r'^\d{3}\s?\d{2}$')
+
+
+class RuleBasedNer:
+    """
+    Recognizes company names and postal addresses in tagged sentences without a model, filling misc['NE'] the way
+    NameTag does: "type_id" of every entity containing the token, outermost first, joined by "-".
+
+    Companies (type "if") are names followed by a legal form such as s.r.o. or a.s.; addresses (container "A")
+    are a street ("gs") with a house number ("ah"), a zip code ("az") and a city ("gu"), e.g.
+    "Plzeňská 3217/16, 150 00 Praha 5".
+    """
+
+    def annotate(self, sentences):
+        """
+        Adds the entities to the tokens of the sentences
+        :param sentences: list of lists of CoNLL-U token dicts
+        """
+        ids = count(1)
+        for sentence in sentences:
+            entities = self.companies(sentence) + self.addresses(sentence)
+            for entity_type, start, end in sorted(entities, key=lambda entity: (entity[1], -entity[2])):
+                label = f'{entity_type}_{next(ids)}'
+                for token in sentence[start:end]:
+                    misc = token.get('misc') or {}
+                    misc['NE'] = f"{misc['NE']}-{label}" if 'NE' in misc else label
+                    token['misc'] = misc
+
+    def companies(self, sentence):
+        """
+        :return: list of (type, start, end) of the company names in the sentence
+        """
+        forms = [token['form'] for token in sentence]
+        entities = []
+        end = 0
+        for i in range(len(forms)):
+            legal_form_start = self._legal_form_start(forms, i)
+            if legal_form_start is None or legal_form_start < end:
+                continue
+
+            start = legal_form_start
+            if start > 0 and forms[start - 1] == ',':
+                start -= 1
+            name_start = start
+            while name_start > max(end, start - MAX_NAME_TOKENS) and self._is_name_part(forms[name_start - 1]):
+                name_start -= 1
+            if name_start < start and any(form[:1].isupper() for form in forms[name_start:start]):
+                entities.append(('if', name_start, i + 1))
+                end = i + 1
+        return entities
+
+    @staticmethod
+    def _legal_form_start(forms, i):
+        """
+        :return: index of the first token of a legal form ending with token i, None if there is none
+        """
+        joined = ''
+        for start in range(i, max(-1, i - MAX_LEGAL_FORM_TOKENS), -1):
+            joined = forms[start] + joined
+            if joined.lower() in LEGAL_FORMS or joined in CASED_LEGAL_FORMS:
+                return start
+        return None
+
+    @staticmethod
+    def _is_name_part(form):
+        return form[:1].isupper() or form[:1].isdigit() or form in NAME_CONNECTORS
+
+    def addresses(self, sentence):
+        """
+        :return: list of (type, start, end) of the addresses in the sentence and of their parts
+        """
+        forms = [token['form'] for token in sentence]
+        entities = []
+        i = 0
+        while i < len(forms):
+            zip_end = self._zip_code_end(forms, i)
+            if zip_end is None:
+                i += 1
+                continue
+
+            city_end = zip_end
+            while city_end < min(len(forms), zip_end + MAX_CITY_TOKENS) and \
+                    (forms[city_end][:1].isupper() or (city_end > zip_end and forms[city_end].isdigit())):
+                city_end += 1
+
+            number_start, street_start = self._street_before(forms, i)
+            if city_end == zip_end and number_start is None:
+                i = zip_end
+                continue
+
+            start = street_start if street_start is not None else i
+            entities.append(('A', start, city_end))
+            if street_start is not None:
+                entities.append(('gs', street_start, number_start))
+                entities.append(('ah', number_start, self._number_end(forms, number_start)))
+            entities.append(('az', i, zip_end))
+            if city_end > zip_end:
+                entities.append(('gu', zip_end, city_end))
+            i = city_end
+        return entities
+
+    @staticmethod
+    def _zip_code_end(forms, i):
+        if ZIP_CODE.match(forms[i]):
+            return i + 1
+        if re.match(r'^\d{3}$', forms[i]) and i + 1 < len(forms) and re.match(r'^\d{2}$', forms[i + 1]):
+            return i + 2
+        return None
+
+    @staticmethod
+    def _number_end(forms, start):
+        end = start + 1
+        if end + 1 < len(forms) and forms[end] == '/' and HOUSE_NUMBER.match(forms[end + 1]):
+            end += 2
+        return end
+
+    @staticmethod
+    def _street_before(forms, zip_start):
+        """
+        :return: start of the house number and of the street before the zip code, (None, None) if there are none
+        """
+        end = zip_start
+        if end > 0 and forms[end - 1] == ',':
+            end -= 1
+
+        # house number, possibly with an orientation number after a slash
+        number_start = end - 1
+        if number_start < 0 or not HOUSE_NUMBER.match(forms[number_start]):
+            return None, None
+        if number_start >= 2 and forms[number_start - 1] == '/' and HOUSE_NUMBER.match(forms[number_start - 2]):
+            number_start -= 2
+
+        street_start = number_start
+        while street_start > max(0, number_start - MAX_STREET_TOKENS) and \
+                (forms[street_start - 1][:1].isupper() or forms[street_start - 1].lower() in STREET_WORDS):
+            street_start -= 1
+        if not any(form[:1].isupper() for form in forms[street_start:number_start]):
+            return None, None
+        return number_start, street_start
@@ -0,0 +1,56 @@
+import unittest
+
+from advertisement_processing.regular_extractor.ner import RuleBasedNer
+
+
+def sentence(*forms):
+    return [{'form': form, 'lemma': form.lower(), 'misc': None} for form in forms]
+
+
+def entities(tokens):
+    """
+    Returns {type: text} of the entities annotated in the tokens
+    """
+    found = {}
+    for token in tokens:
+        if token['misc'] and 'NE' in token['misc']:
+            for label in token['misc']['NE'].split('-'):
+                entity_type = label.split('_')[0]
+                found[entity_type] = f"{found[entity_type]} {token['form']}" if entity_type in found else token['form']
+    return found
+
+
+class RuleBasedNerTest(unittest.TestCase):
+    def annotate(self, *forms):
+        tokens = sentence(*forms)
+        RuleBasedNer().annotate([tokens])
+        return tokens
+
+    def test_company_with_legal_form(self):
+        tokens = self.annotate('Správcem', 'je', 'společnost', 'Seznam.cz', ',', 'a', '.', 's', '.', ',', 'se', 'sídlem')
+        self.assertEqual(entities(tokens), {'if': 'Seznam.cz , a . s .'})
+        self.assertIsNone(tokens[10]['misc'])
+
+    def test_reflexive_se_is_not_a_legal_form(self):
+        self.assertEqual(entities(self.annotate('Data', 'se', 'zpracovávají')), {})
+
+    def test_address_split_into_tokens(self):
+        tokens = self.annotate('sídlem', 'Radlická', '3294', '/', '10', ',', '150', '00', 'Praha', '5', ',', 'IČO')
+        self.assertEqual(entities(tokens), {'A': 'Radlická 3294 / 10 , 150 00 Praha 5', 'gs': 'Radlická',
+                                            'ah': '3294 / 10', 'az': '150 00', 'gu': 'Praha 5'})
+        self.assertTrue(tokens[1]['misc']['NE'].startswith('A_'))
+
+    def test_numbers_are_not_an_address(self):
+        self.assertEqual(entities(self.annotate('uchováváme', '123', '45', 'dní')), {})
+
+    def test_entity_ids_are_unique(self):
+        first = sentence('Alza.cz', 'a.s.')
+        second = sentence('Jankovcova', '1522', ',', '170', '00', 'Praha')
+        RuleBasedNer().annotate([first, second])
+        labels = [label for token in first + second for label in token['misc']['NE'].split('-')]
+        # the company and the address with its four parts
+        self.assertEqual(len(set(label.split('_')[1] for label in labels)), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import abc
+import functools
+import json
+from typing import Tuple
+
+import conllu
+from perscache import Cache
+
+from api.config import Config
+from .ner import RuleBasedNer
+from .nlp_client import get_client
+
+
+class NlpBackend(abc.ABC):
+    """
+    Lemmatizes texts and recognizes their named entities for a TextProcessor.
+
+    A parsed text is a list of sentences, each a conllu.TokenList of token dicts with at least 'form', 'lemma' and
+    'misc' - None or a dict with 'SpaceAfter': 'No' if no space follows the token and 'NE' with the NameTag
+    entities of the token.
+    """
+
+    @abc.abstractmethod
+    def parse(self, texts: list[str]) -> list:
+        """
+        :return: the parsed sentences of each text; every text gets tokens of its own, also if it repeats
+        """
+
+
+class LindatBackend(NlpBackend):
+    """
+    UDPipe and NameTag web services at LINDAT, called through the pooled client with the responses cached on disk
+    """
+    cache = Cache()
+
+    @cache
+    @staticmethod
+    def process_text(tokenizer, tagger, parser, output, data):
+        payload = {
+            'tokenizer': tokenizer,
+            'input': 'generic_tokenizer',
+            'tagger': tagger,
+            'parser': parser,
+            'output': output,
+            'data': data
+        }
+        return get_client().udpipe(payload)
+
+    @cache
+    @staticmethod
+    def recognize_entities(conllu_input):
+        payload = {
+            'data': conllu_input,
+            'input': "conllu",
+            'output': "conllu-ne",
+        }
+        return get_client().nametag(payload)
+
+    @staticmethod
+    def _tag_and_recognize(text: str) -> Tuple[str, str]:
+        """
+        Returns the tagged CoNLL-U of the text, and the same with named entities
+        """
+        json_output = LindatBackend.process_text(tokenizer=None, tagger="data", parser=None, output="conllu", data=text)
+        tagged = json.loads(json_output)['result']
+        json_output = LindatBackend.recognize_entities(tagged)
+        return tagged, json.loads(json_output)['result']
+
+    @staticmethod
+    def _document_chunks(texts: list[str], max_length: int) -> list[list[int]]:
+        """
+        Splits the indices of the texts into runs of consecutive texts of at most max_length characters together,
+        a longer text makes a run of its own
+        """
+        chunks = []
+        length = 0
+        for i, text in enumerate(texts):
+            if not chunks or length + len(text) > max_length:
+                chunks.append([])
+                length = 0
+            chunks[-1].append(i)
+            length += len(text) + 2
+        return chunks
+
+    @staticmethod
+    def _sentence_counts(texts: list[str], sentences) -> list[int] | None:
+        """
+        Maps the sentences of a document made of the texts back to the texts by the sentence text comments
+        :return: number of sentences of each text, None if the sentences do not make up the texts one by one
+        """
+        sentences = iter(sentences)
+        counts = []
+        for text in texts:
+            remaining = ''.join(text.split())
+            count = 0
+            while remaining:
+                sentence = next(sentences, None)
+                if sentence is None:
+                    return None
+                sentence_text = ''.join(sentence.metadata.get('text', '').split())
+                if not sentence_text or not remaining.startswith(sentence_text):
+                    return None
+                remaining = remaining[len(sentence_text):]
+                count += 1
+            counts.append(count)
+
+        if next(sentences, None) is not None:
+            return None
+        return counts
+
+    def parse(self, texts: list[str]) -> list:
+        """
+        With Config.NLP_DOCUMENT_PER_PAGE the texts are sent as a few documents of consecutive texts separated by
+        empty lines, i.e. paragraphs, which no sentence crosses. Texts of a document whose sentences cannot be
+        mapped back, and all texts otherwise, are sent one by one, each distinct text once.
+        """
+        parsed = [None] * len(texts)
+        if Config.NLP_DOCUMENT_PER_PAGE:
+            chunks = self._document_chunks(texts, Config.NLP_DOCUMENT_MAX_LENGTH)
+            documents = ['\n\n'.join(texts[i] for i in chunk) for chunk in chunks]
+            for chunk, (tagged, recognized) in zip(chunks, get_client().map(self._tag_and_recognize, documents)):
+                sentences = conllu.parse(recognized)
+                counts = self._sentence_counts([texts[i] for i in chunk], conllu.parse(tagged))
+                if counts is None or sum(counts) != len(sentences):
+                    continue
+
+                start = 0
+                for i, count in zip(chunk, counts):
+                    parsed[i] = sentences[start:start + count]
+                    start += count
+
+        missing = [i for i, sentences in enumerate(parsed) if sentences is None]
+        unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+        results = dict(zip(unique_texts, get_client().map(self._tag_and_recognize, unique_texts)))
+        for i in missing:
+            parsed[i] = conllu.parse(results[texts[i]][1])
+        return parsed
+
+
+@functools.lru_cache(maxsize=None)
+def load_udpipe(lang):
+    """
+    spacy_udpipe pipeline of the language, loaded once per process
+    """
+    import spacy_udpipe
+    return spacy_udpipe.load(lang)
+
+
+class LocalBackend(NlpBackend):
+    """
+    spacy_udpipe model tagging in the process, with the rule-based recognizer of companies and addresses instead of
+    NameTag; needs no network once the model is downloaded
+    """
+
+    def __init__(self, lang='cs', ner=None):
+        self.lang = lang
+        self.ner = ner or RuleBasedNer()
+
+    def parse(self, texts: list[str]) -> list:
+        nlp = load_udpipe(self.lang)
+        parsed = []
+        for doc in nlp.pipe(texts):
+            sentences = [self._sentence_to_conllu(sentence) for sentence in doc.sents]
+            sentences = [sentence for sentence in sentences if len(sentence) > 0]
+            self.ner.annotate(sentences)
+            parsed.append(sentences)
+        return parsed
+
+    @staticmethod
+    def _sentence_to_conllu(sentence) -> conllu.TokenList:
+        tokens = [token for token in sentence if not token.is_space]
+        ids = {token.i: i for i, token in enumerate(tokens, 1)}
+        token_list = []
+        for i, token in enumerate(tokens, 1):
+            token_list.append(conllu.Token({
+                'id': i,
+                'form': token.text,
+                'lemma': token.lemma_ or token.text,
+                'upos': token.pos_ or None,
+                'xpos': token.tag_ or None,
+                'feats': token.morph.to_dict() or None,
+                'head': ids.get(token.head.i, 0) if token.head.i != token.i else 0,
+                'deprel': token.dep_ or None,
+                'deps': None,
+                'misc': None if token.whitespace_ else {'SpaceAfter': 'No'},
+            }))
+        return conllu.TokenList(token_list, metadata={'text': sentence.text.strip()})
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend(name=None) -> NlpBackend:
+    """
+    The backend of the given name, 'lindat' or 'local', Config.NLP_BACKEND by default
+    """
+    name = name or Config.NLP_BACKEND
+    if name == 'lindat':
+        return LindatBackend()
+    if name == 'local':
+        return LocalBackend(Config.NLP_LOCAL_LANGUAGE)
+    raise ValueError(f'Unknown NLP backend {name}')
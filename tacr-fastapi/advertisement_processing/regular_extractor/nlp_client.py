@@ -0,0 +1,91 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from api.config import Config
+
+# responses retried besides failed connections and reads
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class LindatClient:
+    """
+    Client of the UDPipe and NameTag web services.
+
+    Requests go over a pool of persistent connections, time out instead of hanging, and are retried with
+    exponential backoff on connection errors and on overloaded or failing services. map() runs several requests
+    concurrently, at most as many as there are connections.
+    """
+
+    def __init__(self, udpipe_url, nametag_url, max_connections, timeout, retries, backoff):
+        """
+        :param max_connections: maximum number of concurrent requests and of kept connections per host
+        :param timeout: (connect, read) timeout in seconds of a single attempt
+        :param retries: number of retries of a failed request
+        :param backoff: delay in seconds before the first retry, doubled for each following one
+        """
+        self.udpipe_url = udpipe_url
+        self.nametag_url = nametag_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+
+        # both services are stateless, so retrying a POST is safe
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES, allowed_methods=None,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max_connections, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_connections, thread_name_prefix='lindat')
+
+    def post(self, url, payload) -> str:
+        """
+        :return: text of the response
+        :raises requests.RequestException: if the request failed after all retries or returned an error status
+        """
+        response = self.session.post(url, data=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def udpipe(self, payload) -> str:
+        return self.post(self.udpipe_url, payload)
+
+    def nametag(self, payload) -> str:
+        return self.post(self.nametag_url, payload)
+
+    def map(self, fn, items) -> list:
+        """
+        Returns [fn(item) for item in items], computed concurrently by up to max_connections threads
+        """
+        items = list(items)
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+        return list(self.executor.map(fn, items))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> LindatClient:
+    """
+    Returns the client shared by all TextProcessors of the process, created from Config on first use
+
+    A forked child process gets a client of its own instead of sharing the connections of its parent.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = LindatClient(Config.UDPIPE_URL, Config.NAMETAG_URL, Config.NLP_MAX_CONNECTIONS,
+                                   Config.NLP_TIMEOUT, Config.NLP_RETRIES, Config.NLP_RETRY_BACKOFF)
+            _client_pid = os.getpid()
+        return _client
@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import requests
+
+from advertisement_processing.regular_extractor.nlp_client import LindatClient
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the LINDAT services: /process and /recognize echo the data, /slow answers after server.delay
+    seconds, /flaky answers 503 to the first server.failures requests
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        data = parse_qs(body.decode('utf-8'))['data'][0]
+        with server.lock:
+            server.requests += 1
+            server.ports.add(self.client_address[1])
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            failing = self.path == '/flaky' and server.requests <= server.failures
+        try:
+            if self.path == '/slow':
+                time.sleep(server.delay)
+            if failing:
+                self.respond(503, b'')
+            else:
+                self.respond(200, json.dumps({'result': data}).encode('utf-8'))
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self, status, payload):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LindatClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.ports = set()
+        self.server.active = 0
+        self.server.max_active = 0
+        self.server.delay = 0.2
+        self.server.failures = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, path='/process', max_connections=4, timeout=(1, 5), retries=0):
+        client = LindatClient(self.base_url + path, self.base_url + '/recognize', max_connections, timeout, retries,
+                              backoff=0.01)
+        self.addCleanup(client.close)
+        return client
+
+    def test_post_returns_response(self):
+        client = self.client()
+        self.assertEqual(json.loads(client.udpipe({'data': 'Správce údajů'}))['result'], 'Správce údajů')
+        self.assertEqual(json.loads(client.nametag({'data': 'Praha'}))['result'], 'Praha')
+
+    def test_connections_are_reused(self):
+        client = self.client()
+        for i in range(10):
+            client.udpipe({'data': str(i)})
+        self.assertEqual(len(self.server.ports), 1)
+
+    def test_map_is_concurrent_and_bounded(self):
+        client = self.client('/slow', max_connections=4)
+        texts = [str(i) for i in range(12)]
+
+        start = time.perf_counter()
+        results = client.map(lambda text: json.loads(client.udpipe({'data': text}))['result'], texts)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(results, texts)
+        self.assertEqual(self.server.max_active, 4)
+        self.assertLess(elapsed, 12 * self.server.delay / 2)
+        self.assertLessEqual(len(self.server.ports), 4)
+
+    def test_failed_requests_are_retried(self):
+        self.server.failures = 2
+        client = self.client('/flaky', retries=3)
+        self.assertEqual(json.loads(client.udpipe({'data': 'text'}))['result'], 'text')
+        self.assertEqual(self.server.requests, 3)
+
+    def test_error_status_raises_after_retries(self):
+        self.server.failures = 10
+        client = self.client('/flaky', retries=2)
+        with self.assertRaises(requests.HTTPError):
+            client.udpipe({'data': 'text'})
+        self.assertEqual(self.server.requests, 3)
+
+    def test_slow_service_times_out(self):
+        self.server.delay = 1
+        client = self.client('/slow', timeout=(1, 0.1))
+        with self.assertRaises(requests.RequestException):
+            client.udpipe({'data': 'text'})
+
+
+if __name__ == '__main__':
+    unittest.main()
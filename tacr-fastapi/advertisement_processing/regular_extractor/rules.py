@@ -0,0 +1,168 @@
+from dataclasses import dataclass, field
+from typing import Iterable
+
+# up to three arbitrary tokens between two lemmas
+GAP = "*3"
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    Lemma patterns of one extracted item, see TextProcessor.find_start_reg
+    :param method: "strict" for patterns with *n gaps, "sentence" for lemmas in order within a sentence
+    :param context: "sentence" for the sentences of the matches, "heading" for the heading sections of their starts
+    """
+    name: str
+    patterns: tuple[tuple[str, ...], ...]
+    method: str = "strict"
+    context: str = "sentence"
+
+
+@dataclass
+class RuleMatches:
+    starts: list[int]
+    ends: list[int]
+    # with context "sentence": the sentences containing a start or an end, as TextProcessor.get_whole_sentence
+    # returns them, and the tokens with tags of each
+    sentences: list[dict] = field(default_factory=list)
+    contexts: list[list[tuple]] = field(default_factory=list)
+    # with context "heading": the heading section of each start
+    headings: list[tuple[int, int]] = field(default_factory=list)
+
+
+class RuleSet:
+    """
+    Rules of all the extractors, evaluated together in one pass over a processed document: each distinct pattern is
+    matched once and the context of a sentence is built once, however many rules refer to them.
+    """
+
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules = {}
+        for rule in rules:
+            if rule.name in self.rules:
+                raise ValueError(f'Duplicate rule {rule.name}')
+            if rule.method not in ("strict", "sentence") or rule.context not in ("sentence", "heading"):
+                raise ValueError(f'Invalid method or context of rule {rule.name}')
+            self.rules[rule.name] = rule
+
+    def __getitem__(self, name) -> Rule:
+        return self.rules[name]
+
+    def evaluate(self, text_processor, names: Iterable[str] = None) -> dict[str, RuleMatches]:
+        """
+        Matches the rules in the processed text.
+        :param names: names of the rules to evaluate, all by default
+        :return: matches of each rule by its name
+        """
+        rules = [self.rules[name] for name in names] if names is not None else self.rules.values()
+        found = {}
+        contexts = {}
+        matches = {}
+        for rule in rules:
+            starts = []
+            ends = []
+            for pattern in rule.patterns:
+                key = (pattern, rule.method)
+                if key not in found:
+                    found[key] = text_processor.find_start_reg(list(pattern), method=rule.method)
+                starts += found[key][0]
+                ends += found[key][1]
+
+            match = RuleMatches(starts, ends)
+            if rule.context == "heading":
+                match.headings = [text_processor.get_heading_for_token(start) for start in starts]
+            else:
+                match.sentences = text_processor.get_whole_sentence(starts + ends)
+                for sentence in match.sentences:
+                    start, end = sentence["range"]
+                    if (start, end) not in contexts:
+                        contexts[start, end] = text_processor.get_tokens_with_tags(
+                            text_processor.flattened_tokens[start:end + 1])
+                    match.contexts.append(contexts[start, end])
+            matches[rule.name] = match
+        return matches
+
+
+def _patterns(*patterns: list[str]) -> tuple[tuple[str, ...], ...]:
+    return tuple(tuple(pattern) for pattern in patterns)
+
+
+# kinds of personal data, each found after a lemma saying that the data are processed
+DRUH_PREFIXES = [["zpracovávat"], ["osobní", "údaj"], ["ukládat"]]
+DRUH = {
+    "Jméno": [["jméno"]],
+    "Příjmení": [["příjmení"]],
+    "Datum narození": [["datum", "narození"]],
+    "Adresa": [["adresa"]],
+    "Průkaz": [["průkaz", "totožnost"]],
+    "IČ": [["IČ"]],
+    "DIČ": [["DIČ"]],
+    "Poloha": [["lokační", "údaj"]],
+    "SPZ": [["SPZ"]],
+    "Podpis": [["podpis"]],
+    "Datová schránka": [["datový", "schránka"]],
+}
+
+
+def druh_rule_name(key: str) -> str:
+    return f"druh/{key}"
+
+
+RULES = RuleSet([
+    # the controller of the personal data, followed by its name and address in the same heading section
+    Rule("spravce", _patterns(
+        ['správce', '*1', 'osobní', 'údaj'],
+        ['zpracování', '*1', 'osobní', 'údaj'],
+        ['souhlas', '*1', 'zpracování', '*1', 'osobní', 'údaj', '*8', 'provozovatel'],
+    ), context="heading"),
+
+    # recipients of the personal data
+    Rule("predavani", _patterns(
+        ['předávat', "*2", 'osobní', 'údaj'],
+        ['kdo', 'moci', '*2', 'údaj', '*3', 'zpřístupnit'],    # kdo moci údaj o vy zpřístupnit
+        ['příjemce', '*1', 'osobní', 'údaj'],  # příjemce osobní údaj
+    ), context="heading"),
+
+    # how long the personal data are kept
+    Rule("doba_zpracovani", _patterns(
+        ['osobní', GAP, 'údaj', GAP, 'zpracovávat', GAP, 'po', GAP, 'doba'],
+        ['osobní', GAP, 'údaj', GAP, 'být', GAP, 'zpracovávaný', GAP, 'po', GAP, 'doba'],
+        ['uchovávat', GAP, 'osobní', GAP, 'údaj', GAP, 'po', GAP, 'doba'],
+        ['data', GAP, 'být', GAP, 'uchovaný', GAP, 'po', GAP, 'doba'],
+        ['data', GAP, 'být', GAP, 'uchovávaný', GAP, 'po', GAP, 'doba'],
+        ['uložený', GAP, 'po', GAP, 'doba', GAP, 'léta'],
+        ['být', GAP, 'zpracovávaný', GAP, 'po', GAP, 'doba'],
+        ['být', GAP, 'uložený', "*4", 'po', GAP, 'doba'],
+    )),
+
+    # right of access to the personal data
+    Rule("pristup", _patterns(
+        # právo na přístup k svůj osobní údaj
+        ['právo', GAP, 'přístup', "*5", 'osobní', 'údaj'],
+        # Můžete nás požádat, abychom vám zaslali přehled vašich osobních údajů
+        ['přehled', GAP, 'osobní', 'údaj'],
+        # kdykoliv moci požádat o náš potvrzení , zda osobní údaj , který se vy týkat , být či být zpracovávaný
+        ['potvrzení', '*4', 'osobní', 'údaj'],
+        # přístup k osobní údaj na váš žádost vystavit potvrzení , zda zpracovávat nebo zpracovávat
+        ['potvrzení', '*4', 'zpracovávat' '*2', 'zpracovávat'],
+        # požadovat přenesení údaj , přístup k svůj osobní údaj
+        ['přístup', '*2', 'svůj', '*2', 'osobní', 'údaj'],
+    )),
+
+    # right to erasure
+    Rule("vymaz", _patterns(
+        ['právo', '*2', 'výmaz'],
+        ['výmaz', '*2', 'osobní', 'údaj'],
+        ['osobní', 'údaj', '*2', 'výmaz'],
+    )),
+
+    # time limit for answering a request
+    Rule("lhuta", _patterns(
+        ['obdržet', '*4', 'žádost'],
+        ['žádosti', '*4', 'lhůtu'],
+    )),
+] + [
+    Rule(druh_rule_name(key), _patterns(*[prefix + reg for prefix in DRUH_PREFIXES for reg in regs]),
+         method="sentence")
+    for key, regs in DRUH.items()
+])
@@ -0,0 +1,70 @@
+import unittest
+
+import conllu
+
+from advertisement_processing.regular_extractor.nlp_backend import NlpBackend
+from advertisement_processing.regular_extractor.rules import RULES, Rule, RuleSet
+from advertisement_processing.regular_extractor.text_processor import TextProcessor
+
+
+class LemmaBackend(NlpBackend):
+    """
+    Splits the texts into sentences at "." and into tokens at spaces, the tokens being their own lemmas
+    """
+
+    def parse(self, texts):
+        parsed = []
+        for text in texts:
+            sentences = []
+            for sentence in text.split(' . '):
+                forms = sentence.split() + ['.']
+                sentences.append(conllu.TokenList([conllu.Token({'id': i, 'form': form, 'lemma': form, 'misc': None})
+                                                   for i, form in enumerate(forms, 1)]))
+            parsed.append(sentences)
+        return parsed
+
+
+TEXTS = [
+    {'id': 0, 'tag': 'h1', 'text': 'zásady zpracování osobní údaj'},
+    {'id': 1, 'tag': 'p', 'text': 'vy mít právo na výmaz osobní údaj . my zpracovávat váš jméno a adresa'},
+    {'id': 2, 'tag': 'h2', 'text': 'doba'},
+    {'id': 3, 'tag': 'p', 'text': 'osobní údaj být zpracovávaný po doba 5 léta . osobní údaj ukládat jméno'},
+]
+
+
+class RuleSetTest(unittest.TestCase):
+    def setUp(self):
+        self.text_processor = TextProcessor('test', LemmaBackend())
+        self.text_processor.process(TEXTS)
+
+    def test_same_as_separate_search(self):
+        matches = RULES.evaluate(self.text_processor)
+        self.assertEqual(matches.keys(), RULES.rules.keys())
+        for name, match in matches.items():
+            rule = RULES[name]
+            starts, ends = self.text_processor.find_all_reg([list(pattern) for pattern in rule.patterns],
+                                                            method=rule.method)
+            self.assertEqual((match.starts, match.ends), (starts, ends))
+            if rule.context == "heading":
+                self.assertEqual(match.headings, [self.text_processor.get_heading_for_token(start) for start in starts])
+            else:
+                self.assertEqual(match.sentences, self.text_processor.get_whole_sentence(starts + ends))
+                self.assertEqual(len(match.contexts), len(match.sentences))
+
+        self.assertTrue(matches["vymaz"].starts)
+        self.assertTrue(matches["doba_zpracovani"].starts)
+        self.assertEqual(len(matches["druh/Jméno"].sentences), 2)
+
+    def test_subset(self):
+        matches = RULES.evaluate(self.text_processor, ["vymaz"])
+        self.assertEqual(list(matches), ["vymaz"])
+
+    def test_invalid_rules(self):
+        with self.assertRaises(ValueError):
+            RuleSet([Rule("a", (("x",),)), Rule("a", (("y",),))])
+        with self.assertRaises(ValueError):
+            RuleSet([Rule("a", (("x",),), context="page")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,15 @@
 import os
+from bisect import bisect_right
 from typing import Tuple
-from perscache import Cache
 import xml.etree.ElementTree as ET
-import requests
 import conllu
 import json
 from dataclasses import dataclass
 import re
+from .entity_index import EntityIndex
+from .lemma_matcher import LemmaIndex
+from .nlp_backend import NlpBackend, get_backend
+from .token_store import SentenceView, TokenStore, TokenView
 LEMMATIZED_FOLDER="RegularExtractor/lemmatized"
 
 H_TAGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
@@ -23,44 +26,22 @@ class NamedEntity:
         return f"{self.type}: {self.text}"
 
 class TextProcessor:
-    cache = Cache()
-
-    def __init__(self, filename):
+    def __init__(self, filename, backend: NlpBackend = None):
+        """
+        :param backend: lemmatizer and named entity recognizer, the one given by Config.NLP_BACKEND by default
+        """
         self.filename = filename
+        self.backend = backend or get_backend()
         self.hierarchical_tokens = []
         self.flattened_tokens = []
         self.named_entities = []
         self.parsed_conllu = None
         self.sent_ids_for_tokens = []
+        self.tokens = None
+        self.lemma_index = None
+        self.entity_index = None
 
 
-    @cache
-    @staticmethod
-    def process_text(tokenizer, tagger, parser, output, data):
-        url = 'http://lindat.mff.cuni.cz/services/udpipe/api/process'
-        payload = {
-            'tokenizer': tokenizer,
-            'input': 'generic_tokenizer',
-            'tagger': tagger,
-            'parser': parser,
-            'output': output,
-            'data': data
-        }
-        response = requests.post(url, data=payload)
-        return response.text
-
-    @cache
-    @staticmethod
-    def recognize_entities(conllu_input):
-        url = 'http://lindat.mff.cuni.cz/services/nametag/api/recognize'
-        payload = {
-            'data': conllu_input,
-            'input': "conllu",
-            'output': "conllu-ne",
-        }
-        response = requests.post(url, data=payload)
-        return response.text
-
     @staticmethod
     def _add_text_index(parsed_tags):
         text_index = 0
@@ -92,34 +73,12 @@ class TextProcessor:
     
 
     def _extract_named_entities(self):
-        named_entities = {}
-        
-        for idx, token in enumerate(self.flattened_tokens):
-            if 'misc' in token and token['misc'] and 'NE' in token['misc']:
-                entity = token['misc']['NE']
-                entities = entity.split('-')
-                for entity in entities:
-                    entity_tuple = tuple(entity.split('_'))+(self.tag_ids_for_tokens[idx],)
-                    named_entity = named_entities.get(entity_tuple)
-                    if named_entity:
-                        named_entity.end_index = idx
-                        named_entity.tokens.append(token)
-                        if 'misc' in token and token['misc'] and 'SpaceAfter' in token['misc'] and token['misc']['SpaceAfter'] == 'No':
-                            space = ''
-                        else:
-                            space = ' '
-                        
-                        named_entity.text += token['form'] + space
-                    else:
-                        named_entities[entity_tuple] = NamedEntity(
-                            type=entity_tuple[0],
-                            start_index=idx,
-                            end_index=idx,
-                            tokens=[token],
-                            text=token['form'] + ' ' if ('misc' not in token or 'SpaceAfter' not in token['misc'] or token['misc']['SpaceAfter'] != 'No') else token['form']
-                        )
-
-        self.named_entities = list(named_entities.values())
+        tokens = self.tokens
+        self.named_entities = [
+            NamedEntity(type=tokens.strings[type_id], start_index=start, end_index=end,
+                        tokens=self.flattened_tokens[start:end + 1], text=tokens.entity_text(start, end))
+            for type_id, start, end in zip(tokens.entity_types.tolist(), tokens.entity_starts.tolist(),
+                                           tokens.entity_ends.tolist())]
     
     # # found : list[start,len]
     # def find_time(self, found):
@@ -136,62 +95,47 @@ class TextProcessor:
     #     return times 
 
     def _recognize_entities(self, text: str):
-        json_output = TextProcessor.process_text(tokenizer=None, tagger="data", parser=None, output="conllu", data=text)
-        parsed_output = json.loads(json_output)
-        json_output = TextProcessor.recognize_entities(parsed_output['result'])
-        parsed_output = json.loads(json_output)
-        parsed_conllu = conllu.parse(parsed_output['result'])
-        return parsed_conllu
-        
+        return self.backend.parse([text])[0]
 
     def process(self, texts:list[dict[str, object]]):
-        parsed_tags = [{"id": text['id'], "text": text['text'], "parsed_text": self._recognize_entities(text['text']), "tag": text['tag']} for text in texts]
+        parsed_texts = self.backend.parse([text['text'] for text in texts])
+        parsed_tags = [{"id": text['id'], "text": text['text'], "parsed_text": parsed_text, "tag": text['tag']} for text, parsed_text in zip(texts, parsed_texts)]
 
         self._add_text_index(parsed_tags)
 
-        self.hierarchical_tokens = parsed_tags
-
         # flatened =  [token for tag in parsed_tags for sentence in tag["parsed_text"] for token in sentence]
 
-        token_index = 0
-        sentence_index = 0
-        tag_index = 0
-        self.flattened_tokens = []
-        self.flattened_sentences = []
-        self.sent_ids_for_tokens = []
-        self.tag_ids_for_tokens = []
-        for tag in parsed_tags:
-            for sentence in tag["parsed_text"]:
-                self.flattened_sentences.append(sentence)
-                for token in sentence:
-                    self.flattened_tokens.append(token)
-                    self.sent_ids_for_tokens.append(sentence_index)
-                    self.tag_ids_for_tokens.append(tag_index)
-                    token_index += 1
-                sentence_index += 1
-            tag_index += 1
-
-
-        assert all([i == token["text_index"] for i, token in enumerate(self.flattened_tokens)])
+        # the token dicts are not kept, the views build them from the store on access
+        self.tokens = TokenStore([tag["parsed_text"] for tag in parsed_tags])
+        self.flattened_sentences = SentenceView(self.tokens)
+        self.flattened_tokens = TokenView(self.tokens, 0, len(self.tokens))
+        self.sent_ids_for_tokens = self.tokens.sentence_ids
+        self.tag_ids_for_tokens = self.tokens.tag_ids
 
-        self.heading_ranges = [tag['parsed_text'][0][0]['text_index'] for tag in self.hierarchical_tokens if (len(tag['parsed_text']) > 0) and len(tag['parsed_text'][0]) > 0 and (tag['tag'] in H_TAGS)] + [len(self.flattened_tokens)-1]
+        self.heading_ranges = [tag['parsed_text'][0][0]['text_index'] for tag in parsed_tags if (len(tag['parsed_text']) > 0) and len(tag['parsed_text'][0]) > 0 and (tag['tag'] in H_TAGS)] + [len(self.flattened_tokens)-1]
+        self.hierarchical_tokens = [{key: value for key, value in tag.items() if key != "parsed_text"} for tag in parsed_tags]
 
         if self.heading_ranges[0] != 0:
             self.heading_ranges = [0] + self.heading_ranges
 
+        self.lemma_index = LemmaIndex(self.tokens)
+
         self._extract_named_entities()
+        self.entity_index = EntityIndex(self.named_entities)
 
     def get_tokens_with_tags(self, flattened_tokens):
-        return [(token['form'], self.tag_ids_for_tokens[token["text_index"]]) for token in flattened_tokens]
+        return [(token['form'], int(self.tag_ids_for_tokens[token["text_index"]])) for token in flattened_tokens]
 
     def get_heading_for_token(self, token_index: int):
         """
         Returns the heading for the given token index.
         :param token_index: The index of the token to get the heading for.
         """
-        for heading_index in range(len(self.heading_ranges) - 1):
-            if self.heading_ranges[heading_index] <= token_index < self.heading_ranges[heading_index + 1]:
-                return (self.heading_ranges[heading_index], self.heading_ranges[heading_index + 1])
+        # the heading ranges are sorted, so only the last one starting at or before the token can contain it
+        heading_index = bisect_right(self.heading_ranges, token_index) - 1
+        if 0 <= heading_index < len(self.heading_ranges) - 1 and \
+                self.heading_ranges[heading_index] <= token_index < self.heading_ranges[heading_index + 1]:
+            return (self.heading_ranges[heading_index], self.heading_ranges[heading_index + 1])
         return None
 
     def write_lemmatized_text(self):
@@ -276,8 +220,11 @@ class TextProcessor:
         return True, end_index
     
     def start_end_from_sentence(self, sent_id):
-        start = self.flattened_tokens.index(self.flattened_sentences[sent_id][0])
-        end = self.flattened_tokens.index(self.flattened_sentences[sent_id][-1])
+        """
+        Returns the indices of the first and the last token of the sentence
+        """
+        start = int(self.tokens.sentence_starts[sent_id])
+        end = int(self.tokens.sentence_starts[sent_id + 1]) - 1
         return start,end
 
 
@@ -323,7 +270,7 @@ class TextProcessor:
         token_indexes = sorted(token_indexes)
         sent_ids = set()
         for token_index in token_indexes:
-            sent_ids.add(self.sent_ids_for_tokens[token_index])
+            sent_ids.add(int(self.sent_ids_for_tokens[token_index]))
 
         sentences = []
         sentences_token_lits = [(sent_id, [w for w in self.flattened_sentences[sent_id]]) for sent_id in sent_ids]
@@ -362,7 +309,12 @@ class TextProcessor:
         """
         if to_index == -1:
             to_index = len(self.flattened_tokens)
-        
+
+        if self.lemma_index is not None:
+            found = self.lemma_index.find(lemma_list, from_index, to_index, method)
+            if found is not None:
+                return found
+
         starts = []
         ends = []
         for i in range(from_index,to_index - len(lemma_list)+1):
@@ -390,31 +342,8 @@ class TextProcessor:
         :param start_range_offset: The number of tokens to search before the start position.
         :param end_range_offset: The number of tokens to search after the start position.
         """
-        black_list = [token.lower() for token in black_list]  
-        named_entities = []
-
-        for i in range(start_range, end_range):
-            token = self.flattened_tokens[i]
-            if 'misc' in token and token['misc'] and 'NE' in token['misc']:
-                entity = token['misc']['NE']
-                entities = entity.split('-')
-                # remove the _* suffix from entities
-                entities = [entity.split('_')[0] for entity in entities]
-
-                for entity in entities:
-                    if entity in entity_type:
-                        named_entities.append(i)
-
-        if named_entities:
-            named_entities = [entity for entity in self.named_entities if entity.start_index in named_entities and entity.type in entity_type and entity.text.lower().strip() not in black_list]
-            
-            # Print the text of the named entities
-            # for entity in named_entities:
-            #     print(entity.text)
-
-
-
-        return named_entities
+        # an entity of the types starting in the range, whose first token thus carries its type
+        return self.entity_index.in_range(entity_type, start_range, end_range, black_list)
     
     def find_closest_named_entity(self, entity_type: list[str], start_position: int, start_range: int, end_range:int, black_list: list[str] = []):
         """
@@ -424,9 +353,6 @@ class TextProcessor:
         :param start_range_offset: The number of tokens to search before the start position.
         :param end_range_offset: The number of tokens to search after the start position.
         """
-        named_entities = self.find_all_named_entities(entity_type, start_range, end_range, black_list)
-        if named_entities:
-            return min(named_entities, key=lambda x: abs(x.start_index - start_position))
-        return None
+        return self.entity_index.closest(entity_type, start_position, start_range, end_range, black_list)
 
 
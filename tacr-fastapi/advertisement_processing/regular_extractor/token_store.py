@@ -0,0 +1,172 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+# id of a string missing from the vocabulary, never the id of a token
+UNKNOWN_ID = -1
+
+
+class TokenStore:
+    """
+    Columnar store of the flattened tokens of a processed document, replacing their CoNLL-U token dicts.
+
+    Lemmas, forms, SpacesAfter values and NE labels are interned into integer ids of one vocabulary and kept in
+    NumPy arrays along with the sentence, tag and SpaceAfter flag of every token; the named entity spans are
+    arrays of start, end and type. Matching compares integers, and token() builds a token dict only when an
+    output needs one, with the form, lemma and the misc keys the extractor reads.
+    """
+
+    def __init__(self, sentences_of_tags: list[list[list[dict]]]):
+        """
+        :param sentences_of_tags: parsed sentences of each tag of the document, not referenced afterwards
+        """
+        self.vocabulary = {}
+        self.strings = []
+        intern = self.intern
+        lemma_ids = []
+        form_ids = []
+        spaces_after_ids = []
+        ne_ids = []
+        sentence_ids = []
+        tag_ids = []
+        space_after = []
+        sentence_starts = [0]
+        # (label, tag id) of each entity -> [type id, first token, last token], in the order of the first tokens
+        entities = {}
+        for tag_id, sentences in enumerate(sentences_of_tags):
+            for sentence in sentences:
+                sentence_id = len(sentence_starts) - 1
+                for token in sentence:
+                    lemma_ids.append(intern(token['lemma']))
+                    form_ids.append(intern(token['form']))
+                    misc = token.get('misc')
+                    if not misc:
+                        spaces_after_ids.append(UNKNOWN_ID)
+                        ne_ids.append(UNKNOWN_ID)
+                        space_after.append(True)
+                        continue
+                    spaces_after = misc.get('SpacesAfter')
+                    spaces_after_ids.append(UNKNOWN_ID if spaces_after is None else intern(spaces_after))
+                    space_after.append(misc.get('SpaceAfter') != 'No')
+                    labels = misc.get('NE')
+                    if labels is None:
+                        ne_ids.append(UNKNOWN_ID)
+                        continue
+                    ne_ids.append(intern(labels))
+                    index = len(lemma_ids) - 1
+                    for label in labels.split('-'):
+                        span = entities.get((label, tag_id))
+                        if span is None:
+                            entities[label, tag_id] = [intern(label.split('_')[0]), index, index]
+                        else:
+                            span[2] = index
+                sentence_ids += [sentence_id] * len(sentence)
+                tag_ids += [tag_id] * len(sentence)
+                sentence_starts.append(len(lemma_ids))
+
+        self.lemma_ids = np.array(lemma_ids, dtype=np.int32)
+        self.form_ids = np.array(form_ids, dtype=np.int32)
+        self.spaces_after_ids = np.array(spaces_after_ids, dtype=np.int32)
+        self.ne_ids = np.array(ne_ids, dtype=np.int32)
+        self.sentence_ids = np.array(sentence_ids, dtype=np.int32)
+        self.tag_ids = np.array(tag_ids, dtype=np.int32)
+        self.space_after = np.array(space_after, dtype=bool)
+        # index of the first token of each sentence, and the number of tokens at the end
+        self.sentence_starts = np.array(sentence_starts, dtype=np.int32)
+
+        spans = np.array(list(entities.values()), dtype=np.int32).reshape(-1, 3)
+        self.entity_types = spans[:, 0].copy()
+        self.entity_starts = spans[:, 1].copy()
+        self.entity_ends = spans[:, 2].copy()
+
+    def __len__(self):
+        return len(self.lemma_ids)
+
+    def intern(self, string: str) -> int:
+        string_id = self.vocabulary.get(string)
+        if string_id is None:
+            string_id = self.vocabulary[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def id(self, string: str) -> int:
+        """
+        :return: id of the string, UNKNOWN_ID if no token has it as its lemma, form or label
+        """
+        return self.vocabulary.get(string, UNKNOWN_ID)
+
+    def token(self, index: int) -> dict:
+        """
+        :return: token dict with the form, lemma, misc (SpaceAfter, SpacesAfter and NE, None without them) and
+            text_index of the token
+        """
+        misc = {}
+        if not self.space_after[index]:
+            misc['SpaceAfter'] = 'No'
+        if self.spaces_after_ids[index] != UNKNOWN_ID:
+            misc['SpacesAfter'] = self.strings[self.spaces_after_ids[index]]
+        if self.ne_ids[index] != UNKNOWN_ID:
+            misc['NE'] = self.strings[self.ne_ids[index]]
+        return {'form': self.strings[self.form_ids[index]], 'lemma': self.strings[self.lemma_ids[index]],
+                'misc': misc or None, 'text_index': int(index)}
+
+    def entity_text(self, start: int, end: int) -> str:
+        """
+        :return: forms of the tokens start to end, each followed by a space unless it has SpaceAfter=No
+        """
+        forms = self.form_ids[start:end + 1].tolist()
+        spaces = self.space_after[start:end + 1].tolist()
+        return ''.join(self.strings[form_id] + (' ' if space else '') for form_id, space in zip(forms, spaces))
+
+
+class TokenView(Sequence):
+    """
+    Tokens start to end (exclusive) of a TokenStore as a sequence of token dicts built on access; slicing gives
+    another view
+    """
+
+    def __init__(self, store: TokenStore, start: int, end: int):
+        self.store = store
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return TokenView(self.store, self.start + start, self.start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('token index out of range')
+        return self.store.token(self.start + index)
+
+    def __iter__(self):
+        for index in range(self.start, self.end):
+            yield self.store.token(index)
+
+
+class SentenceView(Sequence):
+    """
+    Sentences of a TokenStore, each a TokenView
+    """
+
+    def __init__(self, store: TokenStore):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store.sentence_starts) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('sentence index out of range')
+        starts = self.store.sentence_starts
+        return TokenView(self.store, int(starts[index]), int(starts[index + 1]))
@@ -0,0 +1,97 @@
+import random
+import unittest
+
+import conllu
+
+from advertisement_processing.regular_extractor.nlp_backend import NlpBackend
+from advertisement_processing.regular_extractor.text_processor import TextProcessor
+from advertisement_processing.regular_extractor.token_store import UNKNOWN_ID, SentenceView, TokenStore, TokenView
+
+
+class RandomSentenceBackend(NlpBackend):
+    """
+    Up to three sentences of random tokens for each text
+    """
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+
+    def parse(self, texts):
+        parsed = []
+        for _ in texts:
+            sentences = []
+            for _ in range(self.rng.randint(0, 3)):
+                tokens = [conllu.Token({'id': i, 'form': 'a', 'lemma': 'a', 'misc': None})
+                          for i in range(1, self.rng.randint(1, 12))]
+                sentences.append(conllu.TokenList(tokens))
+            parsed.append(sentences)
+        return parsed
+
+
+def scan_heading(heading_ranges, token_index):
+    for heading_index in range(len(heading_ranges) - 1):
+        if heading_ranges[heading_index] <= token_index < heading_ranges[heading_index + 1]:
+            return (heading_ranges[heading_index], heading_ranges[heading_index + 1])
+    return None
+
+
+class TokenStoreTest(unittest.TestCase):
+    def test_columns(self):
+        sentences = [[{'form': 'Správce', 'lemma': 'správce', 'misc': {'NE': 'if_1', 'Other': 'x'}},
+                      {'form': 'údajů', 'lemma': 'údaj', 'misc': {'SpaceAfter': 'No', 'NE': 'if_1-gu_2'}},
+                      {'form': '.', 'lemma': '.', 'misc': {'SpacesAfter': '\\n'}}],
+                     []]
+        tokens = TokenStore([sentences, [[{'form': 'údaj', 'lemma': 'údaj', 'misc': {'NE': 'if_1'}}]]])
+
+        self.assertEqual(len(tokens), 4)
+        self.assertEqual(tokens.sentence_starts.tolist(), [0, 3, 3, 4])
+        self.assertEqual(tokens.sentence_ids.tolist(), [0, 0, 0, 2])
+        self.assertEqual(tokens.tag_ids.tolist(), [0, 0, 0, 1])
+        self.assertEqual(tokens.space_after.tolist(), [True, False, True, True])
+        self.assertEqual(tokens.lemma_ids[1], tokens.form_ids[3])
+        self.assertEqual(tokens.id('osobní'), UNKNOWN_ID)
+
+        # one entity per label and tag
+        self.assertEqual([tokens.strings[type_id] for type_id in tokens.entity_types], ['if', 'gu', 'if'])
+        self.assertEqual(tokens.entity_starts.tolist(), [0, 1, 3])
+        self.assertEqual(tokens.entity_ends.tolist(), [1, 1, 3])
+        self.assertEqual(tokens.entity_text(0, 1), 'Správce údajů')
+
+        self.assertEqual(tokens.token(1), {'form': 'údajů', 'lemma': 'údaj', 'text_index': 1,
+                                           'misc': {'SpaceAfter': 'No', 'NE': 'if_1-gu_2'}})
+        self.assertEqual(tokens.token(2)['misc'], {'SpacesAfter': '\\n'})
+
+    def test_views(self):
+        sentences = [[{'form': form, 'lemma': form, 'misc': None} for form in 'abc'], [],
+                     [{'form': form, 'lemma': form, 'misc': None} for form in 'de']]
+        tokens = TokenStore([sentences])
+        view = TokenView(tokens, 0, len(tokens))
+        self.assertEqual([token['form'] for token in view[1:4]], ['b', 'c', 'd'])
+        self.assertEqual(view[-1]['text_index'], 4)
+        self.assertEqual(len(view[-3:2]), 0)
+        self.assertEqual([token['form'] for token in view[::2]], ['a', 'c', 'e'])
+        with self.assertRaises(IndexError):
+            view[5]
+
+        sentence_view = SentenceView(tokens)
+        self.assertEqual([len(sentence) for sentence in sentence_view], [3, 0, 2])
+        self.assertEqual(sentence_view[2][0], view[3])
+
+    def test_sentence_ranges_and_headings_same_as_scan(self):
+        for seed in range(50):
+            text_processor = TextProcessor('test', RandomSentenceBackend(seed))
+            tags = [random.Random(seed + i).choice(['h1', 'h2', 'p', 'p', 'li']) for i in range(8)]
+            text_processor.process([{'id': i, 'tag': tag, 'text': ''} for i, tag in enumerate(tags)])
+
+            tokens = text_processor.flattened_tokens
+            for sent_id, sentence in enumerate(text_processor.flattened_sentences):
+                if len(sentence) > 0:
+                    self.assertEqual(text_processor.start_end_from_sentence(sent_id),
+                                     (tokens.index(sentence[0]), tokens.index(sentence[-1])))
+            for token_index in range(-1, len(tokens) + 1):
+                self.assertEqual(text_processor.get_heading_for_token(token_index),
+                                 scan_heading(text_processor.heading_ranges, token_index))
+
+
+if __name__ == '__main__':
+    unittest.main()
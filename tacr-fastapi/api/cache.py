@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Bounded in-memory cache with LRU eviction and a time to live, sized by entries and by approximate bytes.
+
+    Values must not be modified after they are cached; None is a valid cached value, a miss is returned as
+    ResultCache.MISSING. The time to live bounds how long another server worker, which has its own cache,
+    may serve a value this worker has since invalidated.
+    """
+
+    MISSING = object()
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        """
+        :param max_entries: maximum number of cached values
+        :param max_bytes: maximum total size of the cached values as given to put
+        :param ttl: seconds a value is served for after it was put
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, size, expires = entry
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return self.MISSING
+
+    def put(self, key, value, size):
+        with self.lock:
+            self._remove(key)
+            if self.max_entries <= 0 or size > self.max_bytes:
+                return
+            self.entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
@@ -8,6 +8,12 @@ class Config:
     # number of interpolation steps for integrated gradients
     IG_SAMPLES = 25
 
+    # number of interpolation steps evaluated in a single forward and backward pass
+    IG_BATCH_SIZE = 13
+
+    # maximum number of tokens in a single forward and backward pass when attributing several blocks at once
+    IG_MAX_BATCH_TOKENS = 13 * 512
+
     # top X percent of positive attributions are kept
     ATTRS_TOP_PERCENT = 10
 
@@ -25,3 +31,111 @@ class Config:
 
     # number of hit tokens for a sentence to be a rationale
     FRACTION_TOKENS_HIT = 0.2
+
+    # number of blocks of a single page classified in one forward pass, or submitted to the batcher at once; the
+    # remaining blocks are skipped after the first chunk with a positive block
+    CLASSIFY_CHUNK_SIZE = 4
+
+    # maximum number of blocks classified in a single batched forward pass
+    CLASSIFY_MAX_BATCH_SIZE = 16
+
+    # maximum time in seconds a block waits for other requests' blocks before its batch is run
+    CLASSIFY_MAX_DELAY = 0.01
+
+    # maximum number of blocks waiting for classification, further requests get 503; a page of more blocks is only
+    # classified when no others are waiting
+    CLASSIFY_MAX_QUEUED_BLOCKS = 512
+
+    # maximum number of pages in a /classify/batch request, larger requests get 413
+    CLASSIFY_BATCH_MAX_PAGES = 256
+
+    # number of pages /classify/batch/stream classifies and stores together before sending their results
+    CLASSIFY_BATCH_STREAM_GROUP_SIZE = 32
+
+    # threads running the model (torch releases the GIL)
+    INFERENCE_THREADS = 2
+
+    # maximum number of queued and running model tasks, further requests get 503
+    INFERENCE_MAX_PENDING = 16
+
+    # processes running HTML parsing, MinHash and the cookie extractor
+    PARSING_PROCESSES = 2
+
+    # maximum number of queued and running parsing tasks, further requests get 503
+    PARSING_MAX_PENDING = 64
+
+    # multiprocessing start method of the parsing processes
+    PARSING_START_METHOD = 'spawn'
+
+    # number of worker processes started by serve.py, sharing the model loaded before forking
+    SERVER_WORKERS = 1
+
+    # torch threads per worker, CPU count divided by the number of workers if None
+    SERVER_TORCH_THREADS = None
+
+    # number of recently parsed pages kept for reuse by subsequent requests, and their maximum approximate bytes
+    # (HTML and texts) in each server worker
+    PARSED_DOCUMENT_CACHE_SIZE = 32
+    PARSED_DOCUMENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+    # parser used for plain text extraction, 'lxml' walks the lxml tree directly, 'bs4' builds a BeautifulSoup
+    # on top of it; both give the same text
+    HTML_TEXT_ENGINE = 'lxml'
+
+    # maximum number of characters extracted from a page streamed to the /stream endpoints, larger pages get 413
+    STREAM_MAX_TEXT_LENGTH = 4_000_000
+
+    # maximum number of bytes between two '<' of a page streamed to the /stream endpoints, e.g. an inline data: URI,
+    # held by the HTML parser until the next tag; longer runs get 413
+    STREAM_MAX_UNTAGGED_BYTES = 16 * 1024 * 1024
+
+    # threads feeding the bodies streamed to the /stream endpoints to the HTML parser, off the event loop
+    STREAM_PARSING_THREADS = 2
+
+    # maximum number of queued and running stream parsing tasks, one per streamed request, further requests get 503
+    STREAM_PARSING_MAX_PENDING = 64
+
+    # minimum Jaccard similarity of a page to its classified version for it to be unchanged, and of a page under
+    # another URL whose classification is reused by /classify
+    PAGE_DUPLICATE_THRESHOLD = 0.95
+
+    # minimum Jaccard similarity of a page to its analyzed version for it to be unchanged, and of a page under
+    # another URL whose analysis is reused by /cookies/analyze
+    COOKIES_DUPLICATE_THRESHOLD = 0.99
+
+    # files the near-duplicate indexes are saved to on shutdown and loaded from on startup, None to always
+    # build the indexes from the database
+    PAGES_INDEX_FILE = 'pages_index.pickle'
+    COOKIES_INDEX_FILE = 'cookies_index.pickle'
+
+    # in-process cache of database reads in api.crud: maximum entries, maximum approximate bytes and seconds an
+    # entry is served for; the time bounds how long other server workers may serve a record this worker changed
+    CRUD_CACHE_MAX_ENTRIES = 10000
+    CRUD_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    CRUD_CACHE_TTL = 30
+
+    # lemmatizer and named entity recognizer of the cookie extractor, 'lindat' for the UDPipe and NameTag web
+    # services, 'local' for the spacy_udpipe model of NLP_LOCAL_LANGUAGE with a rule-based recognizer of companies
+    # and addresses
+    NLP_BACKEND = 'lindat'
+    NLP_LOCAL_LANGUAGE = 'cs'
+
+    # LINDAT services lemmatizing the texts and recognizing named entities for the cookie extractor
+    UDPIPE_URL = 'http://lindat.mff.cuni.cz/services/udpipe/api/process'
+    NAMETAG_URL = 'http://lindat.mff.cuni.cz/services/nametag/api/recognize'
+
+    # maximum number of concurrent requests to the LINDAT services per process
+    NLP_MAX_CONNECTIONS = 8
+
+    # (connect, read) timeout in seconds of a request to the LINDAT services
+    NLP_TIMEOUT = (5, 60)
+
+    # retries of a failed request to the LINDAT services, the first after NLP_RETRY_BACKOFF seconds and each
+    # following one after twice as long
+    NLP_RETRIES = 3
+    NLP_RETRY_BACKOFF = 0.5
+
+    # send the element texts of a page to the LINDAT services as a few documents of at most NLP_DOCUMENT_MAX_LENGTH
+    # characters instead of one request per element; texts whose sentences cannot be mapped back are sent one by one
+    NLP_DOCUMENT_PER_PAGE = True
+    NLP_DOCUMENT_MAX_LENGTH = 100_000
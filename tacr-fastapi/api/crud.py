@@ -1,79 +1,345 @@
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from . import models
-from typing import List
+from .cache import ResultCache
+from .config import Config
+from typing import List, NamedTuple
 import json
 
 
-def get_page(db: Session, url: str) -> models.PageInfo | None:
+class PageRecord(NamedTuple):
+    url: str
+    is_advertisement: bool
+    minhash: object
+    content_hash: str | None
+
+
+class AnalysisRecord(NamedTuple):
+    url: str
+    minhash: object
+    content_hash: str | None
+    processed_html: str
+    entity_data_json: str
+
+
+class DomainRecord(NamedTuple):
+    domain: str
+    cookie_url: str
+
+
+# reads of hot URLs and domains served without a query; the getters return immutable records and every write
+# below invalidates the records it changes. Misses are not cached, so a URL stored by another server worker is
+# found at once instead of after the time to live
+cache = ResultCache(Config.CRUD_CACHE_MAX_ENTRIES, Config.CRUD_CACHE_MAX_BYTES, Config.CRUD_CACHE_TTL)
+
+# approximate size of a record besides its strings and hash values
+_RECORD_OVERHEAD = 200
+
+# number of URLs in one IN (...) clause, below the SQLite limit of bound parameters
+_IN_CHUNK_SIZE = 500
+
+
+def _record_size(record) -> int:
+    if isinstance(record, list):
+        return _RECORD_OVERHEAD + sum(len(item) for item in record)
+
+    size = _RECORD_OVERHEAD
+    for value in record:
+        if isinstance(value, str):
+            size += len(value)
+        elif hasattr(value, 'hashvalues'):
+            size += value.hashvalues.nbytes
+    return size
+
+
+def _cached(key, load):
+    record = cache.get(key)
+    if record is ResultCache.MISSING:
+        record = load()
+        if record is not None:
+            cache.put(key, record, _record_size(record))
+    return record
+
+
+def cache_stats() -> dict:
+    return cache.stats()
+
+
+def _page_record(page_info: models.PageInfo | None) -> PageRecord | None:
+    if page_info is None:
+        return None
+    return PageRecord(page_info.url, page_info.is_advertisement, page_info.minhash, page_info.content_hash)
+
+
+def _query_page(db: Session, url: str) -> models.PageInfo | None:
     return db.query(models.PageInfo).filter(models.PageInfo.url == url).first()
 
 
-def add_page(db: Session, is_advertisement: bool, url: str, minhash) -> models.PageInfo:
-    page_info = models.PageInfo(url=url, is_advertisement=is_advertisement, minhash=minhash)
+def _query_pages(db: Session, urls: List[str]) -> dict:
+    pages = {}
+    for i in range(0, len(urls), _IN_CHUNK_SIZE):
+        for page_info in db.query(models.PageInfo).filter(models.PageInfo.url.in_(urls[i:i + _IN_CHUNK_SIZE])):
+            pages[page_info.url] = page_info
+    return pages
+
+
+def get_page(db: Session, url: str) -> PageRecord | None:
+    return _cached(('page', url), lambda: _page_record(_query_page(db, url)))
+
+
+def add_page(db: Session, is_advertisement: bool, url: str, minhash, content_hash: str = None) -> PageRecord:
+    """
+    Stores a classified page; if a concurrent request, e.g. in another server worker, stored the URL first, keeps
+    and returns that page
+    """
+    page_info = models.PageInfo(url=url, is_advertisement=is_advertisement, minhash=minhash, content_hash=content_hash)
     db.add(page_info)
-    db.commit()
-    db.refresh(page_info)
-    return page_info
+    try:
+        db.commit()
+        db.refresh(page_info)
+    except IntegrityError:
+        db.rollback()
+        page_info = _query_page(db, url)
+        if page_info is None:
+            raise
+    finally:
+        cache.invalidate(('page', url), ('rationales', url))
+    return _page_record(page_info)
 
 
-def get_rationales(db: Session, url: str) -> List[models.Rationale] | None:
-    page_info = get_page(db, url)
-    if not page_info:
-        return None
+def get_pages(db: Session, urls: List[str]) -> dict:
+    """
+    Same as get_page for several URLs, the ones not cached are looked up together
+    :return: the stored pages by URL, without the URLs that are not stored
+    """
+    pages = {}
+    missing = []
+    for url in dict.fromkeys(urls):
+        record = cache.get(('page', url))
+        if record is ResultCache.MISSING:
+            missing.append(url)
+        elif record is not None:
+            pages[url] = record
+
+    stored = _query_pages(db, missing)
+    for url in missing:
+        record = _page_record(stored.get(url))
+        if record is not None:
+            cache.put(('page', url), record, _record_size(record))
+            pages[url] = record
+    return pages
+
 
-    return list(page_info.rationales)
+def store_pages(db: Session, pages: List[PageRecord]) -> None:
+    """
+    Stores classified pages in one transaction; the pages stored before, changed or stored by a concurrent request,
+    are updated and their rationales deleted
+    """
+    pages = list({page.url: page for page in pages}.values())
+    urls = [page.url for page in pages]
+    try:
+        for attempt in range(2):
+            stored = _query_pages(db, urls)
+            changed = list(stored)
+            for i in range(0, len(changed), _IN_CHUNK_SIZE):
+                db.query(models.Rationale).filter(models.Rationale.page_url.in_(changed[i:i + _IN_CHUNK_SIZE])) \
+                    .delete(synchronize_session=False)
+
+            for page in pages:
+                page_info = stored.get(page.url)
+                if page_info is None:
+                    db.add(models.PageInfo(url=page.url, is_advertisement=page.is_advertisement, minhash=page.minhash,
+                                           content_hash=page.content_hash))
+                else:
+                    page_info.is_advertisement = page.is_advertisement
+                    page_info.minhash = page.minhash
+                    page_info.content_hash = page.content_hash
+            try:
+                db.commit()
+                return
+            except IntegrityError:
+                # a concurrent request stored some of the URLs in the meantime, they are updated on the second attempt
+                db.rollback()
+                if attempt == 1:
+                    raise
+    finally:
+        cache.invalidate(*(('page', url) for url in urls), *(('rationales', url) for url in urls))
+
+
+def get_page_urls(db: Session) -> List[str]:
+    """
+    Returns the URLs of all pages with a MinHash, i.e. of those in the near-duplicate index
+    """
+    return [url for url, in db.query(models.PageInfo.url).filter(models.PageInfo.minhash.isnot(None))]
+
+
+def get_page_minhashes(db: Session):
+    """
+    Yields (url, minhash) of all pages with a MinHash
+    """
+    yield from db.query(models.PageInfo.url, models.PageInfo.minhash) \
+        .filter(models.PageInfo.minhash.isnot(None)).yield_per(1000)
+
+
+def get_page_content_hashes(db: Session):
+    """
+    Yields (url, content_hash) of all pages
+    """
+    yield from db.query(models.PageInfo.url, models.PageInfo.content_hash).yield_per(1000)
+
+
+def get_rationales(db: Session, url: str) -> List[str] | None:
+    """
+    Returns the texts of the rationales of the page, None if the page is not classified
+    """
+    def load():
+        page_info = _query_page(db, url)
+        if not page_info:
+            return None
+        return [rationale.text for rationale in page_info.rationales]
+
+    rationales = _cached(('rationales', url), load)
+    return None if rationales is None else list(rationales)
 
 
 def add_rationales(db: Session, rationales: List[str], url: str) -> None:
+    """
+    Stores the rationales of the page unless a concurrent request has stored them already
+    """
+    if db.query(models.Rationale.id).filter(models.Rationale.page_url == url).first() is not None:
+        cache.invalidate(('rationales', url))
+        return
+
     for rationale in rationales:
         db_rationale = models.Rationale(text=rationale, page_url=url)
         db.add(db_rationale)
     db.commit()
+    cache.invalidate(('rationales', url))
 
 
-def update_page_invalidate_rationales(db: Session, page_info: models.PageInfo, is_advertisement: bool, minhash):
+def update_page_invalidate_rationales(db: Session, page: PageRecord, is_advertisement: bool, minhash,
+                                      content_hash: str = None):
+    """
+    Replaces the classification of a stored page and deletes its rationales; the page is stored again if it was
+    deleted since its record was read
+    """
+    page_info = _query_page(db, page.url)
+    if page_info is None:
+        add_page(db, is_advertisement, page.url, minhash, content_hash)
+        return
     page_info.is_advertisement = is_advertisement
     page_info.minhash = minhash
+    page_info.content_hash = content_hash
     page_info.rationales[:] = []
     db.commit()
+    cache.invalidate(('page', page.url), ('rationales', page.url))
 
 
-def add_domain_to_cache(db: Session, domain: str, cookie_url: str) -> None:
+def set_content_hash(db: Session, record: PageRecord | AnalysisRecord, content_hash: str):
+    if record.content_hash == content_hash:
+        return
+
+    if isinstance(record, PageRecord):
+        model, key = models.PageInfo, ('page', record.url)
+    else:
+        model, key = models.CookiesAnalysis, ('analysis', record.url)
+    db.query(model).filter(model.url == record.url).update({model.content_hash: content_hash})
+    db.commit()
+    cache.invalidate(key)
+
+
+def add_domain_to_cache(db: Session, domain: str, cookie_url: str) -> bool:
+    """
+    :return: False if a URL is already cached for the domain
+    """
     domain_cache = models.DomainUrl(domain=domain, cookie_url=cookie_url)
     db.add(domain_cache)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    finally:
+        cache.invalidate(('domain', domain))
+    return True
 
 
 def update_domain_cache(db: Session, domain: str, cookie_url: str) -> bool:
-    domain_cache = get_cookie_url_from_cache(db, domain)
+    domain_cache = db.query(models.DomainUrl).filter(models.DomainUrl.domain == domain).first()
     if not domain_cache:
         return False
 
     domain_cache.cookie_url = cookie_url
     db.commit()
+    cache.invalidate(('domain', domain))
     return True
 
 
-def get_cookie_url_from_cache(db: Session, domain: str) -> models.DomainUrl | None:
-    return db.query(models.DomainUrl).filter(models.DomainUrl.domain == domain).first()
+def get_cookie_url_from_cache(db: Session, domain: str) -> DomainRecord | None:
+    def load():
+        domain_cache = db.query(models.DomainUrl).filter(models.DomainUrl.domain == domain).first()
+        return DomainRecord(domain_cache.domain, domain_cache.cookie_url) if domain_cache else None
+
+    return _cached(('domain', domain), load)
+
+
+def get_analysis(db: Session, url: str) -> AnalysisRecord | None:
+    def load():
+        analysis = db.query(models.CookiesAnalysis).filter(models.CookiesAnalysis.url == url).first()
+        if analysis is None:
+            return None
+        return AnalysisRecord(analysis.url, analysis.minhash, analysis.content_hash, analysis.processed_html,
+                              analysis.entity_data_json)
 
+    return _cached(('analysis', url), load)
 
-def get_analysis(db: Session, url: str) -> models.CookiesAnalysis | None:
-    return db.query(models.CookiesAnalysis).filter(models.CookiesAnalysis.url == url).first()
 
+def get_analysis_urls(db: Session) -> List[str]:
+    """
+    Returns the URLs of all analyses with a MinHash, i.e. of those in the near-duplicate index
+    """
+    return [url for url, in db.query(models.CookiesAnalysis.url).filter(models.CookiesAnalysis.minhash.isnot(None))]
 
-def delete_analysis(db: Session, analysis: models.CookiesAnalysis):
-    db.delete(analysis)
+
+def get_analysis_minhashes(db: Session):
+    """
+    Yields (url, minhash) of all analyses with a MinHash
+    """
+    yield from db.query(models.CookiesAnalysis.url, models.CookiesAnalysis.minhash) \
+        .filter(models.CookiesAnalysis.minhash.isnot(None)).yield_per(1000)
+
+
+def get_analysis_content_hashes(db: Session):
+    """
+    Yields (url, content_hash) of all analyses
+    """
+    yield from db.query(models.CookiesAnalysis.url, models.CookiesAnalysis.content_hash).yield_per(1000)
+
+
+def delete_analysis(db: Session, analysis: AnalysisRecord):
+    db.query(models.CookiesAnalysis).filter(models.CookiesAnalysis.url == analysis.url).delete()
     db.commit()
+    cache.invalidate(('analysis', analysis.url))
 
 
-def create_analysis(db: Session, url: str, modified_html: str, entity_data: dict, minhash):
+def create_analysis(db: Session, url: str, modified_html: str, entity_data: dict, minhash, content_hash: str = None):
+    """
+    Stores the analysis of a page; if a concurrent request stored the URL first, keeps that analysis
+    """
     analysis = models.CookiesAnalysis(
         url=url,
         processed_html=modified_html,
         minhash=minhash,
+        content_hash=content_hash,
         entity_data_json=json.dumps(entity_data)
     )
     db.add(analysis)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        if db.query(models.CookiesAnalysis.url).filter(models.CookiesAnalysis.url == url).first() is None:
+            raise
+    finally:
+        cache.invalidate(('analysis', url))
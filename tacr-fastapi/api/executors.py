@@ -0,0 +1,76 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """
+    Raised when a pool already holds its maximum number of queued and running tasks
+    """
+
+    def __init__(self, pool_name):
+        super().__init__(f'{pool_name} pool is saturated')
+        self.pool_name = pool_name
+
+
+class ExecutionPool:
+    """
+    Runs blocking work off the event loop in a thread or process pool with a bounded number of pending tasks.
+
+    Thread pools suit torch, which releases the GIL during forward and backward passes; process pools suit pure
+    Python work such as BeautifulSoup parsing. The executor is created on first use and its threads or processes
+    are started on the first submitted task, so a pool constructed at import time does not start any before
+    the server forks its workers.
+    """
+
+    def __init__(self, name, kind, workers, max_pending, start_method='spawn'):
+        """
+        :param name: pool name used in errors
+        :param kind: 'thread' or 'process'
+        :param workers: number of threads or processes
+        :param max_pending: maximum number of queued and running tasks, further tasks are rejected with PoolSaturated
+        :param start_method: multiprocessing start method of a process pool
+        """
+        if kind not in ('thread', 'process'):
+            raise ValueError(f'Unknown pool kind {kind}')
+
+        self.name = name
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.start_method = start_method
+        self.pending = 0
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.kind == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context(self.start_method))
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) in the pool and waits for the result
+
+        For process pools, fn, its arguments and its result must be picklable
+        :raises PoolSaturated: if max_pending tasks are already queued or running
+        """
+        if self.pending >= self.max_pending:
+            raise PoolSaturated(self.name)
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -1,7 +1,14 @@
+import asyncio
 import json
+import os
+from typing import List
 from sqlalchemy.orm import Session
 
-from utils.document_similarity import document_to_minhash, are_documents_same
+from utils.document_similarity import are_documents_same
+from utils.parsed_document import DocumentCache, ParsedDocument, NUM_PERM, computed_all
+from utils.minhash_index import MinHashIndex
+from utils.html_stream import HtmlStreamParser, UnsupportedEncoding, MalformedBody, TextLimitExceeded, \
+    UntaggedRunExceeded, charset_from_content_type
 
 from .schemas import *
 from .config import Config
@@ -9,12 +16,17 @@ from .config import Config
 from . import models
 from .database import SessionLocal, engine
 from . import crud
+from . import migrations
+from .executors import ExecutionPool, PoolSaturated
+from .singleflight import SingleFlight
 
 from advertisement_processing import classification
 from advertisement_processing import attribution
+from advertisement_processing.batching import BlockBatcher
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 import transformers
 import torch
 import spacy_udpipe
@@ -24,6 +36,7 @@ from utils.html_utils import analyze_cookies
 spacy_udpipe.download('cs')
 
 models.Base.metadata.create_all(bind=engine)
+migrations.migrate(engine)
 app = FastAPI()
 
 app.add_middleware(
@@ -48,6 +61,131 @@ device = 'cuda' if torch.cuda.is_available() else 'cpu'
 model = transformers.AutoModelForSequenceClassification.from_pretrained(Config.MODEL_FILE).to(device)
 tokenizer = transformers.AutoTokenizer.from_pretrained(Config.MODEL_FILE)
 
+# torch work runs in threads, BeautifulSoup and extractor work in processes, streamed bodies are fed to lxml in
+# threads as they arrive
+inference = ExecutionPool('inference', 'thread', Config.INFERENCE_THREADS, Config.INFERENCE_MAX_PENDING)
+parsing = ExecutionPool('parsing', 'process', Config.PARSING_PROCESSES, Config.PARSING_MAX_PENDING,
+                        start_method=Config.PARSING_START_METHOD)
+streaming = ExecutionPool('streaming', 'thread', Config.STREAM_PARSING_THREADS, Config.STREAM_PARSING_MAX_PENDING)
+batcher = BlockBatcher(model, tokenizer.pad_token_id, Config.CLASSIFY_MAX_BATCH_SIZE, Config.CLASSIFY_MAX_DELAY,
+                       pool=inference, max_queued=Config.CLASSIFY_MAX_QUEUED_BLOCKS)
+
+# pages parsed by recent requests, shared between the endpoints
+documents = DocumentCache(Config.PARSED_DOCUMENT_CACHE_SIZE, Config.PARSED_DOCUMENT_CACHE_MAX_BYTES)
+
+# classifications and rationales being computed, shared by concurrent requests for the same page
+flights = SingleFlight()
+
+# near-duplicate indexes of the classified and the analyzed pages; each server worker keeps its own copy updated
+# with its own inserts
+with SessionLocal() as db:
+    pages_index = MinHashIndex.load_or_build(Config.PAGES_INDEX_FILE, Config.PAGE_DUPLICATE_THRESHOLD, NUM_PERM,
+                                             crud.get_page_urls(db), lambda: crud.get_page_minhashes(db))
+    cookies_index = MinHashIndex.load_or_build(Config.COOKIES_INDEX_FILE, Config.COOKIES_DUPLICATE_THRESHOLD, NUM_PERM,
+                                               crud.get_analysis_urls(db), lambda: crud.get_analysis_minhashes(db))
+
+# process that loaded the indexes; the workers forked from it by serve.py miss each other's inserts, so they do not
+# save their copies and serve.py saves indexes rebuilt from the database instead
+index_owner = os.getpid()
+
+
+def rebuild_indexes():
+    """
+    Rebuilds the near-duplicate indexes from the database, with the pages of all server workers
+    """
+    global pages_index, cookies_index
+    with SessionLocal() as db:
+        pages_index = MinHashIndex.build(crud.get_page_minhashes(db), Config.PAGE_DUPLICATE_THRESHOLD, NUM_PERM)
+        cookies_index = MinHashIndex.build(crud.get_analysis_minhashes(db), Config.COOKIES_DUPLICATE_THRESHOLD,
+                                           NUM_PERM)
+
+
+@app.on_event('shutdown')
+def shutdown_pools():
+    inference.shutdown()
+    parsing.shutdown()
+    streaming.shutdown()
+
+
+@app.on_event('shutdown')
+def save_indexes():
+    """
+    Saves the near-duplicate indexes, only in the process that loaded them
+    """
+    if os.getpid() != index_owner:
+        return
+    for index, path in ((pages_index, Config.PAGES_INDEX_FILE), (cookies_index, Config.COOKIES_INDEX_FILE)):
+        if path:
+            index.save(path)
+
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    return JSONResponse(status_code=503, content={'detail': str(exc)}, headers={'Retry-After': '1'})
+
+
+async def parse(page: Page, *names):
+    """
+    Returns the parsed document of the page with the given attributes computed in the parsing pool
+    """
+    return await materialize(page.url, documents.get(page.url, page.text), *names)
+
+
+async def materialize(url, document: ParsedDocument, *names):
+    """
+    Returns the document with the given attributes computed in the parsing pool, if they are not yet
+    """
+    missing = [name for name in names if not document.has(name)]
+    if missing:
+        document.update(await parsing.run(document.computed, *missing))
+        if document.html is not None:
+            documents.put(url, document)
+    return document
+
+
+async def materialize_many(urls, parsed: List[ParsedDocument], *names):
+    """
+    Same as materialize for several documents, computed in at most one parsing task per parsing process
+    """
+    parsed = list(parsed)
+    missing = [i for i, document in enumerate(parsed) if not all(document.has(name) for name in names)]
+    slices = [missing[i::Config.PARSING_PROCESSES] for i in range(Config.PARSING_PROCESSES)]
+    slices = [indices for indices in slices if indices]
+    results = await asyncio.gather(*(parsing.run(computed_all, [parsed[i] for i in indices], *names)
+                                     for indices in slices))
+    for indices, states in zip(slices, results):
+        for i, state in zip(indices, states):
+            document = parsed[i]
+            document.update(state)
+            if document.html is not None:
+                documents.put(urls[i], document)
+    return parsed
+
+
+async def parse_stream(request: Request) -> ParsedDocument:
+    """
+    Extracts the texts of a page whose HTML is streamed in the request body, optionally compressed as given by
+    Content-Encoding
+
+    Only the extracted text is kept in memory; script and style contents are dropped while parsing.
+    """
+    try:
+        parser = HtmlStreamParser(request.headers.get('content-encoding'),
+                                  charset_from_content_type(request.headers.get('content-type')),
+                                  Config.STREAM_MAX_TEXT_LENGTH, Config.STREAM_MAX_UNTAGGED_BYTES)
+        async for chunk in request.stream():
+            await streaming.run(parser.feed, chunk)
+        extractor = await streaming.run(parser.close)
+    except (UnsupportedEncoding, LookupError) as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except MalformedBody as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (TextLimitExceeded, UntaggedRunExceeded) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    return ParsedDocument.from_texts(extractor.text, extractor.paragraph_text)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -56,6 +194,53 @@ def get_db():
         db.close()
 
 
+async def coalesced(key, fn, *args):
+    """
+    Returns fn(db, *args), computed once for all concurrent requests with the same key
+
+    The computation gets a session of its own, it outlives the request that started it if that one is cancelled.
+    """
+    async def run():
+        with SessionLocal() as db:
+            return await fn(db, *args)
+
+    return await flights.run(key, run)
+
+
+async def is_page_unchanged(db: Session, record, url, document: ParsedDocument, threshold):
+    """
+    Compares a page to its stored version, first by the hash of its normalized text and only if that differs by
+    the MinHash similarity, which is computed just then
+
+    :param record: the stored page, with minhash and content_hash attributes
+    :return: whether the page is unchanged, and the document with its MinHash if it was computed
+    """
+    if record.content_hash is not None and record.content_hash == document.content_hash:
+        return True, document
+
+    document = await materialize(url, document, 'minhash')
+    if not are_documents_same(document.minhash, record.minhash, threshold=threshold):
+        return False, document
+
+    # the next request with this text is recognized by the hash
+    crud.set_content_hash(db, record, document.content_hash)
+    return True, document
+
+
+def find_near_duplicate(db: Session, index: MinHashIndex, get_record, url, minhash, threshold):
+    """
+    Returns the stored record of a page under another URL similar to the page with the given MinHash, or None
+
+    The candidates proposed by the index are verified against the MinHash stored with the record
+    :param get_record: function (db, url) returning the record with a minhash attribute, e.g. crud.get_page
+    """
+    for candidate_url, _ in index.query(minhash, exclude=url):
+        record = get_record(db, candidate_url)
+        if record is not None and are_documents_same(minhash, record.minhash, threshold=threshold):
+            return record
+    return None
+
+
 @app.get("/")
 async def root():
     """
@@ -63,6 +248,14 @@ async def root():
     """
     return {"message": "It works!"}
 
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit and miss counters, number of entries and approximate size in bytes of this worker's database read cache
+    """
+    return crud.cache_stats()
+
 # ----------------------------------------- COOKIES -----------------------------------------
 
 @app.post("/cookies/analyze", response_model=CookiesAnalysis)
@@ -78,40 +271,48 @@ async def analyze(page: Page, db: Session = Depends(get_db)):
     analysis = crud.get_analysis(db, page.url)
     if analysis:
         # if yes, check if the page changed
-        minhash = document_to_minhash(page.text)
-        if not are_documents_same(minhash, analysis.minhash, threshold=0.99):
+        document = await parse(page, 'content_hash')
+        unchanged, document = await is_page_unchanged(db, analysis, page.url, document, Config.COOKIES_DUPLICATE_THRESHOLD)
+        if not unchanged:
             # if it did, invalidate cache
             crud.delete_analysis(db, analysis)
+            cookies_index.remove(page.url)
             analysis = None
         else:
             # TODO if it did not, return the rendered HTML with sidebar
-            return CookiesAnalysis(
-                url=page.url, 
-                entities=[
-                    EntityInfo(short_text=e['short_text'], entity=category_names[e['type']]) for e in json.loads(analysis.entity_data_json)
-                ], 
-                page_to_render=PageToRender(html=analysis.processed_html)
-            )
+            return analysis_response(page.url, json.loads(analysis.entity_data_json), analysis.processed_html)
     
     # the URL is not cached
-    minhash = document_to_minhash(page.text)
+    document = await parse(page, 'content_hash', 'minhash')
+    minhash = document.minhash
+
+    # the same page may have been analyzed under another URL
+    duplicate = find_near_duplicate(db, cookies_index, crud.get_analysis, page.url, minhash,
+                                    Config.COOKIES_DUPLICATE_THRESHOLD)
+    if duplicate:
+        return analysis_response(page.url, json.loads(duplicate.entity_data_json), duplicate.processed_html)
 
     # get the processed page
-    modified_html, entity_data = analyze_cookies(page.text)
+    modified_html, entity_data = await parsing.run(analyze_cookies, page.text)
 
     # TODO create rendered HTML with sidebar
     modified_html = modified_html
 
     # cache original minhash, modified HTML, URL, short texts of entities, IDs and offsets of context elements
-    crud.create_analysis(db, page.url, modified_html, entity_data, minhash)
+    crud.create_analysis(db, page.url, modified_html, entity_data, minhash, document.content_hash)
+    cookies_index.insert(page.url, minhash)
 
     # return rendered HTML with sidebar
+    return analysis_response(page.url, entity_data, modified_html)
+
+
+def analysis_response(url, entity_data, html):
     return CookiesAnalysis(
-        url=page.url, 
+        url=url,
         entities=[
             EntityInfo(short_text=e['short_text'], entity=category_names[e['type']]) for e in entity_data
         ], 
-        page_to_render=PageToRender(html=modified_html)
+        page_to_render=PageToRender(html=html)
     )
 
 
@@ -134,7 +335,7 @@ async def analyze(request: SelectEntityRequest, db: Session = Depends(get_db)):
 # ----------------------------------------- ADS CLASSIFICATION, RATIONALES -----------------------------------------
 
 @app.post("/classify", response_model=Classification)
-async def classify(page: Page, db: Session = Depends(get_db)):
+async def classify(page: Page):
     """
     Returns the classification of a page
 
@@ -142,34 +343,202 @@ async def classify(page: Page, db: Session = Depends(get_db)):
 
     Future requests for a classified page will return the cached classification
 
+    Concurrent requests for the same URL and HTML share one classification
+
     If no text can be extracted from the page, returns 400
     """
+    return await coalesced(('classify', *DocumentCache.key(page.url, page.text)), classify_page, page)
+
+
+async def classify_page(db: Session, page: Page):
+    document = await parse(page, 'text', 'content_hash')
+    return await classify_document(db, page.url, document)
+
+
+@app.post("/classify/stream", response_model=Classification)
+async def classify_stream(url: str, request: Request):
+    """
+    Same as /classify for the page HTML sent as the raw request body, for very large pages
+
+    The body may be compressed, gzip, deflate or br (with the brotli package installed) as given by
+    Content-Encoding; the URL is a query parameter
+
+    Concurrent requests for the same URL and page text share one classification
+
+    Returns 413 if the page text is longer than Config.STREAM_MAX_TEXT_LENGTH, 415 for unsupported encodings
+    """
+    document = await parse_stream(request)
+    return await coalesced(('classify/stream', url, document.content_hash), classify_document, url, document)
+
+
+async def classify_document(db: Session, url: str, document: ParsedDocument):
     # check if the page is cac1hed
-    page_info = crud.get_page(db, page.url)
+    page_info = crud.get_page(db, url)
     if page_info:
         print('classify - cached')
         # if it is, check if the page changed - if it did, update the minhash and is_advertisement stuff
         # then delete all rationales and force new ones on next request
-        minhash = document_to_minhash(page.text)
-        if not are_documents_same(minhash, page_info.minhash):
+        unchanged, document = await is_page_unchanged(db, page_info, url, document, Config.PAGE_DUPLICATE_THRESHOLD)
+        if not unchanged:
             print('documents not same')
-            cls, minhash = classification.classify(page.text, model, tokenizer)
-            crud.update_page_invalidate_rationales(db, page_info, cls, minhash)
+            cls, minhash = await classification.classify_batched(document, tokenizer, batcher, inference)
+            if cls is None:
+                raise HTTPException(status_code=400, detail='Page HTML contains no plain text')
+            crud.update_page_invalidate_rationales(db, page_info, cls, minhash, document.content_hash)
+            pages_index.insert(url, minhash)
             return Classification(is_advertisement=cls)
 
         print('documents same')
         return Classification(is_advertisement=page_info.is_advertisement)
 
-    cls, minhash = classification.classify(page.text, model, tokenizer)
+    # the same page may have been classified under another URL
+    document = await materialize(url, document, 'minhash')
+    duplicate = find_near_duplicate(db, pages_index, crud.get_page, url, document.minhash,
+                                    Config.PAGE_DUPLICATE_THRESHOLD)
+    if duplicate:
+        crud.add_page(db, is_advertisement=duplicate.is_advertisement, url=url, minhash=document.minhash,
+                      content_hash=document.content_hash)
+        pages_index.insert(url, document.minhash)
+        return Classification(is_advertisement=duplicate.is_advertisement)
+
+    cls, minhash = await classification.classify_batched(document, tokenizer, batcher, inference)
     if cls is None:
         raise HTTPException(status_code=400, detail='Page HTML contains no plain text')
     else:
-        crud.add_page(db, is_advertisement=cls, url=page.url, minhash=minhash)
+        crud.add_page(db, is_advertisement=cls, url=url, minhash=minhash, content_hash=document.content_hash)
+        pages_index.insert(url, minhash)
         return Classification(is_advertisement=cls)
 
 
+@app.post("/classify/batch", response_model=List[BatchClassification])
+async def classify_batch(pages: List[Page], db: Session = Depends(get_db)):
+    """
+    Returns the classifications of several pages, in the order of the pages
+
+    Same as /classify for each page, but the stored pages are looked up together, the pages to be classified share
+    padded batches of the model and all new classifications are stored in one transaction
+
+    A page without text gets an error instead of failing the request; of pages with the same URL only the first
+    one is classified
+
+    More than Config.CLASSIFY_BATCH_MAX_PAGES pages return 413
+    """
+    check_batch_size(pages)
+    results = [None] * len(pages)
+    async for group in classify_pages(db, list(enumerate(pages))):
+        for i, result in group:
+            results[i] = result
+    return results
+
+
+@app.post("/classify/batch/stream")
+async def classify_batch_stream(pages: List[Page]):
+    """
+    Same as /classify/batch, but the results are streamed as newline-delimited JSON as soon as they are known,
+    each line a classification with the index of its page in the request
+
+    The pages are classified and stored in groups of Config.CLASSIFY_BATCH_STREAM_GROUP_SIZE pages; the results of
+    stored and near-duplicate pages of a group come before those needing the model
+    """
+    check_batch_size(pages)
+    indexed_pages = list(enumerate(pages))
+    group_size = Config.CLASSIFY_BATCH_STREAM_GROUP_SIZE
+
+    async def lines():
+        with SessionLocal() as db:
+            for start in range(0, len(indexed_pages), group_size):
+                async for group in classify_pages(db, indexed_pages[start:start + group_size]):
+                    for i, result in group:
+                        yield json.dumps({'index': i, **result.model_dump()}) + '\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
+def check_batch_size(pages: List[Page]):
+    if len(pages) > Config.CLASSIFY_BATCH_MAX_PAGES:
+        raise HTTPException(status_code=413, detail=f'At most {Config.CLASSIFY_BATCH_MAX_PAGES} pages per request')
+
+
+async def classify_pages(db: Session, indexed_pages):
+    """
+    Classifies pages as classify_document does, yields the (index, BatchClassification) of the pages decided without
+    the model and then of the pages classified by it, once all new classifications are stored in one transaction
+
+    :param indexed_pages: list of (index, Page)
+    """
+    indices = {}
+    for i, page in indexed_pages:
+        indices.setdefault(page.url, []).append(i)
+    pages = [page for i, page in indexed_pages if indices[page.url][0] == i]
+    urls = [page.url for page in pages]
+
+    def results(classifications):
+        return [(i, classification) for classification in classifications for i in indices[classification.url]]
+
+    docs = await materialize_many(urls, [documents.get(page.url, page.text) for page in pages], 'text', 'content_hash')
+    stored = crud.get_pages(db, urls)
+
+    # the MinHash is needed by new pages and by stored pages whose text differs
+    needs_minhash = [i for i, url in enumerate(urls)
+                     if url not in stored or stored[url].content_hash != docs[i].content_hash]
+    for i, document in zip(needs_minhash, await materialize_many([urls[i] for i in needs_minhash],
+                                                                  [docs[i] for i in needs_minhash], 'minhash')):
+        docs[i] = document
+
+    decided = []
+    to_store = []
+    to_classify = []
+    for url, document in zip(urls, docs):
+        page_info = stored.get(url)
+        if page_info:
+            unchanged, document = await is_page_unchanged(db, page_info, url, document,
+                                                          Config.PAGE_DUPLICATE_THRESHOLD)
+            if unchanged:
+                decided.append(BatchClassification(url=url, is_advertisement=page_info.is_advertisement))
+                continue
+        else:
+            duplicate = find_near_duplicate(db, pages_index, crud.get_page, url, document.minhash,
+                                            Config.PAGE_DUPLICATE_THRESHOLD)
+            if duplicate:
+                decided.append(BatchClassification(url=url, is_advertisement=duplicate.is_advertisement))
+                to_store.append(crud.PageRecord(url, duplicate.is_advertisement, document.minhash,
+                                                document.content_hash))
+                continue
+        to_classify.append((url, document))
+
+    if not to_classify:
+        store_classified(db, to_store)
+        yield results(decided)
+        return
+    yield results(decided)
+
+    pages_blocks = await inference.run(classification.texts_to_blocks, [document.text for _, document in to_classify],
+                                       tokenizer)
+    classes = await inference.run(classification.predict_pages, pages_blocks, model, tokenizer.pad_token_id,
+                                  Config.CLASSIFY_MAX_BATCH_SIZE)
+
+    classified = []
+    for (url, document), cls in zip(to_classify, classes):
+        if cls is None:
+            classified.append(BatchClassification(url=url, error='Page HTML contains no plain text'))
+        else:
+            classified.append(BatchClassification(url=url, is_advertisement=cls))
+            to_store.append(crud.PageRecord(url, cls, document.minhash, document.content_hash))
+
+    store_classified(db, to_store)
+    yield results(classified)
+
+
+def store_classified(db: Session, pages: List[crud.PageRecord]):
+    if not pages:
+        return
+    crud.store_pages(db, pages)
+    for page in pages:
+        pages_index.insert(page.url, page.minhash)
+
+
 @app.post("/rationale", response_model=Rationales)
-async def attribute(page: Page, db: Session = Depends(get_db)):
+async def attribute(page: Page):
     """
     Returns the rationales for ad-positive classification of a page:
 
@@ -179,21 +548,51 @@ async def attribute(page: Page, db: Session = Depends(get_db)):
 
     If the URL is not in the classification cache, returns 400
 
+    Concurrent requests for the same URL and HTML share one computation of the rationales
+
     If no text can be extracted from the page, returns 400
     """
-    rationales = crud.get_rationales(db, page.url)
+    async def paragraph_text():
+        return (await parse(page, 'paragraph_text')).paragraph_text
+
+    return await coalesced(('rationale', *DocumentCache.key(page.url, page.text)), attribute_page, page.url,
+                           paragraph_text)
+
+
+@app.post("/rationale/stream", response_model=Rationales)
+async def attribute_stream(url: str, request: Request):
+    """
+    Same as /rationale for the page HTML sent as the raw request body, see /classify/stream
+
+    Concurrent requests for the same URL and page text share one computation; each request reads its own body
+    first, so an invalid body fails only its own request
+    """
+    document = await parse_stream(request)
+
+    async def paragraph_text():
+        return document.paragraph_text
+
+    return await coalesced(('rationale/stream', url, document.content_hash), attribute_page, url, paragraph_text)
+
+
+async def attribute_page(db: Session, url: str, paragraph_text):
+    """
+    :param paragraph_text: coroutine function returning the paragraph text of the page, called only if the
+    rationales are not cached
+    """
+    rationales = crud.get_rationales(db, url)
 
     if rationales is None:
         raise HTTPException(status_code=400, detail='URL has not been classified yet')
 
     if len(rationales) == 0:
-        rationales = attribution.rationales(page.text, model, tokenizer)
+        rationales = await inference.run(attribution.rationales_from_text, await paragraph_text(), model, tokenizer)
 
-    if rationales is None:
-        raise HTTPException(status_code=400, detail='Page HTML contains no plain text')
-    else:
-        crud.add_rationales(db, rationales=rationales, url=page.url)
-        return Rationales(rationales=rationales)
+        if rationales is None:
+            raise HTTPException(status_code=400, detail='Page HTML contains no plain text')
+        crud.add_rationales(db, rationales=rationales, url=url)
+
+    return Rationales(rationales=rationales)
 
 
 # ----------------------------------------- DOMAIN-URL CACHE -----------------------------------------
@@ -208,11 +607,9 @@ async def add_domain_cookies(request: DomainCacheRequest, domain: str, db: Sessi
     """
     # check if present
     cookie_url = crud.get_cookie_url_from_cache(db, domain)
-    if cookie_url:
+    if cookie_url or not crud.add_domain_to_cache(db, domain, request.url):
         raise HTTPException(status_code=400, detail='Cookies URL already in cache for domain')
 
-    crud.add_domain_to_cache(db, domain, request.url)
-
 
 @app.put("/domains/{domain}")
 async def update_domain_cookies(request: DomainCacheRequest, domain: str, db: Session = Depends(get_db)):   
@@ -0,0 +1,71 @@
+"""
+Migrations of database.db written by older versions of the server, run on startup.
+
+    python -m api.migrations
+"""
+import pickle
+
+from sqlalchemy import text, inspect
+
+from utils.document_similarity import minhash_to_bytes
+from utils.parsed_document import NUM_PERM
+
+# tables with a minhash column and their primary keys
+MINHASH_TABLES = [('pages', 'url'), ('cookies_analysis', 'url')]
+
+
+def migrate(engine):
+    """
+    Brings the tables created by create_all up to date, runs all migrations
+    """
+    add_content_hash_columns(engine)
+    migrate_pickled_minhashes(engine)
+
+
+def add_content_hash_columns(engine):
+    """
+    Adds the content_hash column to the tables with a minhash column, left empty for the existing rows
+    :return: names of the altered tables
+    """
+    altered = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table, _ in MINHASH_TABLES:
+            if 'content_hash' not in [column['name'] for column in inspector.get_columns(table)]:
+                connection.execute(text(f'ALTER TABLE {table} ADD COLUMN content_hash VARCHAR(16)'))
+                altered.append(table)
+    return altered
+
+
+def migrate_pickled_minhashes(engine):
+    """
+    Rewrites MinHashes stored pickled, by the former PickleType minhash columns, as hash value buffers
+
+    Stored buffers have exactly NUM_PERM * 8 bytes, pickled MinHashes are several times larger.
+    :return: number of converted rows
+    """
+    converted = 0
+    with engine.begin() as connection:
+        for table, key in MINHASH_TABLES:
+            rows = connection.execute(
+                text(f'SELECT {key}, minhash FROM {table} WHERE minhash IS NOT NULL AND length(minhash) != :size'),
+                {'size': NUM_PERM * 8}
+            ).fetchall()
+
+            for key_value, data in rows:
+                minhash = pickle.loads(data)
+                connection.execute(text(f'UPDATE {table} SET minhash = :minhash WHERE {key} = :key'),
+                                   {'minhash': minhash_to_bytes(minhash), 'key': key_value})
+            converted += len(rows)
+
+    if converted:
+        # give the space of the pickles back to the filesystem
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text('VACUUM'))
+    return converted
+
+
+if __name__ == '__main__':
+    from api.database import engine
+    print(f'Added content_hash to {add_content_hash_columns(engine)}')
+    print(f'Converted {migrate_pickled_minhashes(engine)} pickled MinHashes')
@@ -1,9 +1,29 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, PickleType, Text
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, LargeBinary
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 
+from utils.document_similarity import minhash_to_bytes, minhash_from_bytes
 from .database import Base
 
 
+class MinHashType(TypeDecorator):
+    """
+    MinHash stored as a fixed-width buffer of its hash values, read back as a LeanMinHash
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return minhash_to_bytes(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return minhash_from_bytes(value)
+
+
 class PageInfo(Base):
     __tablename__ = 'pages'
 
@@ -23,7 +43,13 @@ class PageInfo(Base):
 
     minhash = Column(
         'minhash',
-        PickleType()
+        MinHashType()
+    )
+
+    # xxhash64 of the normalized plain text, None for pages stored before it was introduced
+    content_hash = Column(
+        'content_hash',
+        String(16)
     )
 
 
@@ -76,7 +102,12 @@ class CookiesAnalysis(Base):
 
     minhash = Column(
         'minhash',
-        PickleType()
+        MinHashType()
+    )
+
+    content_hash = Column(
+        'content_hash',
+        String(16)
     )
 
     processed_html = Column(
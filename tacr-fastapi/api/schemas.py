@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 
 class Page(BaseModel):
@@ -15,6 +15,13 @@ class Classification(BaseModel):
     is_advertisement: bool
 
 
+class BatchClassification(BaseModel):
+    url: str
+    # None if the page could not be classified, see error
+    is_advertisement: Optional[bool] = None
+    error: Optional[str] = None
+
+
 class Rationales(BaseModel):
     rationales: List[str]
 
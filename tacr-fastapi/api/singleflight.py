@@ -0,0 +1,36 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first call starts the computation, calls arriving while
+    it runs wait for the same result or exception instead of starting their own.
+
+    The computation runs as a separate task, so it finishes, and its results are stored, even if the request that
+    started it is cancelled; the other waiters are not affected.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def __len__(self):
+        return len(self.tasks)
+
+    async def run(self, key, fn, *args, **kwargs):
+        """
+        Returns the result of the coroutine function fn(*args, **kwargs), shared with all concurrent calls with
+        the same key
+        """
+        task = self.tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self.tasks[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+        if not task.cancelled():
+            # retrieved here so that an exception nobody awaited any more is not reported as never retrieved
+            task.exception()
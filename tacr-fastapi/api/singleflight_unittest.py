@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+
+from api.singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.flights = SingleFlight()
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def compute(self, value):
+        self.calls += 1
+        await self.release.wait()
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    async def test_concurrent_calls_share_result(self):
+        waiters = [asyncio.ensure_future(self.flights.run('page', self.compute, i)) for i in range(5)]
+        await asyncio.sleep(0)
+        self.release.set()
+
+        self.assertEqual(await asyncio.gather(*waiters), [0] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(self.flights), 0)
+
+    async def test_different_keys_run_separately(self):
+        waiters = [asyncio.ensure_future(self.flights.run(key, self.compute, key)) for key in ('a', 'b')]
+        await asyncio.sleep(0)
+        self.release.set()
+
+        self.assertEqual(await asyncio.gather(*waiters), ['a', 'b'])
+        self.assertEqual(self.calls, 2)
+
+    async def test_exception_reaches_all_waiters(self):
+        waiters = [asyncio.ensure_future(self.flights.run('page', self.compute, ValueError('no text')))
+                   for _ in range(3)]
+        await asyncio.sleep(0)
+        self.release.set()
+
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(self.calls, 1)
+
+    async def test_cancelled_first_caller_does_not_cancel_others(self):
+        first = asyncio.ensure_future(self.flights.run('page', self.compute, 1))
+        second = asyncio.ensure_future(self.flights.run('page', self.compute, 2))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        self.release.set()
+
+        self.assertEqual(await second, 1)
+        self.assertTrue(first.cancelled())
+
+    async def test_later_call_computes_again(self):
+        self.release.set()
+        self.assertEqual(await self.flights.run('page', self.compute, 1), 1)
+        self.assertEqual(await self.flights.run('page', self.compute, 2), 2)
+        self.assertEqual(self.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
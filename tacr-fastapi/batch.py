@@ -0,0 +1,339 @@
+"""
+Offline batch processing of a page corpus, e.g. to pre-warm the cache of the server overnight.
+
+The input is a JSONL file of pages as accepted by /classify, one {"url": ..., "text": ...} per line, or a directory
+of *.html files whose paths are used as URLs. Worker processes parse the pages and tokenize them (classify) or run
+analyze_cookies (cookies); the main process classifies the blocks of several pages in padded batches. Results are
+written as they are done, as JSONL or into the SQLite database of the server, and a checkpoint next to the output
+lets an interrupted run be resumed.
+
+    python batch.py classify corpus.jsonl --output results.jsonl
+    python batch.py classify pages/ --database database.db
+    python batch.py cookies corpus.jsonl --database database.db
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+
+import numpy as np
+import torch
+import transformers
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from api.config import Config
+from api import crud, models, migrations
+from advertisement_processing import classification
+from utils.html_utils import analyze_cookies
+from utils.parsed_document import ParsedDocument
+
+NO_TEXT = 'Page HTML contains no plain text'
+
+# tokenizer of a worker process, loaded by init_worker
+tokenizer = None
+
+
+def read_pages(path):
+    """
+    Yields (url, html) of the pages of a JSONL file or of the *.html files of a directory, in a stable order
+    """
+    if os.path.isdir(path):
+        for filename in sorted(glob.glob(os.path.join(path, '*.html'))):
+            with open(filename, 'r', encoding='utf-8') as f:
+                yield filename, f.read()
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                page = json.loads(line)
+                yield page['url'], page['text']
+            except (ValueError, KeyError) as e:
+                raise ValueError(f'{path}:{line_number}: not a page: {e}')
+
+
+class PageError:
+    """
+    Page whose preparation failed in a worker, written with the error instead of a result so that the run goes on
+    and the checkpoint moves past it
+    """
+
+    def __init__(self, url, error):
+        self.url = url
+        self.error = error
+
+
+def init_worker(load_tokenizer):
+    global tokenizer
+    if load_tokenizer:
+        tokenizer = transformers.AutoTokenizer.from_pretrained(Config.MODEL_FILE)
+
+
+def prepare_classification(url, html, stored_hash):
+    """
+    Parses and tokenizes a page in a worker process
+    :param stored_hash: content hash stored for the URL, the page is not tokenized if it is unchanged
+    :return: url, content hash, MinHash and token ids, None instead of the MinHash and the ids if the page is
+    unchanged; PageError if the page fails
+    """
+    try:
+        document = ParsedDocument(html).materialize('text', 'content_hash')
+        if document.content_hash == stored_hash:
+            return url, document.content_hash, None, None
+
+        input_ids = tokenizer(document.text, add_special_tokens=False).input_ids
+        return url, document.content_hash, document.minhash, np.array(input_ids, dtype=np.int32)
+    except Exception as e:
+        return PageError(url, f'{type(e).__name__}: {e}')
+
+
+def prepare_analysis(url, html, stored_hash):
+    """
+    Analyzes the cookie agreement of a page in a worker process
+    :param stored_hash: content hash stored for the URL, the page is not analyzed if it is unchanged
+    :return: url, content hash, MinHash, modified HTML and entity data, None instead of the last three if the page
+    is unchanged; PageError if the page fails
+    """
+    try:
+        document = ParsedDocument(html).materialize('content_hash')
+        if document.content_hash == stored_hash:
+            return url, document.content_hash, None, None, None
+
+        modified_html, entity_data = analyze_cookies(html)
+        return url, document.content_hash, document.minhash, modified_html, entity_data
+    except Exception as e:
+        return PageError(url, f'{type(e).__name__}: {e}')
+
+
+def ordered_map(pool, fn, items, window):
+    """
+    Same as pool.imap over argument tuples, but with at most window tasks in flight, so that a large corpus is not
+    read into memory ahead of the workers
+    """
+    pending = deque()
+    for args in items:
+        pending.append(pool.apply_async(fn, args))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+class Checkpoint:
+    """
+    Number of input pages whose results are written, and for JSONL output the length of the output at that point,
+    so that results written after the last checkpoint are dropped on resume instead of being duplicated
+    """
+
+    def __init__(self, path, input_path):
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.done = 0
+        self.output_size = 0
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r') as f:
+            state = json.load(f)
+        if state['input'] != self.input_path:
+            raise ValueError(f'Checkpoint {self.path} belongs to {state["input"]}, use --restart to start over')
+        self.done = state['done']
+        self.output_size = state['output_size']
+        return True
+
+    def save(self, done, output_size=0):
+        self.done = done
+        self.output_size = output_size
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'input': self.input_path, 'done': done, 'output_size': output_size}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class JsonlWriter:
+    def __init__(self, path, checkpoint: Checkpoint, resume):
+        if resume and not os.path.exists(path):
+            raise ValueError(f'Output {path} of the checkpoint does not exist, use --restart to start over')
+        self.file = open(path, 'r+b' if resume else 'wb')
+        self.file.truncate(checkpoint.output_size if resume else 0)
+        self.file.seek(0, os.SEEK_END)
+
+    def stored_hashes(self):
+        return {}
+
+    def _write(self, result):
+        self.file.write(json.dumps(result, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    def write_classifications(self, classified, failed):
+        for url, _, _, cls in classified:
+            self._write({'url': url, 'is_advertisement': cls, 'error': None if cls is not None else NO_TEXT})
+        for page in failed:
+            self._write({'url': page.url, 'is_advertisement': None, 'error': page.error})
+
+    def write_analyses(self, analyses, failed):
+        for url, _, _, modified_html, entity_data in analyses:
+            self._write({'url': url, 'entities': entity_data, 'html': modified_html, 'error': None})
+        for page in failed:
+            self._write({'url': page.url, 'entities': None, 'html': None, 'error': page.error})
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class DatabaseWriter:
+    """
+    Writes into the SQLite database of the server; pages stored with the same content hash are skipped, changed
+    pages are replaced and failed pages are left as they are
+    """
+
+    def __init__(self, path, analyses):
+        self.engine = create_engine(f'sqlite:///{path}')
+        models.Base.metadata.create_all(bind=self.engine)
+        migrations.migrate(self.engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)()
+        self.analyses = analyses
+
+    def stored_hashes(self):
+        hashes = crud.get_analysis_content_hashes(self.db) if self.analyses else crud.get_page_content_hashes(self.db)
+        return {url: content_hash for url, content_hash in hashes if content_hash is not None}
+
+    def write_classifications(self, classified, failed):
+        crud.store_pages(self.db, [crud.PageRecord(url, cls, minhash, content_hash)
+                                   for url, content_hash, minhash, cls in classified if cls is not None])
+
+    def write_analyses(self, analyses, failed):
+        for url, content_hash, minhash, modified_html, entity_data in analyses:
+            stored = crud.get_analysis(self.db, url)
+            if stored is not None:
+                crud.delete_analysis(self.db, stored)
+            crud.create_analysis(self.db, url, modified_html, entity_data, minhash, content_hash)
+
+    def flush(self):
+        return 0
+
+    def close(self):
+        self.db.close()
+        self.engine.dispose()
+
+
+class Classifier:
+    def __init__(self, batch_size):
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.model = transformers.AutoModelForSequenceClassification.from_pretrained(Config.MODEL_FILE).to(self.device)
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(Config.MODEL_FILE)
+        self.batch_size = batch_size
+
+    def classify(self, pages_ids):
+        """
+        :param pages_ids: token ids of each page
+        :return: classification of each page, None for pages without text
+        """
+        pages_blocks = [classification.ids_to_blocks(input_ids.tolist(), self.tokenizer) for input_ids in pages_ids]
+        return classification.predict_pages(pages_blocks, self.model, self.tokenizer.pad_token_id, self.batch_size)
+
+
+def process_chunk(chunk, writer, classifier):
+    """
+    Classifies and writes the prepared pages, and the errors of the failed ones
+    :return: number of unchanged pages, which are not written, and number of failed pages
+    """
+    failed = [result for result in chunk if isinstance(result, PageError)]
+    changed = [result for result in chunk if not isinstance(result, PageError) and result[2] is not None]
+    if classifier is None:
+        writer.write_analyses(changed, failed)
+    else:
+        classes = classifier.classify([input_ids for _, _, _, input_ids in changed])
+        writer.write_classifications([(url, content_hash, minhash, cls)
+                                      for (url, content_hash, minhash, _), cls in zip(changed, classes)], failed)
+    return len(chunk) - len(changed) - len(failed), len(failed)
+
+
+def main(args):
+    analyses = args.task == 'cookies'
+    output = args.output or args.database
+    checkpoint = Checkpoint(args.checkpoint or f'{output}.checkpoint', args.input)
+    if args.restart:
+        checkpoint.remove()
+    resume = checkpoint.load()
+    if resume:
+        print(f'Resuming after {checkpoint.done} pages')
+
+    writer = DatabaseWriter(args.database, analyses) if args.database else JsonlWriter(args.output, checkpoint, resume)
+    stored_hashes = writer.stored_hashes()
+    classifier = None if analyses else Classifier(args.batch_size)
+
+    pages = read_pages(args.input)
+    for _ in range(checkpoint.done):
+        next(pages, None)
+    tasks = ((url, html, stored_hashes.get(url)) for url, html in pages)
+
+    done = checkpoint.done
+    processed = 0
+    skipped = 0
+    errors = 0
+    start = last_report = time.perf_counter()
+    context = multiprocessing.get_context(Config.PARSING_START_METHOD)
+    with context.Pool(args.workers, initializer=init_worker, initargs=(not analyses,)) as pool:
+        prepare = prepare_analysis if analyses else prepare_classification
+        chunk = []
+        results = ordered_map(pool, prepare, tasks, args.workers * 4)
+        while True:
+            result = next(results, None)
+            if result is not None:
+                chunk.append(result)
+            if chunk and (len(chunk) >= args.chunk_size or result is None):
+                unchanged, failed = process_chunk(chunk, writer, classifier)
+                skipped += unchanged
+                errors += failed
+                done += len(chunk)
+                processed += len(chunk)
+                checkpoint.save(done, writer.flush())
+                chunk = []
+
+                now = time.perf_counter()
+                if now - last_report >= args.report_interval:
+                    print(f'{done} pages, {errors} errors, {processed / (now - start):.1f} pages/s')
+                    last_report = now
+            if result is None:
+                break
+
+    writer.close()
+    elapsed = time.perf_counter() - start
+    print(f'Done: {done} pages, {processed} in this run, {skipped} unchanged, {errors} errors, '
+          f'{processed / elapsed if elapsed > 0 else 0:.1f} pages/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Classify pages or analyze their cookie agreements offline.')
+    parser.add_argument('task', choices=['classify', 'cookies'])
+    parser.add_argument('input', type=str, help='JSONL file of {"url": ..., "text": ...} or directory of *.html')
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('--output', type=str, help='JSONL file of the results')
+    output.add_argument('--database', type=str, help='SQLite database of the server to store the results in')
+    parser.add_argument('--checkpoint', type=str, help='Checkpoint file, the output path with .checkpoint by default')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the first page')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=64,
+                        help='Number of pages classified and written together')
+    parser.add_argument('--batch-size', type=int, default=Config.CLASSIFY_MAX_BATCH_SIZE,
+                        help='Maximum number of blocks in a forward pass')
+    parser.add_argument('--report-interval', type=float, default=10, help='Seconds between progress reports')
+    args = parser.parse_args()
+
+    main(args)
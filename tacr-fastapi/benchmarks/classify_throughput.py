@@ -0,0 +1,78 @@
+"""
+Compares /classify throughput of the inline per-request path against the micro-batched path.
+
+Run from the tacr-fastapi directory:
+
+    python -m benchmarks.classify_throughput --requests 64 --concurrency 16
+"""
+import argparse
+import asyncio
+import glob
+import os
+import time
+
+import torch
+import transformers
+
+from api.config import Config
+from advertisement_processing import classification
+from advertisement_processing.batching import BlockBatcher
+from utils.parsed_document import ParsedDocument
+
+DATA_DIR = os.path.join('advertisement_processing', 'regular_extractor', 'data')
+
+
+def load_pages(datadir, count):
+    pages = []
+    for filename in sorted(glob.glob(os.path.join(datadir, '*.html'))):
+        with open(filename, 'r', encoding='utf-8') as f:
+            pages.append(f.read())
+
+    return [pages[i % len(pages)] for i in range(count)]
+
+
+def run_inline(pages, model, tokenizer):
+    start = time.perf_counter()
+    for page in pages:
+        classification.classify(page, model, tokenizer)
+    return len(pages) / (time.perf_counter() - start)
+
+
+async def run_batched(pages, tokenizer, batcher, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(page):
+        async with semaphore:
+            await classification.classify_batched(ParsedDocument(page), tokenizer, batcher)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[request(page) for page in pages])
+    return len(pages) / (time.perf_counter() - start)
+
+
+def main(args):
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = transformers.AutoModelForSequenceClassification.from_pretrained(Config.MODEL_FILE).to(device)
+    tokenizer = transformers.AutoTokenizer.from_pretrained(Config.MODEL_FILE)
+    pages = load_pages(args.datadir, args.requests)
+
+    inline_rps = run_inline(pages, model, tokenizer)
+    print(f'inline:  {inline_rps:.2f} requests/s')
+
+    batcher = BlockBatcher(model, tokenizer.pad_token_id, args.max_batch_size, args.max_delay)
+    batched_rps = asyncio.run(run_batched(pages, tokenizer, batcher, args.concurrency))
+    print(f'batched: {batched_rps:.2f} requests/s (concurrency {args.concurrency}, '
+          f'max batch {args.max_batch_size}, max delay {args.max_delay}s)')
+    print(f'speedup: {batched_rps / inline_rps:.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark /classify throughput.')
+    parser.add_argument('--datadir', type=str, default=DATA_DIR, help='Directory with *.html pages')
+    parser.add_argument('--requests', type=int, default=64, help='Number of classified pages')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent requests in the batched run')
+    parser.add_argument('--max-batch-size', type=int, default=Config.CLASSIFY_MAX_BATCH_SIZE)
+    parser.add_argument('--max-delay', type=float, default=Config.CLASSIFY_MAX_DELAY)
+    args = parser.parse_args()
+
+    main(args)
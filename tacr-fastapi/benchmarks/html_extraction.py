@@ -0,0 +1,58 @@
+"""
+Compares plain text extraction throughput of the BeautifulSoup and the lxml engines of utils.html_utils.
+
+Each page is parsed and its text extracted the way ParsedDocument does for /classify (full text) and for
+/rationale (paragraph text), reporting MB of HTML per second.
+
+Run from the tacr-fastapi directory:
+
+    python -m benchmarks.html_extraction --repeat 5
+"""
+import argparse
+import glob
+import os
+import time
+
+from utils.html_utils import parse_html, tree_to_plaintext
+
+DATA_DIR = os.path.join('advertisement_processing', 'regular_extractor', 'data')
+
+ENGINES = ['bs4', 'lxml']
+
+
+def load_pages(datadir):
+    pages = []
+    for filename in sorted(glob.glob(os.path.join(datadir, '*.html'))):
+        with open(filename, 'r', encoding='utf-8') as f:
+            pages.append(f.read())
+    return pages
+
+
+def extract(pages, engine, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            tree = parse_html(page, engine)
+            tree_to_plaintext(tree, lowercase=False)
+            tree_to_plaintext(tree, keep_paragraphs_only=True, trim_start=0, lowercase=False, merge_whitespaces=False)
+    return time.perf_counter() - start
+
+
+def main(args):
+    pages = load_pages(args.datadir)
+    megabytes = sum(len(page.encode('utf-8')) for page in pages) * args.repeat / 1e6
+
+    print('| engine | MB/s | pages/s |')
+    print('|---|---|---|')
+    for engine in ENGINES:
+        elapsed = extract(pages, engine, args.repeat)
+        print(f'| {engine} | {megabytes / elapsed:.2f} | {len(pages) * args.repeat / elapsed:.1f} |')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare text extraction throughput of the HTML engines.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of passes over the pages')
+    parser.add_argument('--datadir', type=str, default=DATA_DIR, help='Directory with *.html pages')
+    args = parser.parse_args()
+
+    main(args)
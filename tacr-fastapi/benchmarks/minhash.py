@@ -0,0 +1,74 @@
+"""
+Microbenchmark of the page MinHash: the kshingle shingle set hashed through datasketch (shingles_to_minhash)
+against the vectorized text_to_minhash.
+
+Texts of the sample pages are measured as they are, and concatenated to larger sizes to cover the long tail
+of the page-size distribution.
+
+Run from the tacr-fastapi directory:
+
+    python -m benchmarks.minhash --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import glob
+import os
+import time
+
+import kshingle
+import numpy as np
+
+from utils.document_similarity import shingles_to_minhash, text_to_minhash
+from utils.html_utils import html_to_plaintext
+from utils.parsed_document import SHINGLE_K, NUM_PERM
+
+DATA_DIR = os.path.join('advertisement_processing', 'regular_extractor', 'data')
+
+
+def load_texts(datadir):
+    texts = []
+    for filename in sorted(glob.glob(os.path.join(datadir, '*.html'))):
+        with open(filename, 'r', encoding='utf-8') as f:
+            texts.append(html_to_plaintext(f.read(), trim_start=0))
+    return texts
+
+
+def measure(fn, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(text)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def reference(text):
+    return shingles_to_minhash(kshingle.shingleset_k(text, SHINGLE_K), NUM_PERM)
+
+
+def vectorized(text):
+    return text_to_minhash(text, SHINGLE_K, NUM_PERM)
+
+
+def main(args):
+    texts = load_texts(args.datadir)
+    corpus = ' '.join(texts)
+    cases = [(f'page {i}', text) for i, text in enumerate(texts)]
+    cases += [(f'{size} chars', (corpus * (size // len(corpus) + 1))[:size]) for size in args.sizes]
+
+    print('| text | characters | shingle set (ms) | vectorized (ms) | speedup |')
+    print('|---|---|---|---|---|')
+    for name, text in cases:
+        reference_time, expected = measure(reference, text, args.repeat)
+        vectorized_time, actual = measure(vectorized, text, args.repeat)
+        assert np.array_equal(expected.hashvalues, actual.hashvalues)
+        print(f'| {name} | {len(text)} | {reference_time * 1e3:.1f} | {vectorized_time * 1e3:.1f} '
+              f'| {reference_time / vectorized_time:.2f}x |')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare MinHash computation of the shingle set and the vectorized engine.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='Sizes in characters of texts made of the concatenated pages')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of measurements averaged per text')
+    parser.add_argument('--datadir', type=str, default=DATA_DIR, help='Directory with *.html pages')
+    args = parser.parse_args()
+
+    main(args)
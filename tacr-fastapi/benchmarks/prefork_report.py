@@ -0,0 +1,123 @@
+"""
+Memory and throughput report of serve.py for a growing number of preforked workers.
+
+For each worker count, starts the server, sends /classify requests from concurrent clients for a fixed time and
+reports requests/s together with the RSS and PSS (proportional set size, shared pages split between the
+processes sharing them) of each worker. Every request uses a new URL so that the model runs each time; the
+classifications are written to the server's database.db.
+
+Run from the tacr-fastapi directory:
+
+    python -m benchmarks.prefork_report --workers 1 2 4 --duration 30
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+DATA_DIR = os.path.join('advertisement_processing', 'regular_extractor', 'data')
+
+
+def read_memory_kb(pid):
+    """
+    Returns RSS and PSS of a process in kB
+    """
+    memory = {}
+    with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:'):
+                memory[parts[0][:-1]] = int(parts[1])
+    return memory['Rss'], memory['Pss']
+
+
+def child_pids(pid):
+    with open(f'/proc/{pid}/task/{pid}/children', 'r') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def wait_until_ready(url, server, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('Server exited before becoming ready')
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    raise TimeoutError('Server did not start in time')
+
+
+def load(url, pages, clients, duration):
+    run_id = uuid.uuid4().hex
+    counts = [0] * clients
+    deadline = time.time() + duration
+
+    def client(index):
+        session = requests.Session()
+        i = 0
+        while time.time() < deadline:
+            page = pages[(index + i) % len(pages)]
+            response = session.post(f'{url}/classify', json={'text': page, 'url': f'http://benchmark/{run_id}/{index}/{i}'})
+            if response.status_code == 200:
+                counts[index] += 1
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return sum(counts) / (time.time() - start)
+
+
+def report(args):
+    pages = []
+    for filename in sorted(glob.glob(os.path.join(args.datadir, '*.html'))):
+        with open(filename, 'r', encoding='utf-8') as f:
+            pages.append(f.read())
+
+    url = f'http://127.0.0.1:{args.port}'
+    rows = []
+    for workers in args.workers:
+        server = subprocess.Popen([sys.executable, 'serve.py', '--workers', str(workers), '--port', str(args.port), '--log-level', 'warning'])
+        try:
+            wait_until_ready(url, server, args.startup_timeout)
+            requests_per_second = load(url, pages, args.clients, args.duration)
+
+            parent_rss, _ = read_memory_kb(server.pid)
+            worker_memory = [read_memory_kb(pid) for pid in child_pids(server.pid)]
+            rows.append((workers, requests_per_second, parent_rss, worker_memory))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print('| workers | requests/s | parent RSS (MB) | RSS per worker (MB) | PSS per worker (MB) | total PSS (MB) |')
+    print('|---|---|---|---|---|---|')
+    for workers, requests_per_second, parent_rss, worker_memory in rows:
+        rss = sum(m[0] for m in worker_memory) / max(1, len(worker_memory)) / 1024
+        pss = sum(m[1] for m in worker_memory) / max(1, len(worker_memory)) / 1024
+        total_pss = sum(m[1] for m in worker_memory) / 1024
+        print(f'| {workers} | {requests_per_second:.2f} | {parent_rss / 1024:.0f} | {rss:.0f} | {pss:.0f} | {total_pss:.0f} |')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report memory and throughput of preforked workers.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Worker counts to measure')
+    parser.add_argument('--clients', type=int, default=16, help='Number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='Load duration in seconds per worker count')
+    parser.add_argument('--port', type=int, default=8011)
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--datadir', type=str, default=DATA_DIR, help='Directory with *.html pages')
+    args = parser.parse_args()
+
+    report(args)
@@ -0,0 +1,117 @@
+"""
+Preforking server.
+
+Imports api.main, and with it the model and tokenizer, once in the parent process and then forks the workers,
+so that all workers share the weight pages copy-on-write instead of loading the model each.
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8001
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+
+import torch
+import uvicorn
+
+from api.config import Config
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def threads_per_worker(workers, threads=None):
+    """
+    Number of torch threads of a worker, the CPUs split evenly between the workers unless given explicitly
+    """
+    if threads:
+        return threads
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def run_worker(app, sock, threads, args):
+    torch.set_num_threads(threads)
+
+    # connections of the parent's pool must not be shared with the children
+    from api.database import engine
+    engine.dispose(close=False)
+
+    config = uvicorn.Config(app, host=args.host, port=args.port, log_level=args.log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def fork_worker(app, sock, threads, args):
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            run_worker(app, sock, threads, args)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def main(args):
+    sock = bind_socket(args.host, args.port)
+
+    # loads the model and tokenizer
+    from api.main import app, rebuild_indexes, save_indexes
+
+    # keep the garbage collector from touching (and so copying) the objects shared with the workers
+    gc.collect()
+    gc.freeze()
+
+    threads = threads_per_worker(args.workers, args.threads)
+    workers = set(fork_worker(app, sock, threads, args) for _ in range(args.workers))
+    print(f'Started {args.workers} workers with {threads} torch threads each: {sorted(workers)}')
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while workers:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not stopping:
+            # replace a crashed worker
+            workers.add(fork_worker(app, sock, threads, args))
+
+    sock.close()
+
+    # each worker's copy of the near-duplicate indexes misses the other workers' pages, so none of them saved theirs
+    rebuild_indexes()
+    save_indexes()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the API with preforked workers sharing the model.')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--workers', type=int, default=Config.SERVER_WORKERS, help='Number of worker processes')
+    parser.add_argument('--threads', type=int, default=Config.SERVER_TORCH_THREADS,
+                        help='Torch threads per worker, CPU count divided by workers if not set')
+    parser.add_argument('--log-level', type=str, default='info')
+    args = parser.parse_args()
+
+    main(args)
@@ -1,8 +1,28 @@
+import functools
+
 import kshingle
 import datasketch
+import numpy as np
+from datasketch.minhash import _mersenne_prime, _max_hash
 from utils.html_utils import html_to_plaintext
 import xxhash
 
+# seed of the MinHash permutations, the datasketch default all stored MinHashes were computed with
+MINHASH_SEED = 1
+
+# xxh32 primes
+_P1 = np.uint32(0x9E3779B1)
+_P2 = np.uint32(0x85EBCA77)
+_P3 = np.uint32(0xC2B2AE3D)
+_P4 = np.uint32(0x27D4EB2F)
+_P5 = np.uint32(0x165667B1)
+
+# number of text positions whose shingles are hashed at once
+TEXT_WINDOW = 1 << 14
+
+# number of shingle hashes permuted at once, each takes num_perm * 8 bytes
+HASH_CHUNK = 1 << 8
+
 
 def hash_f(d):
     return xxhash.xxh32(d).intdigest()
@@ -10,12 +30,150 @@ def hash_f(d):
 
 def document_to_minhash(document, k=5, num_perm=512):
     text = html_to_plaintext(document, trim_start=0)
-    shingleset = kshingle.shingleset_k(text, k)
-    minhash = datasketch.MinHash(num_perm, hashfunc=hash_f)
+    return text_to_minhash(text, k, num_perm)
+
+
+def shingles_to_minhash(shingleset, num_perm=512):
+    minhash = datasketch.MinHash(num_perm, hashfunc=hash_f, permutations=_permutations(num_perm))
     minhash.update_batch([s.encode('utf-8') for s in shingleset])
     return minhash
 
 
+@functools.lru_cache(maxsize=None)
+def _permutations(num_perm):
+    a, b = datasketch.MinHash(num_perm, seed=MINHASH_SEED).permutations
+    a.flags.writeable = False
+    b.flags.writeable = False
+    return a, b
+
+
+def text_to_minhash(text, k=5, num_perm=512):
+    """
+    Same MinHash as shingles_to_minhash(kshingle.shingleset_k(text, k), num_perm) computed with array operations
+
+    The shingles, all substrings of 1 to k characters, are never built as strings: their UTF-8 bytes are taken
+    from the encoded text and hashed with a vectorized xxh32, and the permutations are applied to whole arrays
+    of hash values. Shingles are deduplicated by their hash values rather than as strings, equal hash values
+    give equal permuted values.
+    """
+    a, b = _permutations(num_perm)
+    hashvalues = np.full(num_perm, _max_hash, dtype=np.uint64)
+
+    if text:
+        hashes = _shingle_hashes(text, k)
+        permuted = np.empty((HASH_CHUNK, num_perm), dtype=np.uint64)
+        for chunk_start in range(0, len(hashes), HASH_CHUNK):
+            chunk = hashes[chunk_start:chunk_start + HASH_CHUNK, np.newaxis]
+            out = permuted[:len(chunk)]
+            # datasketch's (a * hash + b) % _mersenne_prime & _max_hash, without temporaries
+            np.multiply(chunk, a, out=out)
+            out += b
+            np.remainder(out, np.uint64(_mersenne_prime), out=out)
+            out &= np.uint64(_max_hash)
+            np.minimum(hashvalues, out.min(axis=0), out=hashvalues)
+
+    return datasketch.MinHash(num_perm, seed=MINHASH_SEED, hashfunc=hash_f, hashvalues=hashvalues,
+                              permutations=(a, b))
+
+
+def _shingle_hashes(text, k):
+    """
+    Distinct xxh32 values of the UTF-8 bytes of all shingles of 1 to k characters of the text, as uint64
+    """
+    encoded = np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+    code_points = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+    # byte offset of each character and of the end of the text
+    char_lengths = 1 + (code_points >= 0x80).astype(np.int64) + (code_points >= 0x800) + (code_points >= 0x10000)
+    offsets = np.concatenate(([0], np.cumsum(char_lengths)))
+
+    hashes = [np.unique(_window_shingle_hashes(encoded, offsets, start, min(start + TEXT_WINDOW, len(code_points)), k))
+              for start in range(0, len(code_points), TEXT_WINDOW)]
+    return np.unique(np.concatenate(hashes)).astype(np.uint64)
+
+
+def _window_shingle_hashes(encoded, offsets, start, stop, k):
+    """
+    xxh32 of the UTF-8 bytes of all shingles of 1 to k characters starting at characters start to stop - 1
+    """
+    length = len(offsets) - 1
+    byte_starts = []
+    byte_lengths = []
+    for n in range(1, k + 1):
+        positions = np.arange(start, min(stop, length - n + 1))
+        byte_starts.append(offsets[positions])
+        byte_lengths.append(offsets[positions + n] - offsets[positions])
+    byte_starts = np.concatenate(byte_starts)
+    byte_lengths = np.concatenate(byte_lengths)
+
+    hashes = np.empty(len(byte_starts), dtype=np.uint32)
+    for byte_length in np.unique(byte_lengths):
+        selected = byte_lengths == byte_length
+        data = encoded[byte_starts[selected, np.newaxis] + np.arange(byte_length)]
+        hashes[selected] = _xxh32(data)
+    return hashes
+
+
+def _rotl(x, r):
+    return (x << np.uint32(r)) | (x >> np.uint32(32 - r))
+
+
+def _xxh32(data):
+    """
+    xxh32 with seed 0 of each row of a (rows, length) uint8 array
+    """
+    rows, length = data.shape
+
+    def word(i):
+        return (data[:, i].astype(np.uint32) | (data[:, i + 1].astype(np.uint32) << np.uint32(8))
+                | (data[:, i + 2].astype(np.uint32) << np.uint32(16)) | (data[:, i + 3].astype(np.uint32) << np.uint32(24)))
+
+    position = 0
+    if length >= 16:
+        accumulators = [np.full(rows, value, dtype=np.uint32)
+                        for value in (int(_P1) + int(_P2), int(_P2), 0, (1 << 32) - int(_P1))]
+        while position + 16 <= length:
+            for i in range(4):
+                accumulator = accumulators[i] + word(position + 4 * i) * _P2
+                accumulators[i] = _rotl(accumulator, 13) * _P1
+            position += 16
+        h = (_rotl(accumulators[0], 1) + _rotl(accumulators[1], 7)
+             + _rotl(accumulators[2], 12) + _rotl(accumulators[3], 18))
+    else:
+        h = np.full(rows, _P5, dtype=np.uint32)
+
+    h += np.uint32(length)
+    while position + 4 <= length:
+        h = _rotl(h + word(position) * _P3, 17) * _P4
+        position += 4
+    while position < length:
+        h = _rotl(h + data[:, position].astype(np.uint32) * _P5, 11) * _P1
+        position += 1
+
+    h ^= h >> np.uint32(15)
+    h *= _P2
+    h ^= h >> np.uint32(13)
+    h *= _P3
+    h ^= h >> np.uint32(16)
+    return h
+
+
+def minhash_to_bytes(minhash):
+    """
+    Hash values of the MinHash as a little-endian uint64 buffer, the stored form of page MinHashes
+    """
+    return minhash.hashvalues.astype('<u8', copy=False).tobytes()
+
+
+def minhash_from_bytes(data, seed=MINHASH_SEED) -> datasketch.LeanMinHash:
+    """
+    LeanMinHash over a buffer written by minhash_to_bytes, the hash values are not copied
+    """
+    minhash = datasketch.LeanMinHash.__new__(datasketch.LeanMinHash)
+    minhash.seed = seed
+    minhash.hashvalues = np.frombuffer(data, dtype='<u8')
+    return minhash
+
+
 def are_documents_same(minhash1: datasketch.MinHash, minhash2: datasketch.MinHash, threshold=0.95):
     print(minhash1.jaccard(minhash2))
     return minhash1.jaccard(minhash2) > threshold
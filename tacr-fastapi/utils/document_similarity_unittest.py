@@ -0,0 +1,42 @@
+import random
+import unittest
+
+import kshingle
+import numpy as np
+import xxhash
+
+from utils.document_similarity import text_to_minhash, shingles_to_minhash, _xxh32, TEXT_WINDOW
+
+
+class VectorizedMinHashTest(unittest.TestCase):
+    def test_xxh32(self):
+        rng = np.random.default_rng(0)
+        for length in range(1, 25):
+            data = rng.integers(0, 256, (20, length), dtype=np.uint8)
+            expected = [xxhash.xxh32(bytes(row)).intdigest() for row in data]
+            self.assertEqual(_xxh32(data).tolist(), expected)
+
+    def test_same_as_shingle_set(self):
+        random.seed(0)
+        texts = [
+            '',
+            'a',
+            'abcd',
+            'osobní údaje zpracováváme v souladu s nařízením gdpr',
+            # characters of 4 UTF-8 bytes give shingles of 16 and more bytes
+            '𝄞𝄞𝄞𝄞𝄞 🐎 kůň',
+            ''.join(random.choice('ab é€🐎') for _ in range(2000)),
+            # shingles crossing the boundary of the hashed windows
+            ''.join(random.choice('abcdefgh ') for _ in range(TEXT_WINDOW + 100)),
+        ]
+        for text in texts:
+            for k, num_perm in ((5, 512), (3, 64)):
+                with self.subTest(text=text[:20], k=k):
+                    expected = shingles_to_minhash(kshingle.shingleset_k(text, k), num_perm)
+                    actual = text_to_minhash(text, k, num_perm)
+                    self.assertTrue(np.array_equal(actual.hashvalues, expected.hashvalues))
+                    self.assertEqual(actual.jaccard(expected), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,316 @@
+import re
+import zlib
+
+from lxml import etree
+
+from utils.html_utils import NON_TEXT_TAGS, PARAGRAPH_TAG_SET, PRESERVE_WHITESPACE_TAGS, ASCII_SPACES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# contents of these tags are dropped while streaming; they are left out of the plain text of parsed pages too
+# (NON_TEXT_TAGS), so the streamed plain text and its content hash match those of ParsedDocument
+STRIPPED_TAGS = frozenset(['script', 'style'])
+
+# maximum size of a single piece of decompressed output, keeps compressed bombs from expanding at once
+DECOMPRESSED_PIECE_SIZE = 1 << 16
+
+# libxml2 does not recognize the end tag of a script or style element split between two fed chunks, so an
+# unterminated tag of at most this many bytes at the end of a chunk is held back until the next one
+END_TAG_HOLDBACK = 16
+
+
+class UnsupportedEncoding(Exception):
+    """
+    Raised for a Content-Encoding that cannot be decompressed
+    """
+
+    def __init__(self, encoding):
+        super().__init__(f'Unsupported content encoding {encoding}')
+        self.encoding = encoding
+
+
+class MalformedBody(Exception):
+    """
+    Raised when a compressed body cannot be decompressed
+    """
+
+
+class TextLimitExceeded(Exception):
+    """
+    Raised when the text extracted from a streamed page grows over the limit
+    """
+
+    def __init__(self, limit):
+        super().__init__(f'Page text exceeds {limit} characters')
+        self.limit = limit
+
+
+class UntaggedRunExceeded(Exception):
+    """
+    Raised when a streamed page has a longer run of bytes without a '<' than the limit; libxml2 holds such a run in
+    memory until it sees the next '<'
+    """
+
+    def __init__(self, limit):
+        super().__init__(f'Page has more than {limit} bytes without a tag')
+        self.limit = limit
+
+
+class StreamDecoder:
+    """
+    Incremental decompression of a request body with the given Content-Encoding
+    """
+
+    def __init__(self, content_encoding=None):
+        encoding = (content_encoding or 'identity').strip().lower()
+        self.encoding = encoding
+        if encoding == 'identity':
+            self._decompressor = None
+        elif encoding in ('gzip', 'x-gzip', 'deflate'):
+            # automatic detection of the gzip and zlib headers
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+        elif encoding == 'br' and brotli is not None:
+            self._decompressor = brotli.Decompressor()
+        else:
+            raise UnsupportedEncoding(encoding)
+
+    def decode(self, chunk):
+        """
+        Yields the decompressed data of a body chunk in pieces of at most DECOMPRESSED_PIECE_SIZE bytes
+        (brotli output is yielded at once)
+        :raises MalformedBody: if the chunk is not valid compressed data
+        """
+        if self._decompressor is None:
+            if chunk:
+                yield chunk
+        elif self.encoding == 'br':
+            try:
+                data = self._decompressor.process(chunk)
+            except brotli.error as e:
+                raise MalformedBody(f'Malformed br body: {e}')
+            if data:
+                yield data
+        else:
+            while chunk:
+                try:
+                    data = self._decompressor.decompress(chunk, DECOMPRESSED_PIECE_SIZE)
+                except zlib.error as e:
+                    raise MalformedBody(f'Malformed {self.encoding} body: {e}')
+                if data:
+                    yield data
+                chunk = self._decompressor.unconsumed_tail
+
+    def flush(self):
+        if self._decompressor is None:
+            return
+        if self.encoding == 'br':
+            if not self._decompressor.is_finished():
+                raise MalformedBody('Truncated br body')
+            return
+        data = self._decompressor.flush()
+        if data:
+            yield data
+        if not self._decompressor.eof:
+            raise MalformedBody(f'Truncated {self.encoding} body')
+
+
+class StreamingTextExtractor:
+    """
+    Parser target extracting the plain text and the paragraph text of a page fed in chunks.
+
+    Only the extracted strings are kept, never the HTML or a tree, and contents of STRIPPED_TAGS are dropped as
+    soon as they are parsed. The strings are the ones BeautifulSoup would hold for the same page, so the texts
+    match ParsedDocument.text and ParsedDocument.paragraph_text of the page with script and style elements
+    removed. Those contribute nothing to ParsedDocument.text either, so the plain texts are the same.
+    """
+
+    def __init__(self, max_text_length=None):
+        """
+        :param max_text_length: maximum number of characters of the plain text, TextLimitExceeded is raised as soon
+            as the plain text together with the text node being parsed grows over it
+        """
+        self.max_text_length = max_text_length
+        self.text_parts = []
+        self.paragraph_parts = []
+        # characters of the plain text
+        self.length = 0
+
+        self._pending = []
+        self._pending_length = 0
+        self._stripped = 0
+        self._non_text = 0
+        self._preserve = 0
+        # strings of the paragraphs opened since the outermost open paragraph, in opening order
+        self._paragraphs = []
+        self._open_paragraphs = []
+
+    def _check_length(self, pending_length):
+        if self.max_text_length is not None and self.length + pending_length > self.max_text_length:
+            raise TextLimitExceeded(self.max_text_length)
+
+    def _add_paragraph_string(self, string):
+        for index in self._open_paragraphs:
+            self._paragraphs[index].append(string)
+
+    def _soup_string(self, string):
+        if self._preserve or string.strip(ASCII_SPACES):
+            return string
+        return '\n' if '\n' in string else ' '
+
+    def _flush(self):
+        if not self._pending:
+            return
+        string = self._soup_string(''.join(self._pending))
+        self._pending = []
+        self._pending_length = 0
+        if self._stripped:
+            return
+        if not self._non_text:
+            self.text_parts.append(string)
+            self.length += len(string)
+            self._check_length(0)
+        self._add_paragraph_string(string)
+
+    def start(self, tag, attrib):
+        self._flush()
+        if self._stripped or tag in STRIPPED_TAGS:
+            self._stripped += 1
+            return
+        if self._non_text or tag in NON_TEXT_TAGS:
+            self._non_text += 1
+        if self._preserve or tag in PRESERVE_WHITESPACE_TAGS:
+            self._preserve += 1
+        if tag in PARAGRAPH_TAG_SET:
+            self._open_paragraphs.append(len(self._paragraphs))
+            self._paragraphs.append([])
+
+    def end(self, tag):
+        self._flush()
+        if self._stripped:
+            self._stripped -= 1
+            return
+        if self._non_text:
+            self._non_text -= 1
+        if self._preserve:
+            self._preserve -= 1
+        if tag in PARAGRAPH_TAG_SET and self._open_paragraphs:
+            self._open_paragraphs.pop()
+            if not self._open_paragraphs:
+                for strings in self._paragraphs:
+                    self.paragraph_parts.extend(strings)
+                self._paragraphs = []
+
+    def data(self, data):
+        if not self._stripped:
+            # a text node is only flushed at the next tag, so its length is checked while it is buffered
+            self._pending.append(data)
+            self._pending_length += len(data)
+            self._check_length(self._pending_length)
+
+    def comment(self, text):
+        self._flush()
+        if not self._stripped:
+            self._add_paragraph_string(self._soup_string(text))
+
+    def pi(self, target, data=None):
+        self._flush()
+        if not self._stripped:
+            self._add_paragraph_string(self._soup_string(target + ' ' + (data or '')))
+
+    def close(self):
+        self._flush()
+
+    @property
+    def text(self):
+        """
+        Plain text with merged whitespaces
+        """
+        return re.sub('\\s+', ' ', ''.join(self.text_parts))
+
+    @property
+    def paragraph_text(self):
+        """
+        Text of paragraphs and headings, one per line
+        """
+        return re.sub('\n+', '\n', '\n'.join(self.paragraph_parts))
+
+
+def charset_from_content_type(content_type):
+    """
+    Returns the charset parameter of a Content-Type header value, or None
+    """
+    match = re.search(r'charset\s*=\s*"?([\w.:-]+)', content_type or '', flags=re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+class HtmlStreamParser:
+    """
+    Feeds (optionally compressed) HTML chunks to an incremental lxml parser with a StreamingTextExtractor target
+
+        parser = HtmlStreamParser(content_encoding='gzip')
+        for chunk in chunks:
+            parser.feed(chunk)
+        extractor = parser.close()
+    """
+
+    def __init__(self, content_encoding=None, charset=None, max_text_length=None, max_untagged_bytes=None):
+        """
+        :param content_encoding: Content-Encoding of the chunks, 'identity', 'gzip', 'deflate' or 'br'
+        :param charset: charset of the decompressed HTML, detected by the parser if None
+        :param max_text_length: maximum number of characters of the plain text, TextLimitExceeded is raised over it
+        :param max_untagged_bytes: maximum number of decompressed bytes between two '<', including tags, attributes
+            and script or style contents; UntaggedRunExceeded is raised over it
+        :raises UnsupportedEncoding: for other content encodings, or 'br' without the brotli package
+        :raises LookupError: for an unknown charset
+        """
+        self.decoder = StreamDecoder(content_encoding)
+        self.extractor = StreamingTextExtractor(max_text_length)
+        self.parser = etree.HTMLParser(target=self.extractor, encoding=charset)
+        self.max_untagged_bytes = max_untagged_bytes
+        self.size = 0
+        self._held_back = b''
+        # bytes fed since the last '<', held by libxml2 until the next one
+        self._untagged = 0
+
+    def feed(self, chunk):
+        for data in self.decoder.decode(chunk):
+            self._feed(data)
+
+    def _feed(self, data):
+        data = self._held_back + data
+        tag = data.rfind(b'<', max(0, len(data) - END_TAG_HOLDBACK))
+        if tag >= 0 and data.find(b'>', tag) < 0:
+            data, self._held_back = data[:tag], data[tag:]
+        else:
+            self._held_back = b''
+
+        if data:
+            self._count_untagged(data)
+            self.size += len(data)
+            self.parser.feed(data)
+
+    def _count_untagged(self, data):
+        tag = data.rfind(b'<')
+        self._untagged = len(data) - tag - 1 if tag >= 0 else self._untagged + len(data)
+        if self.max_untagged_bytes is not None and self._untagged > self.max_untagged_bytes:
+            raise UntaggedRunExceeded(self.max_untagged_bytes)
+
+    def close(self) -> StreamingTextExtractor:
+        for data in self.decoder.flush():
+            self._feed(data)
+        if self._held_back:
+            self._count_untagged(self._held_back)
+            self.size += len(self._held_back)
+            self.parser.feed(self._held_back)
+        if self.size == 0:
+            return self.extractor
+
+        try:
+            self.parser.close()
+        except etree.XMLSyntaxError:
+            # nothing but whitespace was fed
+            pass
+        return self.extractor
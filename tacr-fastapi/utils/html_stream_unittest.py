@@ -0,0 +1,102 @@
+import glob
+import gzip
+import os
+import unittest
+import zlib
+
+from bs4 import BeautifulSoup
+
+from utils.html_stream import HtmlStreamParser, MalformedBody, TextLimitExceeded, UntaggedRunExceeded
+from utils.html_utils import tree_to_plaintext
+from utils.parsed_document import ParsedDocument
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'advertisement_processing', 'regular_extractor', 'data')
+
+
+def stream(data, chunk_size, content_encoding=None, max_text_length=None):
+    parser = HtmlStreamParser(content_encoding, 'utf-8', max_text_length)
+    for i in range(0, len(data), chunk_size):
+        parser.feed(data[i:i + chunk_size])
+    return parser.close()
+
+
+class HtmlStreamParserTest(unittest.TestCase):
+    def setUp(self):
+        self.pages = []
+        for filename in sorted(glob.glob(os.path.join(DATA_DIR, '*.html'))):
+            with open(filename, 'r', encoding='utf-8') as f:
+                self.pages.append(f.read())
+        self.assertTrue(self.pages)
+
+    def _assert_same_texts(self, html, extractor):
+        # streamed pages are stripped of script and style contents
+        self.assertEqual(extractor.text, ParsedDocument(html).text)
+        soup = BeautifulSoup(html, 'lxml')
+        for tag in soup.find_all(['script', 'style']):
+            tag.decompose()
+        self.assertEqual(extractor.text, tree_to_plaintext(soup, lowercase=False))
+        self.assertEqual(extractor.paragraph_text,
+                         tree_to_plaintext(soup, keep_paragraphs_only=True, trim_start=0, lowercase=False,
+                                           merge_whitespaces=False))
+
+    def test_chunked(self):
+        for html in self.pages:
+            for chunk_size in (7, 4096):
+                with self.subTest(chunk_size=chunk_size):
+                    self._assert_same_texts(html, stream(html.encode('utf-8'), chunk_size))
+
+    def test_compressed(self):
+        html = self.pages[0]
+        self._assert_same_texts(html, stream(gzip.compress(html.encode('utf-8')), 1000, 'gzip'))
+        self._assert_same_texts(html, stream(zlib.compress(html.encode('utf-8')), 1000, 'deflate'))
+
+    def test_stripped_tags(self):
+        html = '<h1>title <p>nested</p></h1><p>a<script>x</script>b<iframe>y</iframe><!-- c --></p><style>z</style>'
+        for chunk_size in range(1, 12):
+            with self.subTest(chunk_size=chunk_size):
+                self._assert_same_texts(html, stream(html.encode('utf-8'), chunk_size))
+
+    def test_empty(self):
+        for html in ('', '  '):
+            extractor = stream(html.encode('utf-8'), 1)
+            self.assertEqual((extractor.text, extractor.paragraph_text), ('', ''))
+
+    def test_malformed(self):
+        with self.assertRaises(MalformedBody):
+            stream(b'not gzip', 4, 'gzip')
+        with self.assertRaises(MalformedBody):
+            stream(gzip.compress(b'<p>text</p>')[:-10], 4, 'gzip')
+
+    def test_text_limit(self):
+        with self.assertRaises(TextLimitExceeded):
+            stream(self.pages[0].encode('utf-8'), 4096, max_text_length=100)
+
+    def test_text_limit_within_text_node(self):
+        parser = HtmlStreamParser(None, 'utf-8', 1000)
+        parser.feed(b'<html><body><p>')
+        with self.assertRaises(TextLimitExceeded):
+            for _ in range(100):
+                parser.feed(b'x' * 100)
+            parser.close()
+
+    def test_text_limit_ignores_attributes(self):
+        html = b'<p>hi</p><img src="data:image/png;base64,' + b'A' * 10000 + b'"><p>there</p>'
+        extractor = stream(html, 512, max_text_length=1000)
+        self.assertEqual(extractor.text, 'hithere')
+
+    def test_untagged_limit(self):
+        parser = HtmlStreamParser(None, 'utf-8', max_untagged_bytes=1000)
+        parser.feed(b'<p>hi</p><img src="data:image/png;base64,')
+        with self.assertRaises(UntaggedRunExceeded):
+            for _ in range(100):
+                parser.feed(b'A' * 100)
+
+    def test_text_limit_counts_plain_text_once(self):
+        html = '<p><p>' + 'x' * 90 + '</p></p>'
+        extractor = stream(html.encode('utf-8'), 7, max_text_length=100)
+        self.assertEqual(extractor.length, 90)
+
+
+if __name__ == '__main__':
+    unittest.main()
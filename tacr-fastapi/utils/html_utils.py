@@ -2,15 +2,28 @@ import copy
 from bs4 import BeautifulSoup, NavigableString
 import re
 import bs4
-import spacy_udpipe
+from lxml import etree
+from api.config import Config
 from advertisement_processing.regular_extractor.text_processor import TextProcessor
 from advertisement_processing.regular_extractor.main import extract_from_agreements
+from advertisement_processing.regular_extractor.nlp_backend import load_udpipe
+
+# strings inside these tags are left out by BeautifulSoup's get_text()
+NON_TEXT_TAGS = frozenset(['script', 'style', 'template', 'rt', 'rp'])
+
+PARAGRAPH_TAGS = ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+PARAGRAPH_TAG_SET = frozenset(PARAGRAPH_TAGS)
+
+# whitespace-only strings outside these tags are replaced by a single newline or space, as BeautifulSoup does
+PRESERVE_WHITESPACE_TAGS = frozenset(['pre', 'textarea'])
+
+ASCII_SPACES = ' \n\t\x0c\r'
 
 ELEMENT_ID_ATTRIBUTE = 'vilda-element-id'
 
 
 class Tokenizer(object):
-    tokenizer = spacy_udpipe.load("cs")
+    tokenizer = load_udpipe("cs")
 
     @classmethod
     def tokenize(cls, text):
@@ -57,7 +70,7 @@ def process_contents(tag, string_list):
 def keep_paragraphs(soup: BeautifulSoup):
     result_list = []
 
-    p_tags = soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+    p_tags = soup.find_all(PARAGRAPH_TAGS)
     for p_tag in p_tags:
         process_contents(p_tag, result_list)
 
@@ -80,15 +93,114 @@ def trim_text_start_length(text, trim_length):
     return new_text
 
 
-def html_to_plaintext(html, keep_paragraphs_only=False, trim_start=None, lowercase=True, merge_whitespaces=True):
-    soup = BeautifulSoup(html, 'lxml')
+def parse_lxml(html):
+    """
+    Parses the html with the same lxml parser BeautifulSoup uses, without building a soup
+    :return: root element, None for a document without any elements
+    """
+    parser = etree.HTMLParser()
+    try:
+        parser.feed(html)
+        return parser.close()
+    except etree.XMLSyntaxError:
+        return None
+
+
+def _soup_string(string, preserve_whitespace):
+    if preserve_whitespace or string.strip(ASCII_SPACES):
+        return string
+    return '\n' if '\n' in string else ' '
+
+
+def lxml_strings(element, skipped_tags=frozenset(), special_strings=False):
+    """
+    Yields the text nodes under the element in document order, the same strings BeautifulSoup would hold
+    :param element: lxml element, its own tail is not included
+    :param skipped_tags: strings under elements with these tags are left out
+    :param special_strings: include comments and processing instructions
+    """
+    skipped = element.tag in skipped_tags
+    preserve = any(ancestor.tag in PRESERVE_WHITESPACE_TAGS for ancestor in element.iterancestors())
+    preserve = preserve or element.tag in PRESERVE_WHITESPACE_TAGS
+    if element.text and not skipped:
+        yield _soup_string(element.text, preserve)
+
+    stack = [(element, iter(element), skipped, preserve)]
+    while stack:
+        node, children, skipped, preserve = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            if stack and node.tail and not stack[-1][2]:
+                yield _soup_string(node.tail, stack[-1][3])
+            continue
+
+        if isinstance(child.tag, str):
+            child_skipped = skipped or child.tag in skipped_tags
+            child_preserve = preserve or child.tag in PRESERVE_WHITESPACE_TAGS
+            if child.text and not child_skipped:
+                yield _soup_string(child.text, child_preserve)
+            stack.append((child, iter(child), child_skipped, child_preserve))
+            continue
+
+        if special_strings and not skipped:
+            if child.tag is etree.Comment:
+                yield _soup_string(child.text or '', preserve)
+            elif child.tag is etree.PI:
+                yield _soup_string(child.target + ' ' + (child.text or ''), preserve)
+        if child.tail and not skipped:
+            yield _soup_string(child.tail, preserve)
+
 
-    if keep_paragraphs_only:
-        soup_text = keep_paragraphs(soup)
+def lxml_keep_paragraphs(root):
+    """
+    keep_paragraphs for an lxml tree
+    """
+    result_list = []
+    # iter() with tag arguments misses the paragraphs libxml2 implies around bare text
+    for p_tag in root.iter():
+        if p_tag.tag in PARAGRAPH_TAG_SET:
+            result_list.extend(lxml_strings(p_tag, special_strings=True))
+
+    text = '\n'.join(result_list)
+    return re.sub('\n+', '\n', text)
+
+
+def parse_html(html, engine=None):
+    """
+    Parses the html for tree_to_plaintext
+    :param engine: 'lxml' for a bare lxml tree, 'bs4' for a BeautifulSoup, Config.HTML_TEXT_ENGINE if None
+    """
+    engine = engine or Config.HTML_TEXT_ENGINE
+    if engine == 'lxml':
+        return parse_lxml(html)
+    elif engine == 'bs4':
+        return BeautifulSoup(html, 'lxml')
+    raise ValueError(f'Unknown HTML engine {engine}')
+
+
+def html_to_plaintext(html, keep_paragraphs_only=False, trim_start=None, lowercase=True, merge_whitespaces=True, engine=None):
+    tree = parse_html(html, engine)
+    return tree_to_plaintext(tree, keep_paragraphs_only, trim_start, lowercase, merge_whitespaces)
+
+
+def tree_to_plaintext(tree, keep_paragraphs_only=False, trim_start=None, lowercase=True, merge_whitespaces=True):
+    """
+    Same as html_to_plaintext for html already parsed by parse_html, does not modify the tree
+    """
+    if tree is None:
+        soup_text = ''
+    elif keep_paragraphs_only:
+        if isinstance(tree, BeautifulSoup):
+            soup_text = keep_paragraphs(tree)
+        else:
+            soup_text = lxml_keep_paragraphs(tree)
         if trim_start:
             soup_text = trim_text_start_length(soup_text, trim_start)
+    elif isinstance(tree, BeautifulSoup):
+        soup_text = tree.get_text()
     else:
-        soup_text = soup.get_text()
+        soup_text = ''.join(lxml_strings(tree, skipped_tags=NON_TEXT_TAGS))
 
     if lowercase:
         soup_text = soup_text.lower()
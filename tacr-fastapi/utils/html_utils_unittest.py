@@ -0,0 +1,66 @@
+import glob
+import itertools
+import os
+import unittest
+
+from utils.html_utils import html_to_plaintext
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'advertisement_processing', 'regular_extractor', 'data')
+
+SNIPPETS = [
+    '',
+    '   ',
+    'plain text without tags',
+    '<p>one</p><p>two</p>',
+    '<html><head><title>Title</title><style>p { color: red; }</style></head><body>text</body></html>',
+    '<div>before<script>var x = "<p>no</p>";</script>after</div>',
+    '<p>outer <b>bold</b> tail <!-- comment --> end</p>',
+    '<h1>heading <p>nested paragraph</p> rest</h1><h2></h2><p>\n\n\nlines\n\n</p>',
+    '<?xml version="1.0" encoding="utf-8"?><p>declared</p>',
+    '<p>processing <?php echo 1; ?> instruction</p>',
+    '<template><p>template</p></template><ruby>kanji<rp>(</rp><rt>kana</rt><rp>)</rp></ruby>',
+    '<table><tr><td>cell&nbsp;one</td><td>cell &amp; two</td></tr></table>',
+    '<p>unclosed <i>italic<p>next',
+    '<!DOCTYPE html><html><body><noscript><p>noscript</p></noscript><iframe>frame</iframe></body></html>',
+    '<div>\n\n  <span>a</span>\t <span>b</span></div><pre>\n\n  </pre><p>  <textarea>\n </textarea></p>',
+    '<p>empty <!----> comment</p>',
+    '<p>Příliš žluťoučký kůň úpěl ďábelské ódy</p>',
+]
+
+OPTIONS = [
+    dict(keep_paragraphs_only=keep_paragraphs_only, trim_start=trim_start, lowercase=lowercase,
+         merge_whitespaces=merge_whitespaces)
+    for keep_paragraphs_only, trim_start, lowercase, merge_whitespaces
+    in itertools.product([False, True], [None, 0], [False, True], [False, True])
+]
+
+
+class TextExtractionParityTest(unittest.TestCase):
+    """
+    The lxml engine gives the same text as BeautifulSoup
+    """
+
+    def _assert_parity(self, html):
+        for options in OPTIONS:
+            with self.subTest(**options):
+                self.assertEqual(html_to_plaintext(html, engine='lxml', **options),
+                                 html_to_plaintext(html, engine='bs4', **options))
+
+    def test_snippets(self):
+        for html in SNIPPETS:
+            with self.subTest(html=html):
+                self._assert_parity(html)
+
+    def test_pages(self):
+        filenames = sorted(glob.glob(os.path.join(DATA_DIR, '*.html')))
+        self.assertTrue(filenames)
+        for filename in filenames:
+            with open(filename, 'r', encoding='utf-8') as f:
+                html = f.read()
+            with self.subTest(page=os.path.basename(filename)):
+                self._assert_parity(html)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+
+import datasketch
+import numpy as np
+
+from utils.pickle_utils import to_binary_string, from_binary_string
+
+# version of the on-disk format, files of other versions are ignored
+INDEX_FORMAT_VERSION = 1
+
+
+class MinHashIndex:
+    """
+    LSH index of page MinHashes keyed by URL for finding near-duplicate pages under other URLs.
+
+    Candidates from the LSH buckets are ranked by the Jaccard similarity estimated from the kept hash values;
+    the index only proposes pages, callers verify a match against the stored MinHash before using it.
+    """
+
+    def __init__(self, threshold, num_perm=512):
+        """
+        :param threshold: Jaccard similarity the LSH bands are tuned for and the minimum similarity of a match
+        :param num_perm: number of permutations of the indexed MinHashes
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.lsh = datasketch.MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.hashvalues = {}
+
+    def __len__(self):
+        return len(self.hashvalues)
+
+    def __contains__(self, url):
+        return url in self.hashvalues
+
+    def insert(self, url, minhash):
+        """
+        Adds the MinHash of a page, replacing the one indexed for the URL before; a page without a MinHash is only
+        removed
+        """
+        if url in self.hashvalues:
+            self.remove(url)
+        if minhash is None:
+            return
+        minhash = datasketch.LeanMinHash(minhash)
+        self.lsh.insert(url, minhash)
+        self.hashvalues[url] = minhash.hashvalues
+
+    def remove(self, url):
+        if url in self.hashvalues:
+            self.lsh.remove(url)
+            del self.hashvalues[url]
+
+    def query(self, minhash, exclude=None):
+        """
+        Returns (url, estimated Jaccard similarity) of the indexed pages similar to the MinHash above the threshold,
+        most similar first
+        :param exclude: URL left out of the results, usually the URL of the queried page itself
+        """
+        hashvalues = minhash.hashvalues
+        matches = []
+        for url in self.lsh.query(minhash):
+            if url == exclude:
+                continue
+            jaccard = np.count_nonzero(self.hashvalues[url] == hashvalues) / len(hashvalues)
+            if jaccard > self.threshold:
+                matches.append((url, jaccard))
+
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
+
+    @classmethod
+    def build(cls, minhashes, threshold, num_perm=512):
+        """
+        :param minhashes: iterable of (url, MinHash), pages without a MinHash are left out
+        """
+        index = cls(threshold, num_perm)
+        with index.lsh.insertion_session() as session:
+            for url, minhash in minhashes:
+                if minhash is None:
+                    continue
+                minhash = datasketch.LeanMinHash(minhash)
+                session.insert(url, minhash, check_duplication=False)
+                index.hashvalues[url] = minhash.hashvalues
+        return index
+
+    def save(self, path):
+        """
+        Writes the index to the file, atomically so that a concurrent load never reads a partial file
+        """
+        state = {
+            'version': INDEX_FORMAT_VERSION,
+            'threshold': self.threshold,
+            'num_perm': self.num_perm,
+            'lsh': self.lsh,
+            'hashvalues': self.hashvalues,
+        }
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(to_binary_string(state))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, threshold, num_perm=512, urls=None):
+        """
+        Reads an index written by save
+
+        :param urls: URLs the index must hold, e.g. all URLs in the database
+        :return: the index, or None if the file does not exist, was written with other parameters or does not
+        hold exactly the given URLs
+        """
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as f:
+            state = from_binary_string(f.read())
+
+        if state.get('version') != INDEX_FORMAT_VERSION or state['threshold'] != threshold \
+                or state['num_perm'] != num_perm:
+            return None
+        if urls is not None and set(urls) != state['hashvalues'].keys():
+            return None
+
+        index = cls.__new__(cls)
+        index.threshold = threshold
+        index.num_perm = num_perm
+        index.lsh = state['lsh']
+        index.hashvalues = state['hashvalues']
+        return index
+
+    @classmethod
+    def load_or_build(cls, path, threshold, num_perm, urls, minhashes):
+        """
+        Loads the index from the file if it matches the URLs, builds it from the MinHashes otherwise
+
+        :param urls: all URLs to be indexed
+        :param minhashes: function returning an iterable of (url, MinHash) of all pages to be indexed
+        """
+        index = None
+        if path:
+            try:
+                index = cls.load(path, threshold, num_perm, urls)
+            except Exception as e:
+                print(f'Could not load MinHash index {path}: {e}')
+        if index is None:
+            index = cls.build(minhashes(), threshold, num_perm)
+        return index
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+from utils.document_similarity import shingles_to_minhash
+from utils.minhash_index import MinHashIndex
+
+import kshingle
+
+
+def minhash(text):
+    return shingles_to_minhash(kshingle.shingleset_k(text, 5), 128)
+
+
+class MinHashIndexTest(unittest.TestCase):
+    def setUp(self):
+        words = ' '.join(f'slovo{i}' for i in range(400))
+        self.original = minhash(words)
+        self.changed = minhash(words + ' nove')
+        self.other = minhash(' '.join(f'jine{i}' for i in range(400)))
+
+    def test_query(self):
+        index = MinHashIndex(0.9, 128)
+        index.insert('http://a.cz', self.original)
+        index.insert('http://b.cz', self.other)
+
+        matches = index.query(self.changed)
+        self.assertEqual([url for url, _ in matches], ['http://a.cz'])
+        self.assertEqual(index.query(self.original, exclude='http://a.cz'), [])
+
+    def test_insert_replaces_and_remove(self):
+        index = MinHashIndex(0.9, 128)
+        index.insert('http://a.cz', self.original)
+        index.insert('http://a.cz', self.other)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.query(self.original), [])
+
+        index.remove('http://a.cz')
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.query(self.other), [])
+
+    def test_pages_without_minhash_skipped(self):
+        index = MinHashIndex.build([('http://a.cz', self.original), ('http://b.cz', None)], 0.9, 128)
+        self.assertEqual(len(index), 1)
+        index.insert('http://a.cz', None)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.query(self.original), [])
+
+    def test_save_and_load(self):
+        index = MinHashIndex.build([('http://a.cz', self.original), ('http://b.cz', self.other)], 0.9, 128)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.pickle')
+            index.save(path)
+
+            loaded = MinHashIndex.load(path, 0.9, 128, urls=['http://a.cz', 'http://b.cz'])
+            self.assertEqual([url for url, _ in loaded.query(self.changed)], ['http://a.cz'])
+
+            self.assertIsNone(MinHashIndex.load(path, 0.9, 128, urls=['http://a.cz']))
+            self.assertIsNone(MinHashIndex.load(path, 0.8, 128))
+
+
+if __name__ == '__main__':
+    unittest.main()
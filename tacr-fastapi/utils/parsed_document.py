@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from functools import cached_property
+
+import xxhash
+
+from utils.html_utils import parse_html, tree_to_plaintext
+from utils.document_similarity import text_to_minhash
+
+# shingle length and number of permutations of the page MinHash
+SHINGLE_K = 5
+NUM_PERM = 512
+
+# attributes recomputed after unpickling instead of being transferred between processes
+_TRANSIENT = ('tree',)
+
+
+class ParsedDocument:
+    """
+    Page HTML together with everything derived from it - the parsed tree, the plain texts, the content hash and
+    the MinHash.
+
+    The HTML is parsed at most once; each derived attribute is computed on first access and kept.
+    The tree is not pickled, and computed() leaves out the HTML too, so what a worker process sends back carries
+    only the texts and the hashes.
+    """
+
+    def __init__(self, html):
+        self.html = html
+
+    @classmethod
+    def from_texts(cls, text, paragraph_text):
+        """
+        Document of a page whose texts were extracted without keeping the HTML, e.g. by an HtmlStreamParser
+        """
+        document = cls(None)
+        document.text = text
+        document.paragraph_text = paragraph_text
+        return document
+
+    @cached_property
+    def tree(self):
+        return parse_html(self.html)
+
+    @cached_property
+    def text(self):
+        """
+        Plain text with merged whitespaces, the classification input
+        """
+        return tree_to_plaintext(self.tree, lowercase=False)
+
+    @cached_property
+    def normalized_text(self):
+        """
+        Lowercased plain text with merged whitespaces, the MinHash input
+        """
+        return self.text.lower()
+
+    @cached_property
+    def content_hash(self):
+        """
+        xxhash64 of the normalized text, tells an unchanged page without computing the MinHash
+        """
+        return xxhash.xxh64(self.normalized_text).hexdigest()
+
+    @cached_property
+    def paragraph_text(self):
+        """
+        Text of paragraphs and headings, one per line, the rationale extraction input
+        """
+        return tree_to_plaintext(self.tree, keep_paragraphs_only=True, trim_start=0,  # Config.TRIM_LENGTH
+                                 lowercase=False, merge_whitespaces=False)
+
+    @cached_property
+    def minhash(self):
+        return text_to_minhash(self.normalized_text, SHINGLE_K, NUM_PERM)
+
+    def has(self, name):
+        return name in self.__dict__
+
+    def size(self):
+        """
+        Approximate size in bytes of the HTML and the attributes computed so far
+        """
+        size = 0
+        for name in ('html', 'text', 'normalized_text', 'paragraph_text', 'content_hash'):
+            value = self.__dict__.get(name)
+            if value is not None:
+                size += len(value)
+        if self.has('minhash'):
+            size += self.minhash.hashvalues.nbytes
+        return size
+
+    def materialize(self, *names):
+        """
+        Computes the given attributes and returns the document
+        """
+        for name in names:
+            getattr(self, name)
+        return self
+
+    def computed(self, *names):
+        """
+        Computes the given attributes and returns all attributes computed so far except the HTML, for update() of
+        the caller's copy of the document; meant to be run in a worker process
+        """
+        state = self.materialize(*names).__getstate__()
+        state.pop('html', None)
+        return state
+
+    def update(self, state):
+        """
+        Takes over the attributes computed from another copy of the document, see computed()
+        """
+        self.__dict__.update(state)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in _TRANSIENT:
+            state.pop(name, None)
+        return state
+
+
+def computed_all(documents, *names):
+    """
+    Computes the given attributes of several documents in one worker process task
+    :return: the computed() state of each document
+    """
+    return [document.computed(*names) for document in documents]
+
+
+class DocumentCache:
+    """
+    Bounded LRU cache of parsed documents keyed by URL and a hash of the HTML, so that requests
+    for the same page reuse each other's parsing, sized by entries and by the approximate bytes of the documents
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        """
+        :param max_entries: maximum number of cached documents
+        :param max_bytes: maximum total ParsedDocument.size of the cached documents, as of their last put
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.documents = OrderedDict()
+        self.size = 0
+
+    @staticmethod
+    def key(url, html):
+        """
+        The URL and a hash of the HTML, identifying one version of a page
+        """
+        return url, xxhash.xxh64(html).intdigest()
+
+    def get(self, url, html) -> ParsedDocument:
+        """
+        Returns the cached document for the URL and HTML, or a new unparsed one
+        """
+        key = self.key(url, html)
+        entry = self.documents.get(key)
+        if entry is None:
+            document = ParsedDocument(html)
+            self.put(url, document)
+            return document
+        self.documents.move_to_end(key)
+        return entry[0]
+
+    def put(self, url, document: ParsedDocument):
+        """
+        Caches the document, or updates its size after more of its attributes were computed
+        """
+        key = self.key(url, document.html)
+        self._remove(key)
+        size = document.size()
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        self.documents[key] = (document, size)
+        self.size += size
+        while len(self.documents) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self.documents)))
+
+    def _remove(self, key):
+        entry = self.documents.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
@@ -0,0 +1,47 @@
+import pickle
+import unittest
+
+from utils.parsed_document import DocumentCache, ParsedDocument
+
+HTML = '<html><body><h1>Zásady</h1><p>Zpracováváme osobní údaje.</p><script>x()</script></body></html>'
+
+
+class ParsedDocumentTest(unittest.TestCase):
+    def test_computed_state_without_html(self):
+        worker_copy = pickle.loads(pickle.dumps(ParsedDocument(HTML)))
+        state = pickle.loads(pickle.dumps(worker_copy.computed('content_hash', 'paragraph_text')))
+        self.assertNotIn('html', state)
+        self.assertNotIn('tree', state)
+
+        document = ParsedDocument(HTML)
+        document.update(state)
+        self.assertEqual(document.html, HTML)
+        self.assertTrue(document.has('text') and document.has('content_hash'))
+        self.assertEqual(document.paragraph_text, ParsedDocument(HTML).paragraph_text)
+        self.assertFalse(document.has('tree'))
+
+
+class DocumentCacheTest(unittest.TestCase):
+    def test_bounded_by_bytes(self):
+        cache = DocumentCache(10, 2 * len(HTML) + 10)
+        first = cache.get('http://a.cz', HTML)
+        self.assertIs(cache.get('http://a.cz', HTML), first)
+        cache.get('http://b.cz', HTML)
+        cache.get('http://c.cz', HTML)
+        self.assertEqual(len(cache.documents), 2)
+        self.assertIsNot(cache.get('http://a.cz', HTML), first)
+
+        # computed texts count once the document is put again
+        document = cache.get('http://d.cz', HTML).materialize('text')
+        cache.put('http://d.cz', document)
+        self.assertEqual(len(cache.documents), 1)
+        self.assertEqual(cache.size, document.size())
+
+    def test_document_over_limit_not_cached(self):
+        cache = DocumentCache(10, len(HTML) - 1)
+        cache.get('http://a.cz', HTML)
+        self.assertEqual((len(cache.documents), cache.size), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()